@@ -1,2 +1,4 @@
 __version_info__ = (0, 1, 0)
 __version__ = '.'.join([str(v) for v in __version_info__])
+
+default_app_config = 'deflect.apps.DeflectConfig'
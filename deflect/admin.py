@@ -1,16 +1,40 @@
+from datetime import timedelta
 import re
+import tempfile
 
 from django import forms
 from django.conf import settings
 from django.contrib import admin
+from django.contrib.sites.shortcuts import get_current_site
+from django.db import transaction
+from django.db.models import CharField
+from django.db.models import Value
+from django.http import FileResponse
+from django.http import StreamingHttpResponse
+from django.utils.html import format_html
+from django.utils.html import format_html_join
+from django.utils.timezone import is_aware
+from django.utils.timezone import localtime
+from django.utils.timezone import now
 
-import requests
-
+from .cache import suggestion_cache
+from .checker import record_target_status
+from .checker import validate_target
+from .exports import get_export_rows
+from .exports import stream_csv
+from .exports import stream_json
+from .exports import write_qr_codes
+from .models import DailyClickRollup
 from .models import ShortURL
 from .models import ShortURLAlias
+from .models import ShortURLStatus
+from .tasks import BackgroundWorker
 from .widgets import DatalistTextInput
 
 
+validation_worker = BackgroundWorker('deflect-validation')
+
+
 class ShortURLAliasAdminForm(forms.ModelForm):
     def clean_alias(self):
         """
@@ -30,50 +54,43 @@ class ShortURLAliasInline(admin.StackedInline):
 class ShortURLAdminForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super(ShortURLAdminForm, self).__init__(*args, **kwargs)
-        self.fields['campaign'].widget = DatalistTextInput(choices=ShortURL.objects.get_unique_list('campaign'))
-        self.fields['medium'].widget = DatalistTextInput(choices=ShortURL.objects.get_unique_list('medium'))
+        for field in ShortURL.suggestion_fields:
+            self.fields[field].widget = DatalistTextInput(choices=suggestion_cache.get(field))
 
     def clean_long_url(self):
         """
-        Validate connectivity to the provided target URL.
+        Validate connectivity to the provided target URL. When
+        ``DEFLECT_VALIDATE_IN_BACKGROUND`` is enabled, the target is
+        validated after the ``ShortURL`` is saved instead.
         """
         url = self.cleaned_data.get('long_url')
-        headers = getattr(settings, 'DEFLECT_REQUESTS_HEADERS', None)
-        timeout = getattr(settings, 'DEFLECT_REQUESTS_TIMEOUT', 3.0)
-        try:
-            r = requests.get(url, headers=headers, timeout=timeout,
-                             allow_redirects=True)
-        except requests.exceptions.ConnectionError:
-            raise forms.ValidationError("Error connecting to URL")
-        except requests.exceptions.SSLError:
-            raise forms.ValidationError("Invalid SSL certificate")
-        except requests.exceptions.Timeout:
-            raise forms.ValidationError("Timeout connecting to URL")
-
-        try:
-            r.raise_for_status()
-        except requests.exceptions.HTTPError:
-            raise forms.ValidationError("Invalid status returned (%d)" % r.status_code)
-
-        return r.url
+        if getattr(settings, 'DEFLECT_VALIDATE_IN_BACKGROUND', False):
+            return url
+        final_url, error = validate_target(url)
+        if error:
+            raise forms.ValidationError(error)
+        return final_url
 
 
 class ShortURLAdmin(admin.ModelAdmin):
+    actions = ['export_csv', 'export_json', 'export_qr_codes']
     form = ShortURLAdminForm
     inlines = [ShortURLAliasInline]
-    list_display = ('long_url', 'short_url', 'created', 'hits', 'last_used', 'campaign', 'medium')
+    list_display = ('long_url', 'short_url', 'created', 'get_hits', 'get_last_used', 'campaign', 'medium')
     _list_display = list_display
     list_filter = ('campaign', 'medium')
     _list_filter = list_filter
     ordering = ['-created']
-    readonly_fields = ('created', 'short_url', 'target_url', 'qr_code', 'hits', 'last_used')
+    readonly_fields = ('created', 'short_url', 'target_url', 'target_status', 'qr_code', 'get_hits',
+                       'get_last_used', 'click_history')
     search_fields = ['long_url', 'campaign', 'shorturlalias__alias']
 
     _change_fieldsets = (
-        (None, {'fields': ('long_url', 'short_url', 'target_url')}),
+        (None, {'fields': ('long_url', 'short_url', 'target_url', 'target_status')}),
         ('Tracking', {'fields': ('is_tracking', 'campaign', 'medium', 'content')}),
         ('Additional Info', {'fields': ('description', 'qr_code')}),
-        ('Short URL Usage', {'classes': ('collapse',), 'fields': ('hits', 'created', 'last_used')})
+        ('Short URL Usage', {'classes': ('collapse',),
+                             'fields': ('get_hits', 'created', 'get_last_used', 'click_history')})
     )
 
     _add_fieldsets = (
@@ -82,6 +99,78 @@ class ShortURLAdmin(admin.ModelAdmin):
         ('Additional Info', {'fields': ('description',)})
     )
 
+    click_history_days = 30
+
+    def click_history(self, obj):
+        """
+        Display the daily clicks for the recent past as a bar chart,
+        drawn from the daily click rollups.
+        """
+        current = now()
+        today = (localtime(current) if is_aware(current) else current).date()
+        start = today - timedelta(days=self.click_history_days - 1)
+        clicks = dict(DailyClickRollup.objects.filter(redirect=obj, date__gte=start)
+                                              .values_list('date', 'clicks'))
+        if not clicks:
+            return 'No clicks recorded'
+        peak = max(clicks.values())
+        dates = [start + timedelta(days=i) for i in range(self.click_history_days)]
+        bars = format_html_join(
+            '', '<rect x="{0}" y="{1}" width="5" height="{2}" fill="#79aec8"><title>{3}: {4}</title></rect>',
+            ((i * 6, 40 - clicks.get(d, 0) * 40 // peak, clicks.get(d, 0) * 40 // peak, d, clicks.get(d, 0))
+             for i, d in enumerate(dates))
+        )
+        return format_html('<svg width="{0}" height="40">{1}</svg>', self.click_history_days * 6, bars)
+    click_history.short_description = 'daily clicks'
+
+    def target_status(self, obj):
+        """
+        Display the result of the most recent check of the target URL.
+        """
+        try:
+            status = obj.status
+        except ShortURLStatus.DoesNotExist:
+            return 'Not checked'
+        if status.error:
+            return 'Failed: %s' % status.error
+        return 'OK (%s)' % status.status_code
+    target_status.short_description = 'target status'
+
+    def export_csv(self, request, queryset):
+        """
+        Download the selected ``ShortURL``s and their statistics as a
+        CSV file, streamed as the rows are loaded.
+        """
+        response = StreamingHttpResponse(stream_csv(get_export_rows(queryset)), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="shorturls.csv"'
+        return response
+    export_csv.short_description = 'Export selected short URLs as CSV'
+
+    def export_json(self, request, queryset):
+        """
+        Download the selected ``ShortURL``s and their statistics as
+        JSON lines, streamed as the rows are loaded.
+        """
+        response = StreamingHttpResponse(stream_json(get_export_rows(queryset)),
+                                         content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="shorturls.jsonl"'
+        return response
+    export_json.short_description = 'Export selected short URLs as JSON'
+
+    def export_qr_codes(self, request, queryset):
+        """
+        Download a ZIP archive of QR code images for the selected
+        ``ShortURL``s. The archive is written to a temporary file, so
+        the images are not all held in memory.
+        """
+        archive = tempfile.TemporaryFile()
+        write_qr_codes(archive, queryset)
+        archive.seek(0)
+        response = FileResponse(archive, content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="qrcodes.zip"'
+        return response
+    export_qr_codes.short_description = 'Export QR codes for selected short URLs'
+
     def get_readonly_fields(self, request, obj=None):
         """
         If a ``ShortURL`` has already been created, then display the
@@ -122,7 +211,7 @@ class ShortURLAdmin(admin.ModelAdmin):
         has_perm = super(ShortURLAdmin, self).has_change_permission(request, obj)
         if not has_perm:
             return False
-        if obj is not None and not request.user.has_perm('deflect.list_all') and request.user.id != obj.creator.id:
+        if obj is not None and not request.user.has_perm('deflect.list_all') and request.user.id != obj.creator_id:
             return False
         return True
 
@@ -134,16 +223,26 @@ class ShortURLAdmin(admin.ModelAdmin):
         has_perm = super(ShortURLAdmin, self).has_delete_permission(request, obj)
         if not has_perm:
             return False
-        if obj is not None and not request.user.has_perm('deflect.list_all') and request.user.id != obj.creator.id:
+        if obj is not None and not request.user.has_perm('deflect.list_all') and request.user.id != obj.creator_id:
             return False
         return True
 
-    def queryset(self, request):
+    def get_queryset(self, request):
         """
         Users should only be able to view their own ``ShortURL``s,
         except for privileged users.
+
+        The alias and creator are loaded with each ``ShortURL`` and the
+        site domain is resolved once per request, so the changelist
+        does not query for them on every row. When hit shards are
+        enabled, include the shard totals so the aggregated hits can
+        be displayed without additional queries.
         """
-        qs = super(ShortURLAdmin, self).queryset(request)
+        qs = super(ShortURLAdmin, self).get_queryset(request)
+        qs = qs.select_related('shorturlalias', 'creator')
+        qs = qs.annotate(site_domain=Value(get_current_site(request).domain, output_field=CharField()))
+        if getattr(settings, 'DEFLECT_HIT_SHARDS', 0):
+            qs = qs.with_shard_hits()
         if request.user.has_perm('deflect.list_all'):
             return qs
         return qs.filter(creator=request.user)
@@ -151,11 +250,17 @@ class ShortURLAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         """
         On first save, set the ``ShortURL`` creator to the current
-        user. On subsequent saves, skip this step.
+        user. On subsequent saves, skip this step. If the target is
+        validated in the background, queue the validation.
         """
         if not change:
             obj.creator = request.user
         obj.save()
+        if getattr(settings, 'DEFLECT_VALIDATE_IN_BACKGROUND', False) and 'long_url' in form.changed_data:
+            # The worker uses its own connection, so it can only see
+            # the ``ShortURL`` once the admin's transaction commits
+            pk, long_url = obj.pk, obj.long_url
+            transaction.on_commit(lambda: validation_worker.submit(record_target_status, pk, long_url))
 
 
 admin.site.register(ShortURL, ShortURLAdmin)
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+
+
+class DeflectConfig(AppConfig):
+    name = 'deflect'
+    verbose_name = 'Deflect'
+
+    def ready(self):
+        from . import signals
+
+        if getattr(settings, 'DEFLECT_WARMUP_SIZE', 0):
+            request_started.connect(signals.warm_redirect_cache, dispatch_uid='deflect.warm_redirect_cache')
@@ -0,0 +1,182 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import json
+import timeit
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+import base32_crockford
+
+from . import views
+from .models import ShortURL
+from .models import ShortURLAlias
+from .utils import add_query_params
+from .utils import get_qr_code_img
+
+
+benchmarks = OrderedDict()
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function is called with the
+    fixtures from ``create_fixtures`` and returns the callable to time.
+    """
+    def decorator(func):
+        benchmarks[name] = func
+        return func
+    return decorator
+
+
+def create_fixtures():
+    """
+    Create the ``ShortURL``s used by the benchmarks. Return a dict of
+    the fixtures.
+    """
+    user = get_user_model().objects.create_user('deflect-benchmark')
+    tracking = ShortURL.objects.create(long_url='http://www.example.com/path?q=1', creator=user,
+                                       campaign='Benchmark', medium='email', content='header')
+    plain = ShortURL.objects.create(long_url='http://www.example.com/path?q=1', creator=user,
+                                    is_tracking=False)
+    ShortURLAlias.objects.create(redirect=tracking, alias='benchmark')
+    return {
+        'tracking': tracking,
+        'plain': plain,
+        'factory': RequestFactory(),
+    }
+
+
+@benchmark('decode_key')
+def bench_decode_key(fixtures):
+    key = fixtures['tracking'].key
+    return lambda: base32_crockford.decode(key)
+
+
+@benchmark('redirect_key')
+def bench_redirect_key(fixtures):
+    key = fixtures['tracking'].key
+    request = fixtures['factory'].get('/' + key)
+    return lambda: views.redirect(request, key)
+
+
+@benchmark('redirect_alias')
+def bench_redirect_alias(fixtures):
+    request = fixtures['factory'].get('/benchmark')
+    return lambda: views.redirect(request, 'benchmark')
+
+
+@benchmark('redirect_plain')
+def bench_redirect_plain(fixtures):
+    key = fixtures['plain'].key
+    request = fixtures['factory'].get('/' + key)
+    return lambda: views.redirect(request, key)
+
+
+@benchmark('redirect_params')
+def bench_redirect_params(fixtures):
+    key = fixtures['tracking'].key
+    request = fixtures['factory'].get('/' + key, {'ref': 'benchmark', 'utm_source': 'override'})
+    return lambda: views.redirect(request, key)
+
+
+@benchmark('target_url')
+def bench_target_url(fixtures):
+    shorturl = fixtures['tracking']
+    return lambda: shorturl.target_url()
+
+
+@benchmark('target_url_params')
+def bench_target_url_params(fixtures):
+    shorturl = fixtures['tracking']
+    params = {'ref': 'benchmark', 'utm_source': 'override'}
+    return lambda: shorturl.target_url(params)
+
+
+@benchmark('target_url_plain')
+def bench_target_url_plain(fixtures):
+    shorturl = fixtures['plain']
+    return lambda: shorturl.target_url()
+
+
+@benchmark('add_query_params')
+def bench_add_query_params(fixtures):
+    url = fixtures['tracking'].long_url
+    params = {'ref': 'benchmark', 'utm_source': 'override'}
+    return lambda: add_query_params(url, params)
+
+
+@benchmark('qr_code_img')
+def bench_qr_code_img(fixtures):
+    url = fixtures['tracking'].short_url()
+    return lambda: get_qr_code_img(url)
+
+
+def run_benchmark(func, number=None, repeat=5, min_time=0.2):
+    """
+    Time a callable, returning a dict of the best time per call in
+    seconds over ``repeat`` runs of ``number`` calls, and the number
+    of queries per call. If ``number`` is not given, it is chosen so
+    each run takes at least ``min_time`` seconds.
+    """
+    # Warm up any caches before counting queries
+    func()
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    timer = timeit.Timer(func)
+    if number is None:
+        number = 1
+        while timer.timeit(number) < min_time:
+            number *= 10
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return {
+        'time': best / number,
+        'queries': len(queries),
+    }
+
+
+def run_benchmarks(names=None, **kwargs):
+    """
+    Run the registered benchmarks, or only those in ``names``, against
+    newly created fixtures. Return an ordered dict of the results by
+    benchmark name.
+    """
+    fixtures = create_fixtures()
+    results = OrderedDict()
+    for name, setup in benchmarks.items():
+        if names and name not in names:
+            continue
+        results[name] = run_benchmark(setup(fixtures), **kwargs)
+    return results
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(results, baseline, threshold=0.2):
+    """
+    Compare results against a saved baseline. Return a list of
+    ``(name, message)`` tuples for each benchmark that is more than
+    ``threshold`` slower than the baseline, or runs more queries.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['queries'] > base['queries']:
+            regressions.append((name, "%d queries per call, was %d" % (result['queries'], base['queries'])))
+        if result['time'] > base['time'] * (1 + threshold):
+            regressions.append((name, "%.1f%% slower than the baseline" %
+                                ((result['time'] / base['time'] - 1) * 100)))
+    return regressions
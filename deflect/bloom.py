@@ -0,0 +1,261 @@
+from __future__ import unicode_literals
+
+import hashlib
+import math
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+import base32_crockford
+
+from .cache import LRUCache
+from .tasks import BackgroundWorker
+
+
+rebuild_worker = BackgroundWorker('deflect-bloom')
+
+
+class BloomFilter(object):
+    """
+    A compact, probabilistic set of strings. Membership tests can
+    return false positives at roughly ``error_rate`` once
+    ``capacity`` items are added, but never return false negatives.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(float(self.size) / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.md5(item.encode('utf-8')).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RedirectFilter(object):
+    """
+    Identify short URL keys and aliases that definitely do not exist
+    without querying the database. A ``BloomFilter`` holds every key
+    and alias, and a short-lived negative cache holds recent misses.
+
+    The filter requires ``DEFLECT_CACHE_BACKEND``, which shares a
+    generation counter between processes. New keys and aliases saved
+    in this process are added to the filter as they are saved. When
+    another process saves one, lookups fall back to the database until
+    the filter is rebuilt. Keys above the largest id in the filter are
+    never rejected, as they may have been saved while it was built.
+
+    The filter is rebuilt on a background thread every
+    ``DEFLECT_BLOOM_TIMEOUT`` seconds and when the generation changes,
+    and the previous filter is used until the rebuild finishes.
+    """
+    generation_key = 'deflect:bloom:generation'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Discard the filter and negative cache, and reload the
+        configuration on next use.
+        """
+        # The filter, the largest id it holds, the generation it was
+        # built at and the build time are replaced together, so a
+        # lookup never mixes the state of two builds
+        self._state = None
+        self._rebuilding = False
+        self._negative = None
+        self._configured = False
+        self.rejected = 0
+        self.negative_hits = 0
+
+    def _configure(self):
+        self.enabled = getattr(settings, 'DEFLECT_BLOOM_FILTER', False)
+        self.error_rate = getattr(settings, 'DEFLECT_BLOOM_ERROR_RATE', 0.001)
+        self.timeout = getattr(settings, 'DEFLECT_BLOOM_TIMEOUT', 300)
+        negative_timeout = getattr(settings, 'DEFLECT_NEGATIVE_CACHE_TIMEOUT', 0)
+        negative_size = getattr(settings, 'DEFLECT_NEGATIVE_CACHE_SIZE', 10000)
+        if negative_timeout:
+            self._negative = LRUCache(max_size=negative_size, timeout=negative_timeout)
+        backend = getattr(settings, 'DEFLECT_CACHE_BACKEND', None)
+        if self.enabled and not backend:
+            raise ImproperlyConfigured("DEFLECT_BLOOM_FILTER requires DEFLECT_CACHE_BACKEND, so other "
+                                       "processes see new keys and aliases")
+        self._backend = caches[backend] if backend else None
+        self._configured = True
+
+    def _shared_generation(self):
+        if self._backend is None:
+            return None
+        return self._backend.get(self.generation_key, 0)
+
+    def build(self):
+        """
+        Build the filter from every ``ShortURL`` key and alias in the
+        database.
+        """
+        from .models import ShortURL
+        from .models import ShortURLAlias
+
+        if not self._configured:
+            self._configure()
+        generation = self._shared_generation()
+        ids = ShortURL.objects.values_list('pk', flat=True)
+        aliases = ShortURLAlias.objects.values_list('alias', flat=True)
+        # Leave room for entries added between rebuilds
+        capacity = int((ids.count() + aliases.count()) * 1.5) + 1000
+        bloom = BloomFilter(capacity, error_rate=self.error_rate)
+        max_id = 0
+        for id in ids.iterator():
+            bloom.add('k:%d' % id)
+            max_id = max(max_id, id)
+        for alias in aliases.iterator():
+            bloom.add('a:%s' % alias)
+        self._state = (bloom, max_id, generation, time.time())
+
+    def _rebuild(self):
+        try:
+            self.build()
+        finally:
+            self._rebuilding = False
+
+    def _schedule_rebuild(self):
+        """
+        Rebuild the filter on a background thread, unless a rebuild
+        is already scheduled.
+        """
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        rebuild_worker.submit(self._rebuild)
+
+    def is_missing(self, key):
+        """
+        Return ``True`` if the given key or alias definitely does not
+        exist. A ``False`` result means it may exist.
+        """
+        if not self._configured:
+            self._configure()
+        key = key.lower()
+        if self._negative is not None and self._negative.get(key):
+            self.negative_hits += 1
+            return True
+        if not self.enabled:
+            return False
+
+        state = self._state
+        if state is None or state[3] + self.timeout <= time.time():
+            self._schedule_rebuild()
+        if state is None or self._contains(state, key):
+            return False
+        # Another process has added entries that may be missing from
+        # the filter, so use the database until it is rebuilt
+        if self._shared_generation() != state[2]:
+            self._schedule_rebuild()
+            return False
+        self.rejected += 1
+        return True
+
+    def _contains(self, state, key):
+        bloom, max_id = state[:2]
+        if 'a:' + key in bloom:
+            return True
+        try:
+            id = base32_crockford.decode(key)
+        except ValueError:
+            return False
+        return id > max_id or 'k:%d' % id in bloom
+
+    def add_miss(self, key):
+        """
+        Record a key or alias that does not exist in the negative
+        cache.
+        """
+        if not self._configured:
+            self._configure()
+        if self._negative is None:
+            return
+        key = key.lower()
+        state = self._state
+        if state is not None:
+            # A key above the largest id in the filter may have been
+            # saved by another process, which can only remove it from
+            # its own negative cache
+            try:
+                if base32_crockford.decode(key) > state[1]:
+                    return
+            except ValueError:
+                pass
+        self._negative.set(key, True)
+
+    def add(self, id=None, alias=None):
+        """
+        Add a newly saved ``ShortURL`` id or alias to the filter and
+        remove it from the negative cache. Other processes are
+        notified through the shared generation counter when the
+        transaction commits.
+        """
+        if not self._configured:
+            self._configure()
+        if self._negative is not None:
+            if id is not None:
+                self._negative.delete(base32_crockford.encode(id).lower())
+            if alias:
+                self._negative.delete(alias.lower())
+        if not self.enabled:
+            return
+        state = self._state
+        if state is not None:
+            if id is not None:
+                state[0].add('k:%d' % id)
+            if alias:
+                state[0].add('a:%s' % alias.lower())
+        if self._backend is not None:
+            # Other processes are only notified once the change is
+            # committed, so a rebuild triggered by it includes it
+            transaction.on_commit(self._increment_generation)
+
+    def _increment_generation(self):
+        self._backend.add(self.generation_key, 0, None)
+        generation = self._backend.incr(self.generation_key)
+        # Skip the rebuild for our own change, unless another process
+        # also changed the data
+        state = self._state
+        if state is not None and generation == state[2] + 1:
+            self._state = state[:2] + (generation,) + state[3:]
+
+    def stats(self):
+        """
+        Return the number of lookups that were rejected without
+        querying the database.
+        """
+        return {
+            'bloom_rejections': self.rejected,
+            'negative_cache_hits': self.negative_hits,
+        }
+
+
+redirect_filter = RedirectFilter()
+
+
+@receiver(setting_changed)
+def reset_redirect_filter(**kwargs):
+    if kwargs['setting'].startswith(('DEFLECT_BLOOM_', 'DEFLECT_NEGATIVE_CACHE_', 'DEFLECT_CACHE_BACKEND')):
+        redirect_filter.reset()
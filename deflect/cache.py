@@ -0,0 +1,256 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from datetime import timedelta
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+
+class LRUCache(object):
+    """
+    A thread-safe, in-process least recently used cache. Entries
+    expire after ``timeout`` seconds, and the least recently used
+    entry is evicted once ``max_size`` entries are stored.
+    """
+    def __init__(self, max_size=1024, timeout=300):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.time():
+                return default
+            # Re-insert the entry to mark it as most recently used
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value):
+        expires = time.time() + self.timeout if self.timeout else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedirectCache(object):
+    """
+    Cache the data required to build a redirect, keyed by the
+    lowercase short URL key or alias. Lookups check an in-process
+    ``LRUCache`` first, then fall back to an optional Django cache
+    backend shared between processes.
+    """
+    key_prefix = 'deflect:redirect:'
+
+    def __init__(self):
+        self._local = None
+        self._backend = None
+        self._configured = False
+
+    def _configure(self):
+        size = getattr(settings, 'DEFLECT_CACHE_SIZE', 0)
+        timeout = getattr(settings, 'DEFLECT_CACHE_TIMEOUT', 300)
+        backend = getattr(settings, 'DEFLECT_CACHE_BACKEND', None)
+        self.timeout = timeout
+        self._local = LRUCache(max_size=size, timeout=timeout) if size else None
+        self._backend = caches[backend] if backend else None
+        self._configured = True
+
+    def reset(self):
+        """
+        Discard all locally cached entries and reload the cache
+        configuration on next use.
+        """
+        self._local = None
+        self._backend = None
+        self._configured = False
+
+    @property
+    def enabled(self):
+        if not self._configured:
+            self._configure()
+        return self._local is not None or self._backend is not None
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        key = key.lower()
+        if self._local is not None:
+            value = self._local.get(key)
+            if value is not None:
+                return value
+        if self._backend is not None:
+            value = self._backend.get(self.key_prefix + key)
+            if value is not None and self._local is not None:
+                self._local.set(key, value)
+            return value
+        return None
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        key = key.lower()
+        if self._local is not None:
+            self._local.set(key, value)
+        if self._backend is not None:
+            self._backend.set(self.key_prefix + key, value, self.timeout)
+
+    def delete(self, *keys):
+        if not self.enabled:
+            return
+        keys = [k.lower() for k in keys if k]
+        if self._local is not None:
+            for key in keys:
+                self._local.delete(key)
+        if self._backend is not None:
+            self._backend.delete_many([self.key_prefix + k for k in keys])
+
+    def warm(self, limit, max_age=None, force=False):
+        """
+        Load the redirect data for the ``limit`` most used ``ShortURL``s
+        and their aliases. If ``max_age`` is given, only ``ShortURL``s
+        used in the last ``max_age`` seconds are loaded. Keys that are
+        also the alias of another ``ShortURL`` are skipped.
+
+        With a shared cache backend, only the first process on each
+        host to warm the cache queries the database, and the others
+        read the entries from the backend as they are requested. This
+        is skipped until the cache timeout has passed, unless ``force``
+        is set. Return the number of ``ShortURL``s loaded, or ``None``
+        if the cache was warmed by another process.
+        """
+        from .models import ShortURL
+        from .models import ShortURLAlias
+
+        if not self.enabled or not limit:
+            return 0
+        if self._backend is not None and not force:
+            lock_key = '%swarm:%s' % (self.key_prefix, socket.gethostname())
+            if not self._backend.add(lock_key, 1, self.timeout):
+                return None
+
+        qs = ShortURL.objects.select_related('shorturlalias')
+        if max_age is not None:
+            qs = qs.filter(last_used__gte=now() - timedelta(seconds=max_age))
+        shorturls = list(qs.order_by('-hits', '-last_used')[:limit])
+        entries = {}
+        aliases = {}
+        for shorturl in shorturls:
+            data = shorturl.get_redirect_data()
+            entries[shorturl.key.lower()] = data
+            alias = getattr(shorturl, 'shorturlalias', None)
+            if alias is not None:
+                aliases[alias.alias] = data
+        # An alias takes precedence over a key with the same value,
+        # including the aliases of ``ShortURL``s that are not loaded
+        shadowed = ShortURLAlias.objects.filter(alias__in=[key for key in entries if key not in aliases])
+        for alias in shadowed.values_list('alias', flat=True):
+            del entries[alias]
+        entries.update(aliases)
+
+        if self._local is not None:
+            for key, data in entries.items():
+                self._local.set(key, data)
+        if self._backend is not None:
+            self._backend.set_many(dict((self.key_prefix + key, data) for key, data in entries.items()),
+                                   self.timeout)
+        return len(shorturls)
+
+
+class SuggestionCache(object):
+    """
+    Cache the suggested values for a ``ShortURL`` field, such as the
+    campaign or medium, ordered by most recent use. Values are loaded
+    from the database once, then kept up to date as ``ShortURL``s are
+    saved and deleted in this process. Only the ``DEFLECT_SUGGESTIONS_SIZE``
+    most recently used values are kept, and the values are reloaded
+    every ``DEFLECT_SUGGESTIONS_TIMEOUT`` seconds to pick up changes
+    made by other processes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Discard all cached values, and reload them on next use.
+        """
+        self._values = {}
+        self._loaded = {}
+
+    def get(self, field):
+        """
+        Return the suggested values for a field, most recently used
+        first.
+        """
+        from .models import ShortURL
+
+        size = getattr(settings, 'DEFLECT_SUGGESTIONS_SIZE', 100)
+        timeout = getattr(settings, 'DEFLECT_SUGGESTIONS_TIMEOUT', 300)
+        with self._lock:
+            loaded = self._loaded.get(field)
+            if loaded is None or (timeout and loaded + timeout <= time.time()):
+                values = ShortURL.objects.get_unique_list(field, limit=size)
+                # Values are stored least recently used first
+                self._values[field] = OrderedDict((value, True) for value in reversed(values))
+                self._loaded[field] = time.time()
+            return list(reversed(self._values[field]))
+
+    def add(self, field, value):
+        """
+        Mark a value as the most recently used for a field.
+        """
+        size = getattr(settings, 'DEFLECT_SUGGESTIONS_SIZE', 100)
+        with self._lock:
+            values = self._values.get(field)
+            if values is None or not value:
+                return
+            values.pop(value, None)
+            values[value] = True
+            while len(values) > size:
+                values.popitem(last=False)
+
+    def remove(self, field, value):
+        """
+        Remove a value that is no longer used from a field.
+        """
+        with self._lock:
+            values = self._values.get(field)
+            if values is not None:
+                values.pop(value, None)
+
+
+redirect_cache = RedirectCache()
+suggestion_cache = SuggestionCache()
+
+
+@receiver(setting_changed)
+def reset_redirect_cache(**kwargs):
+    if kwargs['setting'].startswith('DEFLECT_CACHE_'):
+        redirect_cache.reset()
+    if kwargs['setting'].startswith('DEFLECT_SUGGESTIONS_'):
+        suggestion_cache.reset()
@@ -0,0 +1,226 @@
+from __future__ import unicode_literals
+
+from operator import attrgetter
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import six
+from django.utils.six.moves import queue
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .cache import LRUCache
+from .compat import urlparse
+from .compat import urlunparse
+from .utils import normalize_url
+
+
+class URLChecker(object):
+    """
+    Validate target URLs concurrently using a pool of threads that
+    share a ``requests`` session, so connections to each host are
+    pooled and reused. A HEAD request is tried first, falling back to
+    a GET request for servers that do not handle HEAD correctly. The
+    number of simultaneous requests to a single host is limited, so
+    a large batch of URLs for one site does not overload it.
+    """
+    def __init__(self, concurrency=None, host_concurrency=None, timeout=None, headers=None):
+        self.concurrency = concurrency or getattr(settings, 'DEFLECT_ASYNC_CONCURRENCY', None) or 10
+        self.host_concurrency = host_concurrency or getattr(settings, 'DEFLECT_HOST_CONCURRENCY', 2)
+        self.timeout = timeout or getattr(settings, 'DEFLECT_REQUESTS_TIMEOUT', 3.0)
+        self.session = requests.Session()
+        self.session.headers.update(headers or getattr(settings, 'DEFLECT_REQUESTS_HEADERS', None) or {})
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.host_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.host_concurrency)
+            return self._host_semaphores[host]
+
+    def check(self, url):
+        """
+        Validate a URL, checking for connection errors or invalid
+        HTTP status codes. Return the final response after following
+        redirects, or raise a ``requests.exceptions.RequestException``.
+        """
+        with self._host_semaphore(url):
+            r = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+            if r.status_code >= 400:
+                # Some servers reject or mishandle HEAD requests, so
+                # confirm the error with a GET request
+                r = self.session.get(url, timeout=self.timeout, allow_redirects=True, stream=True)
+                r.close()
+        r.raise_for_status()
+        return r
+
+    def check_many(self, items, get_url=None):
+        """
+        Validate the URLs for an iterable of items concurrently. The
+        URL is retrieved from each item with ``get_url``, defaulting
+        to the ``long_url`` attribute. Yield an ``(item, response,
+        error, latency)`` tuple as each check completes, where latency
+        is the duration of the check in seconds. Items are consumed
+        from the iterable as workers become available, so it can be
+        arbitrarily large.
+        """
+        get_url = get_url or attrgetter('long_url')
+        tasks = queue.Queue()
+        results = queue.Queue()
+
+        def work():
+            while True:
+                item = tasks.get()
+                if item is None:
+                    break
+                start = time.time()
+                try:
+                    response = self.check(get_url(item))
+                except Exception as e:
+                    results.put((item, None, e, time.time() - start))
+                else:
+                    results.put((item, response, None, time.time() - start))
+
+        workers = [threading.Thread(target=work, name='deflect-checker-%d' % i) for i in range(self.concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        pending = 0
+        try:
+            for item in items:
+                tasks.put(item)
+                pending += 1
+                # Keep a bounded number of items queued for the workers
+                while pending >= self.concurrency * 2:
+                    yield results.get()
+                    pending -= 1
+            while pending:
+                yield results.get()
+                pending -= 1
+        finally:
+            for worker in workers:
+                tasks.put(None)
+
+
+def get_result(response, error, latency):
+    """
+    Summarize a check from ``URLChecker.check_many`` as a dict of
+    the status code, error message, final URL and latency.
+    """
+    if response is None:
+        response = getattr(error, 'response', None)
+    return {
+        'status_code': response.status_code if response is not None else None,
+        'error': six.text_type(error) if error is not None else '',
+        'final_url': response.url if response is not None else '',
+        'latency': latency,
+    }
+
+
+def get_error_message(error):
+    """
+    Return a short description of an error raised when checking a
+    target URL.
+    """
+    if isinstance(error, requests.exceptions.SSLError):
+        return "Invalid SSL certificate"
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return "Error connecting to URL"
+    if isinstance(error, requests.exceptions.Timeout):
+        return "Timeout connecting to URL"
+    if isinstance(error, requests.exceptions.HTTPError):
+        return "Invalid status returned (%d)" % error.response.status_code
+    return "Error connecting to URL"
+
+
+def validate_target(url):
+    """
+    Check a target URL, reusing a recent successful result for the
+    same normalized URL when available. Return a tuple of the final URL
+    after following redirects and an error message, which is ``None``
+    if the URL is valid. The fragment of ``url`` is kept in the final
+    URL, unless a redirect replaced it.
+    """
+    key = normalize_url(url)
+    fragment = urlparse(url).fragment
+    cache = get_validation_cache()
+    final_url = cache.get(key) if cache is not None else None
+    if final_url is None:
+        try:
+            r = get_checker().check(url)
+        except requests.exceptions.RequestException as e:
+            # Errors are not cached, so a target can be saved as soon
+            # as it is fixed
+            return url, get_error_message(e)
+        # Cache the final URL without the submitted fragment, so the
+        # result can be reused with a different fragment
+        parts = urlparse(r.url)
+        final_url = urlunparse(parts._replace(fragment='')) if fragment and parts.fragment == fragment else r.url
+        if cache is not None:
+            cache.set(key, final_url)
+    if fragment and not urlparse(final_url).fragment:
+        final_url = '%s#%s' % (final_url, fragment)
+    return final_url, None
+
+
+def record_target_status(id, url):
+    """
+    Check the target URL of a ``ShortURL`` and store the result as its
+    ``ShortURLStatus``.
+    """
+    from .models import ShortURLStatus
+
+    start = time.time()
+    try:
+        response, error = get_checker().check(url), None
+    except requests.exceptions.RequestException as e:
+        response, error = None, e
+    result = get_result(response, error, time.time() - start)
+    ShortURLStatus.objects.record([id], **result)
+
+
+_checker = None
+_validation_cache = None
+
+
+def get_checker():
+    """
+    Return a shared ``URLChecker`` configured from the settings.
+    """
+    global _checker
+    if _checker is None:
+        _checker = URLChecker()
+    return _checker
+
+
+def get_validation_cache():
+    """
+    Return the cache of recent ``validate_target`` results, or
+    ``None`` if results are not cached.
+    """
+    global _validation_cache
+    if _validation_cache is None:
+        timeout = getattr(settings, 'DEFLECT_VALIDATION_CACHE_TIMEOUT', 300)
+        if not timeout:
+            return None
+        _validation_cache = LRUCache(max_size=1000, timeout=timeout)
+    return _validation_cache
+
+
+@receiver(setting_changed)
+def reset_checker(**kwargs):
+    global _checker, _validation_cache
+    if kwargs['setting'].startswith(('DEFLECT_ASYNC_', 'DEFLECT_HOST_', 'DEFLECT_REQUESTS_')):
+        _checker = None
+    if kwargs['setting'].startswith(('DEFLECT_VALIDATION_', 'DEFLECT_REQUESTS_')):
+        _validation_cache = None
@@ -1,11 +1,3 @@
-# gevent is optional, and allows for asynchronous requests. If it is
-# not present, synchronous requests will be sent.
-try:
-    import gevent
-except ImportError:
-    gevent = None
-
-
 # Support both Python 2 and Python 3 locations for urllib imports.
 try:
     from urllib.parse import parse_qsl
@@ -0,0 +1,12 @@
+from django.conf.urls import url
+
+from .views import deferred_redirect
+from .views import qr_code
+
+
+app_name = 'deflect'
+
+urlpatterns = [
+    url(r'^(?P<key>[a-zA-Z0-9-]+)\.(?P<format>png|svg)$', qr_code, name='qr_code'),
+    url(r'^(?P<key>[a-zA-Z0-9-]+)$', deferred_redirect, name='redirect'),
+]
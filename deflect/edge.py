@@ -0,0 +1,330 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple
+import csv
+from datetime import datetime
+from datetime import timedelta
+import io
+import json
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.urlresolvers import Resolver404
+from django.core.urlresolvers import resolve
+from django.core.urlresolvers import reverse
+from django.db.models import Q
+from django.utils import six
+from django.utils.timezone import get_default_timezone
+from django.utils.timezone import make_naive
+from django.utils.timezone import utc
+
+import base32_crockford
+
+from .models import ShortURL
+from .models import ShortURLAlias
+from .views import MAX_KEY_ID
+
+
+RULE_FORMATS = ('nginx', 'json', 'csv')
+
+# A redirect that can be served without the application: the
+# ``ShortURL`` id, the request path, the target URL and the status
+Rule = namedtuple('Rule', ['id', 'source', 'target', 'status'])
+
+nginx_rule_re = re.compile(r'^\s*"(?P<source>[^"]*)"\s+"(?P<target>[^"]*)";\s*#\s*(?P<id>\d+)\s*$')
+
+# The nginx and Apache combined log format
+access_log_re = re.compile(
+    r'^\S+ \S+ \S+ \[(?P<time>[^\]]+)\] "(?:[A-Z]+) (?P<path>\S+)[^"]*" (?P<status>\d{3}) '
+)
+
+
+def get_rules(queryset, chunk_size=1000):
+    """
+    Yield a ``Rule`` for the key and alias of each ``ShortURL`` in a
+    queryset, loading ``chunk_size`` rows at a time.
+    """
+    qs = queryset.select_related('shorturlalias').order_by('pk')
+    last = 0
+    while True:
+        chunk = list(qs.filter(pk__gt=last)[:chunk_size].iterator())
+        if not chunk:
+            break
+        for shorturl in chunk:
+            target = shorturl.target_url()
+            status = 301 if shorturl.is_tracking else 302
+            yield Rule(shorturl.pk, shorturl.get_absolute_url(), target, status)
+            alias = getattr(shorturl, 'shorturlalias', None)
+            if alias is not None:
+                yield Rule(shorturl.pk, reverse('deflect:redirect', args=[alias.alias]), target, status)
+        last = chunk[-1].pk
+
+
+def _is_key_rule(rule):
+    return rule.source.rsplit('/', 1)[-1] == base32_crockford.encode(rule.id)
+
+
+def _unique_rules(rules):
+    """
+    Return one rule for each source. nginx compares map strings case
+    insensitively, so sources that differ only in case are the same,
+    and an alias takes precedence over a key with the same value, as
+    in the application.
+    """
+    unique = {}
+    for rule in rules:
+        source = rule.source.lower()
+        if source not in unique or not _is_key_rule(rule):
+            unique[source] = rule
+    return list(unique.values())
+
+
+def _nginx_quote(url):
+    # Map values are interpolated, so characters with a special
+    # meaning are percent encoded, which leaves the URL unchanged
+    return url.replace('"', '%22').replace('\\', '%5C').replace('$', '%24')
+
+
+def _encode(value):
+    # The Python 2 csv module reads and writes bytes, so files are
+    # opened in binary mode and text is encoded
+    if six.PY2:
+        return six.text_type(value).encode('utf-8')
+    return six.text_type(value)
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _open(path, mode):
+    if six.PY2:
+        return io.open(path, mode + 'b')
+    return io.open(path, mode, encoding='utf-8', newline='')
+
+
+def write_rules(fileobj, rules, format):
+    """
+    Write rules to a file opened with ``_open``. The nginx format
+    defines a ``$deflect_permanent`` and a ``$deflect_temporary`` map
+    from the request URI to the target URL, for use as::
+
+        if ($deflect_permanent) {
+            return 301 $deflect_permanent;
+        }
+        if ($deflect_temporary) {
+            return 302 $deflect_temporary;
+        }
+
+    The request URI includes the query string, so requests with query
+    parameters do not match and are passed to the application, which
+    counts their hits itself. Map strings are case insensitive, so a
+    key or alias matches in any case. Only redirects served by the
+    edge should be imported with ``import_hits``, so they are not
+    counted twice, by writing them to their own access log::
+
+        access_log /var/log/nginx/deflect.log combined if=$deflect_permanent$deflect_temporary;
+    """
+    if format == 'nginx':
+        for variable, status in (('deflect_permanent', 301), ('deflect_temporary', 302)):
+            fileobj.write(_encode('map $request_uri $%s {\n' % variable))
+            for rule in rules:
+                if rule.status == status:
+                    line = '    "%s" "%s"; # %d\n' % (rule.source, _nginx_quote(rule.target), rule.id)
+                    fileobj.write(_encode(line))
+            fileobj.write(_encode('}\n'))
+    elif format == 'json':
+        for rule in rules:
+            fileobj.write(_encode(json.dumps(rule._asdict()) + '\n'))
+    else:
+        writer = csv.writer(fileobj)
+        writer.writerow([_encode(field) for field in Rule._fields])
+        for rule in rules:
+            writer.writerow([_encode(value) for value in rule])
+
+
+def read_rules(fileobj, format):
+    """
+    Read the rules written by ``write_rules`` from a file opened with
+    ``_open``.
+    """
+    rules = []
+    if format == 'nginx':
+        status = None
+        for line in fileobj:
+            line = _decode(line)
+            if line.startswith('map '):
+                status = 301 if '$deflect_permanent' in line else 302
+                continue
+            match = nginx_rule_re.match(line)
+            if match:
+                rules.append(Rule(int(match.group('id')), match.group('source'), match.group('target'), status))
+    elif format == 'json':
+        for line in fileobj:
+            if line.strip():
+                data = json.loads(_decode(line))
+                rules.append(Rule(data['id'], data['source'], data['target'], data['status']))
+    else:
+        reader = csv.reader(fileobj)
+        next(reader, None)
+        for id, source, target, status in reader:
+            rules.append(Rule(int(id), _decode(source), _decode(target), int(status)))
+    return rules
+
+
+def export_rules(path, format, since=None):
+    """
+    Write the rules for every ``ShortURL`` to ``path``. If ``since``
+    is given, only regenerate the rules for ``ShortURL``s updated
+    after it, keeping the other rules from the existing file and
+    dropping those of deleted ``ShortURL``s. The file is replaced
+    atomically. Return the total number of rules and the number that
+    were regenerated.
+    """
+    qs = ShortURL.objects.all()
+    rules = []
+    if since is not None and os.path.exists(path):
+        existing = set(qs.values_list('pk', flat=True))
+        with _open(path, 'r') as f:
+            previous = read_rules(f, format)
+        # A key shadowed by an alias has no rule, so it is regenerated
+        # in case the alias has since been removed
+        shadowed = existing - set(rule.id for rule in previous if _is_key_rule(rule))
+        changed = qs.filter(Q(updated__gt=since) | Q(pk__in=shadowed))
+        changed_ids = set(changed.values_list('pk', flat=True))
+        rules = [rule for rule in previous if rule.id in existing and rule.id not in changed_ids]
+        qs = changed
+    new_rules = list(get_rules(qs))
+    rules = _unique_rules(rules + new_rules)
+    rules.sort(key=lambda rule: (rule.id, rule.source))
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.deflect-')
+    os.close(fd)
+    try:
+        with _open(tmp_path, 'w') as f:
+            write_rules(f, rules, format)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return len(rules), len(new_rules)
+
+
+class LogFile(object):
+    """
+    Iterate over the complete lines of a log file opened in binary
+    mode, starting ``offset`` bytes into it. ``offset`` is advanced
+    past each line as it is read, so it can be stored and the next
+    import can continue from it. A line that is still being written
+    is left for the next import. A file shorter than ``offset`` is
+    assumed to have been truncated, and is read from the start.
+    """
+    def __init__(self, fileobj, offset=0):
+        fileobj.seek(0, os.SEEK_END)
+        if fileobj.tell() < offset:
+            offset = 0
+        fileobj.seek(offset)
+        self.fileobj = fileobj
+        self.offset = offset
+
+    def __iter__(self):
+        for line in self.fileobj:
+            if not line.endswith(b'\n'):
+                break
+            self.offset += len(line)
+            yield line.decode('utf-8', 'replace')
+
+
+def parse_access_log(lines):
+    """
+    Yield the request URI, status code and timestamp of each request
+    in an access log in the combined log format.
+    """
+    for line in lines:
+        match = access_log_re.match(line)
+        if not match:
+            continue
+        try:
+            timestamp = parse_log_time(match.group('time'))
+        except ValueError:
+            continue
+        yield match.group('path'), int(match.group('status')), timestamp
+
+
+def parse_log_time(value):
+    """
+    Parse a combined log format timestamp, such as
+    ``10/Oct/2000:13:55:36 -0700``. Return an aware datetime, or a
+    naive datetime in the default time zone if ``USE_TZ`` is disabled.
+    """
+    timestamp, _, offset = value.partition(' ')
+    dt = datetime.strptime(timestamp, '%d/%b/%Y:%H:%M:%S')
+    if offset:
+        sign = -1 if offset.startswith('-') else 1
+        dt -= sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+    dt = dt.replace(tzinfo=utc)
+    if not settings.USE_TZ:
+        dt = make_naive(dt, get_default_timezone())
+    return dt
+
+
+def import_hits(lines, batch_size=1000):
+    """
+    Count the redirects served by the edge in an access log and add
+    them to the ``ShortURL`` hits and last used timestamps. The log
+    should only contain the requests matched by the rules written by
+    ``write_rules``. The rules never match a query string, so those
+    requests were passed to the application, which already counted
+    them. Return the number of hits imported.
+    """
+    counts = {}
+    for path, status, timestamp in parse_access_log(lines):
+        if status not in (301, 302) or '?' in path:
+            continue
+        try:
+            match = resolve(path)
+        except Resolver404:
+            continue
+        if match.view_name != 'deflect:redirect':
+            continue
+        key = match.kwargs['key'].lower()
+        count, last_used = counts.get(key, (0, None))
+        counts[key] = (count + 1, max(last_used, timestamp) if last_used else timestamp)
+
+    hits = {}
+    keys = list(counts)
+    for i in range(0, len(keys), batch_size):
+        ids = _resolve_keys(keys[i:i + batch_size])
+        for key, id in ids.items():
+            count, last_used = counts[key]
+            total, previous = hits.get(id, (0, None))
+            hits[id] = (total + count, max(previous, last_used) if previous else last_used)
+    ShortURL.objects.apply_hits(hits)
+    return sum(count for count, last_used in hits.values())
+
+
+def _resolve_keys(keys):
+    """
+    Return a dict mapping lowercase keys and aliases to the ids of
+    the ``ShortURL``s they redirect to. An alias takes precedence over
+    a key with the same value.
+    """
+    ids = dict(ShortURLAlias.objects.filter(alias__in=keys).values_list('alias', 'redirect_id'))
+    decoded = {}
+    for key in keys:
+        if key in ids:
+            continue
+        try:
+            id = base32_crockford.decode(key)
+        except ValueError:
+            continue
+        if id <= MAX_KEY_ID:
+            decoded[key] = id
+    existing = set(ShortURL.objects.filter(pk__in=decoded.values()).values_list('pk', flat=True))
+    ids.update((key, id) for key, id in decoded.items() if id in existing)
+    return ids
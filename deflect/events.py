@@ -0,0 +1,121 @@
+from __future__ import unicode_literals
+
+import atexit
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from .utils import get_user_agent_family
+
+
+logger = logging.getLogger(__name__)
+
+
+class ClickEventQueue(object):
+    """
+    Queue ``ClickEvent``s in process memory and write them with
+    ``bulk_create``. If an ``interval`` is given, a background thread
+    writes the queued events every ``interval`` seconds, or as soon
+    as ``batch_size`` events are queued. Events are dropped if
+    ``max_size`` events are already waiting to be written.
+    """
+    def __init__(self, batch_size=100, interval=None, max_size=100000):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_size = max_size
+        self._events = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._writer = None
+
+    def add(self, event):
+        with self._lock:
+            if len(self._events) >= self.max_size:
+                logger.warning("Click event queue is full, dropping event")
+                return
+            self._events.append(event)
+            if self._writer is None and self.interval:
+                self._writer = threading.Thread(target=self._run, name='deflect-click-events')
+                self._writer.daemon = True
+                self._writer.start()
+                atexit.register(self.flush)
+            if len(self._events) >= self.batch_size:
+                self._ready.set()
+
+    def flush(self):
+        """
+        Write all queued events to the database. Return the number of
+        events written.
+        """
+        from .models import ClickEvent
+        from .models import ShortURL
+
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        # Skip events for short URLs deleted since the redirect
+        ids = set(event.redirect_id for event in events)
+        existing = set(ShortURL.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        events = [event for event in events if event.redirect_id in existing]
+        ClickEvent.objects.bulk_create(events, batch_size=self.batch_size)
+        return len(events)
+
+    def _run(self):
+        while True:
+            self._ready.wait(self.interval)
+            self._ready.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error writing click events")
+
+
+_click_queue = None
+
+
+def get_click_queue():
+    """
+    Return the ``ClickEventQueue``, or ``None`` if click events are
+    not enabled.
+    """
+    global _click_queue
+    if _click_queue is None and getattr(settings, 'DEFLECT_CLICK_EVENTS', False):
+        batch_size = getattr(settings, 'DEFLECT_CLICK_EVENTS_BATCH_SIZE', 100)
+        interval = getattr(settings, 'DEFLECT_CLICK_EVENTS_FLUSH_INTERVAL', 5)
+        _click_queue = ClickEventQueue(batch_size=batch_size, interval=interval)
+    return _click_queue
+
+
+def record_click(request, redirect):
+    """
+    Queue a ``ClickEvent`` for a redirect, if click events are
+    enabled.
+    """
+    from .models import ClickEvent
+
+    queue = get_click_queue()
+    if queue is None:
+        return
+    params = request.GET.dict() if request.META.get('QUERY_STRING') else {}
+    queue.add(ClickEvent(
+        redirect_id=redirect.pk,
+        timestamp=now(),
+        referrer=request.META.get('HTTP_REFERER', ''),
+        user_agent_family=get_user_agent_family(request.META.get('HTTP_USER_AGENT', '')),
+        query_params=json.dumps(params) if params else '',
+    ))
+
+
+@receiver(setting_changed)
+def reset_click_queue(**kwargs):
+    global _click_queue
+    if kwargs['setting'].startswith('DEFLECT_CLICK_EVENTS'):
+        _click_queue = None
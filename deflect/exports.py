@@ -0,0 +1,167 @@
+from __future__ import unicode_literals
+
+import csv
+from itertools import chain
+from itertools import islice
+import json
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+import zipfile
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.utils import six
+from django.utils.encoding import force_text
+
+from .utils import get_qr_code
+
+
+EXPORT_FIELDS = ('key', 'short_url', 'alias_url', 'long_url', 'target_url', 'campaign', 'medium',
+                 'content', 'hits', 'last_used', 'created')
+
+
+def _render_qr_code(args):
+    """
+    Render a single QR code in a worker process. Return the file name
+    and the image.
+    """
+    filename, url, format, box_size = args
+    return filename, get_qr_code(url, format=format, box_size=box_size)
+
+
+def get_qr_code_items(queryset, format='png', box_size=10, chunk_size=1000):
+    """
+    Yield the file name and short URL for each ``ShortURL`` in a
+    queryset, loading ``chunk_size`` rows at a time. The file name
+    uses the alias, when available.
+    """
+    base = 'http://%s' % Site.objects.get_current().domain
+    qs = queryset.order_by('pk').values_list('pk', 'shorturlalias__alias')
+    last = 0
+    while True:
+        chunk = list(qs.filter(pk__gt=last)[:chunk_size])
+        if not chunk:
+            break
+        for id, alias in chunk:
+            shorturl = queryset.model(pk=id)
+            url = base + reverse('deflect:redirect', args=[shorturl.key])
+            yield '%s.%s' % (alias or shorturl.key, format), url, format, box_size
+        last = chunk[-1][0]
+
+
+def render_qr_codes(items, processes=None):
+    """
+    Render QR codes for an iterable of items from ``get_qr_code_items``
+    in parallel, using a pool of ``processes`` worker processes that
+    defaults to the number of CPUs. Yield the file name and image for
+    each item, in order.
+    """
+    processes = processes or cpu_count()
+    if processes == 1:
+        for item in items:
+            yield _render_qr_code(item)
+        return
+
+    pool = Pool(processes)
+    try:
+        # Submit a bounded window of work at a time, so rendered
+        # images do not accumulate faster than they are consumed
+        window = processes * 16
+        while True:
+            batch = list(islice(items, window))
+            if not batch:
+                break
+            for result in pool.imap(_render_qr_code, batch, chunksize=4):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write_qr_codes(fileobj, queryset, format='png', box_size=10, processes=None):
+    """
+    Write a ZIP archive to ``fileobj`` containing a QR code image for
+    each ``ShortURL`` in a queryset. Images are written to the archive
+    as they are rendered. Return the number of images written.
+    """
+    items = get_qr_code_items(queryset, format=format, box_size=box_size)
+    count = 0
+    # PNG and SVG images gain little from compression
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_STORED) as archive:
+        for filename, image in render_qr_codes(items, processes=processes):
+            archive.writestr(filename, image)
+            count += 1
+    return count
+
+
+def get_export_rows(queryset, chunk_size=1000):
+    """
+    Yield a dict of ``EXPORT_FIELDS`` for each ``ShortURL`` in a
+    queryset. Rows are loaded ``chunk_size`` at a time, with their
+    aliases and any hit shard totals, and the site domain is resolved
+    once, so memory use and the number of queries per row stay flat.
+    """
+    base = 'http://%s' % Site.objects.get_current().domain
+    qs = queryset.select_related('shorturlalias').order_by('pk')
+    if getattr(settings, 'DEFLECT_HIT_SHARDS', 0):
+        qs = qs.with_shard_hits()
+    last = 0
+    while True:
+        chunk = list(qs.filter(pk__gt=last)[:chunk_size].iterator())
+        if not chunk:
+            break
+        for shorturl in chunk:
+            alias = getattr(shorturl, 'shorturlalias', None)
+            yield {
+                'key': shorturl.key,
+                'short_url': base + shorturl.get_absolute_url(),
+                'alias_url': base + reverse('deflect:redirect', args=[alias.alias]) if alias else '',
+                'long_url': shorturl.long_url,
+                'target_url': shorturl.target_url(),
+                'campaign': shorturl.campaign,
+                'medium': shorturl.medium,
+                'content': shorturl.content,
+                'hits': shorturl.get_hits(),
+                'last_used': shorturl.get_last_used(),
+                'created': shorturl.created,
+            }
+        last = chunk[-1].pk
+
+
+class Echo(object):
+    """
+    A file-like object that returns each written value, so ``csv``
+    writers can produce rows for streaming.
+    """
+    def write(self, value):
+        return value
+
+
+def _format_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def stream_csv(rows):
+    """
+    Yield a CSV header and a line for each row from ``get_export_rows``.
+    """
+    writer = csv.writer(Echo())
+    header = dict((field, field) for field in EXPORT_FIELDS)
+    for row in chain([header], rows):
+        values = [force_text(_format_value(row[field])) if row[field] is not None else ''
+                  for field in EXPORT_FIELDS]
+        if six.PY2:
+            values = [value.encode('utf-8') for value in values]
+        yield writer.writerow(values)
+
+
+def stream_json(rows):
+    """
+    Yield a line containing a JSON object for each row from
+    ``get_export_rows``.
+    """
+    for row in rows:
+        yield json.dumps(dict((field, _format_value(row[field])) for field in EXPORT_FIELDS)) + '\n'
@@ -0,0 +1,222 @@
+from __future__ import unicode_literals
+
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryHitBuffer(object):
+    """
+    Accumulate hits in process memory. If an ``interval`` is given,
+    buffered hits are written by a background thread every
+    ``interval`` seconds, as well as when the process exits.
+    """
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._hits = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, id, timestamp):
+        with self._lock:
+            hits, last_used = self._hits.get(id, (0, timestamp))
+            self._hits[id] = (hits + 1, max(last_used, timestamp))
+            if self._flusher is None and self.interval:
+                self._flusher = HitFlusher(self, self.interval)
+                self._flusher.start()
+                atexit.register(flush_hits, self)
+
+    def drain(self):
+        """
+        Remove and return all buffered hits as a dict mapping
+        ``ShortURL`` ids to a tuple of the number of hits and the
+        most recent hit timestamp.
+        """
+        with self._lock:
+            hits, self._hits = self._hits, {}
+        return hits
+
+
+class CacheHitBuffer(object):
+    """
+    Accumulate hits in a Django cache backend shared between
+    processes. Buffered hits are written by the ``flushhits``
+    management command.
+
+    Each hit increments a per-link counter. The first hit after a
+    flush also records the link id in a numbered slot, so a flush
+    only needs to visit the links that were used since the last one.
+    """
+    prefix = 'deflect:hits:'
+    dirty_timeout = 3600
+    lock_timeout = 300
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _key(self, name, id):
+        return '%s%s:%s' % (self.prefix, name, id)
+
+    def add(self, id, timestamp):
+        count_key = self._key('count', id)
+        self.cache.add(count_key, 0, None)
+        try:
+            self.cache.incr(count_key)
+        except ValueError:
+            # The counter was evicted between add() and incr()
+            self.cache.set(count_key, 1, None)
+        # Keep the most recent timestamp. Concurrent hits can still
+        # race between the get() and set(), but only by the time
+        # between them, and ``apply_hits`` never moves it backwards
+        used_key = self._key('used', id)
+        if not self.cache.add(used_key, timestamp, None):
+            previous = self.cache.get(used_key)
+            if previous is None or previous < timestamp:
+                self.cache.set(used_key, timestamp, None)
+
+        if self.cache.add(self._key('dirty', id), 1, self.dirty_timeout):
+            seq_key = self.prefix + 'seq'
+            self.cache.add(seq_key, 0, None)
+            seq = self.cache.incr(seq_key)
+            self.cache.set(self._key('slot', seq), id, None)
+
+    def drain(self):
+        """
+        Remove and return all buffered hits as a dict mapping
+        ``ShortURL`` ids to a tuple of the number of hits and the
+        most recent hit timestamp. Counters are decremented rather
+        than deleted, so hits recorded during a flush are kept.
+        """
+        lock_key = self.prefix + 'lock'
+        if not self.cache.add(lock_key, 1, self.lock_timeout):
+            logger.warning("Buffered hits are already being flushed")
+            return {}
+
+        try:
+            start = self.cache.get(self.prefix + 'flushed', 0)
+            end = self.cache.get(self.prefix + 'seq', 0)
+            missing = self.cache.get(self.prefix + 'missing', 0)
+            slots = dict((self._key('slot', seq), seq) for seq in range(start + 1, end + 1))
+            values = self.cache.get_many(list(slots))
+            ids = set(values.values())
+
+            # A slot that is missing may not have been written yet by a
+            # concurrent hit, so the flush stops before it. A slot that
+            # was already missing in the previous flush was evicted,
+            # and is skipped.
+            flushed = start
+            for seq in range(start + 1, end + 1):
+                if self._key('slot', seq) not in values and seq > missing:
+                    break
+                flushed = seq
+            missing = max([seq for key, seq in slots.items() if key not in values] or [0])
+
+            # Clear the dirty markers first, so any hit from now on
+            # registers its link for the next flush
+            self.cache.delete_many([self._key('dirty', id) for id in ids])
+
+            counts = self.cache.get_many([self._key('count', id) for id in ids])
+            used = self.cache.get_many([self._key('used', id) for id in ids])
+            hits = {}
+            for id in ids:
+                count = counts.get(self._key('count', id))
+                if not count:
+                    continue
+                # The timestamp may have been evicted on its own
+                hits[id] = (count, used.get(self._key('used', id)) or now())
+            for id, (count, last_used) in hits.items():
+                try:
+                    self.cache.decr(self._key('count', id), count)
+                except ValueError:
+                    # The counter was evicted after it was read, so
+                    # there is nothing left to decrement
+                    pass
+
+            # The slots are only released once every counter has been
+            # read, so a failed drain is retried by the next flush
+            self.cache.delete_many([key for key, seq in slots.items() if seq <= flushed])
+            self.cache.set_many({self.prefix + 'flushed': flushed, self.prefix + 'missing': missing}, None)
+            return hits
+        finally:
+            self.cache.delete(lock_key)
+
+
+class HitFlusher(threading.Thread):
+    """
+    A daemon thread that periodically writes the hits accumulated
+    in a ``MemoryHitBuffer``.
+    """
+    def __init__(self, buffer, interval):
+        super(HitFlusher, self).__init__(name='deflect-hit-flusher')
+        self.daemon = True
+        self.buffer = buffer
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            try:
+                flush_hits(self.buffer)
+            except Exception:
+                logger.exception("Error flushing buffered hits")
+
+
+def flush_hits(buffer=None):
+    """
+    Write all hits accumulated in the given or configured hit buffer
+    to the database. Return the number of ``ShortURL``s updated.
+    """
+    from .models import ShortURL
+
+    if buffer is None:
+        buffer = get_hit_buffer()
+    if buffer is None:
+        return 0
+    hits = buffer.drain()
+    if hits:
+        ShortURL.objects.apply_hits(hits)
+    return len(hits)
+
+
+_hit_buffer = None
+
+
+def get_hit_buffer():
+    """
+    Return the hit buffer selected by ``DEFLECT_HITS_BUFFER``, or
+    ``None`` if hits are written directly to the database.
+    """
+    global _hit_buffer
+    if _hit_buffer is None:
+        mode = getattr(settings, 'DEFLECT_HITS_BUFFER', None)
+        if not mode:
+            return None
+        if mode == 'memory':
+            interval = getattr(settings, 'DEFLECT_HITS_FLUSH_INTERVAL', 10)
+            _hit_buffer = MemoryHitBuffer(interval=interval)
+        elif mode == 'cache':
+            backend = getattr(settings, 'DEFLECT_HITS_CACHE_BACKEND', 'default')
+            _hit_buffer = CacheHitBuffer(caches[backend])
+        else:
+            raise ImproperlyConfigured("DEFLECT_HITS_BUFFER must be 'memory' or 'cache', not %r" % mode)
+    return _hit_buffer
+
+
+@receiver(setting_changed)
+def reset_hit_buffer(**kwargs):
+    global _hit_buffer
+    if kwargs['setting'].startswith('DEFLECT_HITS_'):
+        _hit_buffer = None
@@ -0,0 +1,212 @@
+from __future__ import unicode_literals
+
+import csv
+from itertools import islice
+import json
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db import transaction
+from django.utils import six
+from django.utils.timezone import now
+
+from .bloom import redirect_filter
+from .cache import redirect_cache
+from .cache import suggestion_cache
+from .checker import get_checker
+from .checker import get_error_message
+from .models import ShortURL
+from .models import ShortURLAlias
+
+
+IMPORT_FIELDS = ('long_url', 'campaign', 'medium', 'content', 'alias')
+
+alias_re = re.compile(r'^[a-zA-Z0-9-]+$')
+
+
+def read_rows(fileobj, format='csv'):
+    """
+    Read rows to import from a CSV file with a header row, or a file
+    of JSON objects with one object per line. Yield a dict for each
+    row, or ``None`` for a line that cannot be parsed.
+    """
+    if format == 'json':
+        for line in fileobj:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else None
+        return
+
+    for row in csv.DictReader(fileobj):
+        # Values in columns beyond the header are stored as a list
+        # under ``None``, and are ignored
+        row.pop(None, None)
+        if six.PY2:
+            row = dict((k, v.decode('utf-8') if v else v) for k, v in row.items())
+        yield row
+
+
+class ImportResult(object):
+    """
+    The outcome of an import: the number of ``ShortURL``s created and
+    a list of ``(row, message)`` tuples for each row that was skipped,
+    where ``row`` is the 1-based position of the row in the input.
+    """
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, row, message):
+        self.errors.append((row, message))
+
+
+def import_urls(rows, creator, check=False, chunk_size=1000):
+    """
+    Create a ``ShortURL``, and optionally a ``ShortURLAlias``, for
+    each row in an iterable of dicts with ``IMPORT_FIELDS`` keys. Rows
+    are validated and inserted ``chunk_size`` at a time with
+    ``bulk_create``. If ``check`` is ``True``, the target URLs in each
+    chunk are checked concurrently first. Invalid rows are skipped
+    and reported in the returned ``ImportResult``, without aborting
+    the import.
+    """
+    result = ImportResult()
+    seen_aliases = set()
+    rows = enumerate(rows, 1)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        valid = _validate_chunk(chunk, creator, seen_aliases, result)
+        if check:
+            valid = _check_targets(valid, result)
+        if valid:
+            _create_chunk(valid, creator)
+            result.created += len(valid)
+    result.errors.sort()
+    return result
+
+
+def _get_values(row):
+    """
+    Return the ``IMPORT_FIELDS`` of a row as stripped text, converting
+    numbers and other scalar JSON values. Raise ``ValueError`` if a
+    value is a list or object.
+    """
+    values = {}
+    for field in IMPORT_FIELDS:
+        value = row.get(field)
+        if isinstance(value, (dict, list)):
+            raise ValueError("Invalid value for %s" % field)
+        values[field] = six.text_type(value).strip() if value is not None else ''
+    return values
+
+
+def _validate_chunk(chunk, creator, seen_aliases, result):
+    """
+    Build a ``ShortURL`` for each valid row in a chunk. Return a list
+    of ``(row, shorturl, alias)`` tuples.
+    """
+    valid = []
+    for i, row in chunk:
+        if row is None:
+            result.add_error(i, "Invalid row")
+            continue
+        try:
+            values = _get_values(row)
+        except ValueError as e:
+            result.add_error(i, six.text_type(e))
+            continue
+        alias = values.pop('alias').lower()
+        shorturl = ShortURL(creator=creator, **values)
+        try:
+            shorturl.full_clean(exclude=['created', 'creator'], validate_unique=False)
+        except ValidationError as e:
+            result.add_error(i, '; '.join('%s: %s' % (field, ' '.join(messages))
+                                          for field, messages in sorted(e.message_dict.items())))
+            continue
+        if alias:
+            if not alias_re.match(alias) or len(alias) > ShortURLAlias._meta.get_field('alias').max_length:
+                result.add_error(i, "Invalid alias %s" % alias)
+                continue
+            if alias in seen_aliases:
+                result.add_error(i, "Duplicate alias %s" % alias)
+                continue
+            seen_aliases.add(alias)
+        valid.append((i, shorturl, alias))
+
+    # Check every alias in the chunk against the unique index at once
+    aliases = [alias for i, shorturl, alias in valid if alias]
+    existing = set(ShortURLAlias.objects.filter(alias__in=aliases).values_list('alias', flat=True))
+    if existing:
+        for i, shorturl, alias in valid:
+            if alias in existing:
+                result.add_error(i, "Alias %s already exists" % alias)
+        valid = [item for item in valid if item[2] not in existing]
+    return valid
+
+
+def _check_targets(valid, result):
+    """
+    Check the target URLs of validated rows concurrently, replacing
+    each target with the final URL after following redirects. Return
+    the rows with valid targets, in their original order.
+    """
+    checked = []
+    results = get_checker().check_many(valid, get_url=lambda item: item[1].long_url)
+    for (i, shorturl, alias), response, error, latency in results:
+        if error is not None:
+            result.add_error(i, "Invalid target URL: %s" % get_error_message(error))
+            continue
+        shorturl.long_url = response.url
+        checked.append((i, shorturl, alias))
+    return sorted(checked, key=lambda item: item[0])
+
+
+def _create_chunk(valid, creator):
+    """
+    Insert the ``ShortURL``s and aliases for a chunk of validated rows.
+    """
+    created = now()
+    shorturls = [shorturl for i, shorturl, alias in valid]
+    for shorturl in shorturls:
+        shorturl.created = created
+    with transaction.atomic():
+        last = ShortURL.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        ShortURL.objects.bulk_create(shorturls)
+        if not getattr(connection.features, 'can_return_ids_from_bulk_insert', False):
+            _fetch_ids(shorturls, creator, last)
+        ShortURLAlias.objects.bulk_create([ShortURLAlias(redirect=shorturl, alias=alias)
+                                           for i, shorturl, alias in valid if alias])
+
+    # Signals are not sent for bulk inserts, so update the caches here
+    for i, shorturl, alias in valid:
+        redirect_filter.add(id=shorturl.pk, alias=alias or None)
+        for field in ShortURL.suggestion_fields:
+            suggestion_cache.add(field, getattr(shorturl, field))
+    redirect_cache.delete(*[alias for i, shorturl, alias in valid if alias])
+
+
+def _fetch_ids(shorturls, creator, last):
+    """
+    Set the primary keys of ``ShortURL``s inserted with ``bulk_create``
+    on databases that do not return them, by matching the rows
+    inserted after the previous highest primary key in order.
+    """
+    fields = ('long_url', 'campaign', 'medium', 'content')
+    inserted = (ShortURL.objects.filter(pk__gt=last, creator=creator, created=shorturls[0].created)
+                                .order_by('pk').values_list('pk', *fields))
+    pending = iter(shorturls)
+    shorturl = next(pending)
+    for row in inserted.iterator():
+        if row[1:] == tuple(getattr(shorturl, field) for field in fields):
+            shorturl.pk = row[0]
+            shorturl = next(pending, None)
+            if shorturl is None:
+                break
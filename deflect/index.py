@@ -0,0 +1,211 @@
+from __future__ import unicode_literals
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .utils import URLTemplate
+
+
+# The file starts with a header, followed by a fixed size record for
+# each key and alias in sorted order, then a blob of the redirect
+# data for every record
+HEADER = struct.Struct('<4sIIQdI')
+RECORD = struct.Struct('<16sQII')
+MAGIC = b'DFLX'
+VERSION = 2
+KEY_SIZE = 16
+
+
+def build_index(path, chunk_size=1000):
+    """
+    Write an index of the redirect data for every ``ShortURL`` key
+    and alias to ``path``. The index is written to a temporary file
+    and renamed into place, so processes reading the previous index
+    are not affected. Return the number of entries.
+    """
+    from .models import ShortURL
+
+    built = time.time()
+    entries = {}
+    qs = ShortURL.objects.select_related('shorturlalias').order_by('pk')
+    last = 0
+    while True:
+        chunk = list(qs.filter(pk__gt=last)[:chunk_size].iterator())
+        if not chunk:
+            break
+        for shorturl in chunk:
+            data = json.dumps(shorturl.get_redirect_data(), separators=(',', ':')).encode('utf-8')
+            entries.setdefault(shorturl.key.lower().encode('ascii'), (shorturl.pk, data))
+            alias = getattr(shorturl, 'shorturlalias', None)
+            if alias is not None and len(alias.alias) <= KEY_SIZE:
+                # An alias takes precedence over a key with the same value
+                entries[alias.alias.lower().encode('ascii')] = (shorturl.pk, data)
+        last = chunk[-1].pk
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.deflect-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            keys = sorted(entries)
+            blob_offset = HEADER.size + RECORD.size * len(keys)
+            f.write(HEADER.pack(MAGIC, VERSION, len(keys), blob_offset, built, 0))
+            offset = 0
+            for key in keys:
+                id, data = entries[key]
+                f.write(RECORD.pack(key, id, offset, len(data)))
+                offset += len(data)
+            for key in keys:
+                f.write(entries[key][1])
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(entries)
+
+
+class RedirectIndex(object):
+    """
+    Look up redirect data in a memory mapped index file built by
+    ``build_index``, so every process on a host shares one copy of
+    the data in the page cache. The file is checked every
+    ``DEFLECT_INDEX_CHECK_INTERVAL`` seconds, and reopened when it has
+    been replaced by a rebuild.
+
+    Keys and aliases missing from the index may be newer than it, and
+    should be looked up in the database. Keys and aliases changed in
+    this process since the index was built are treated as missing.
+    Changes made by other processes are seen once the index is
+    rebuilt, so an index older than ``DEFLECT_INDEX_MAX_AGE`` seconds
+    is not used, and every lookup goes to the database until it is
+    rebuilt.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Close the index file, and reload the configuration on next
+        use.
+        """
+        # The mapped file, record count, blob offset and build time are
+        # replaced together, so a lookup never mixes two index files
+        self._index = None
+        self._stat = None
+        self._checked = 0
+        self._stale = {}
+        self._configured = False
+
+    def _configure(self):
+        self.path = getattr(settings, 'DEFLECT_INDEX_PATH', None)
+        self.check_interval = getattr(settings, 'DEFLECT_INDEX_CHECK_INTERVAL', 5)
+        self.max_age = getattr(settings, 'DEFLECT_INDEX_MAX_AGE', 300)
+        self._configured = True
+
+    @property
+    def enabled(self):
+        if not self._configured:
+            self._configure()
+        return bool(self.path)
+
+    def _open(self):
+        """
+        Map the index file, if it exists and has changed since it
+        was last mapped.
+        """
+        self._checked = time.time()
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._index = None
+            self._stat = None
+            return
+        if self._stat is not None and (stat.st_ino, stat.st_mtime) == self._stat:
+            return
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, blob_offset, built, _ = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            self._index = None
+            return
+        # The previous file is unmapped once no lookup refers to it
+        self._index = (mm, count, blob_offset, built)
+        self._stat = (stat.st_ino, stat.st_mtime)
+        # Changes made before this index was built are included in it
+        self._stale = dict((key, changed) for key, changed in self._stale.items() if changed >= built)
+
+    def get(self, key):
+        """
+        Return the redirect data for a key or alias, or ``None`` if it
+        is not in the index.
+        """
+        if not self.enabled:
+            return None
+        if self._checked + self.check_interval <= time.time():
+            with self._lock:
+                self._open()
+        index = self._index
+        if index is None:
+            return None
+        mm, count, blob_offset, built = index
+        if self.max_age and built + self.max_age <= time.time():
+            return None
+        key = key.lower()
+        if key in self._stale:
+            return None
+        try:
+            search = key.encode('ascii').ljust(KEY_SIZE, b'\0')
+        except UnicodeError:
+            return None
+        if len(search) > KEY_SIZE:
+            return None
+
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD.size
+            current = mm[offset:offset + KEY_SIZE]
+            if current < search:
+                low = middle + 1
+            elif current > search:
+                high = middle
+            else:
+                record_key, id, data_offset, length = RECORD.unpack_from(mm, offset)
+                start = blob_offset + data_offset
+                data = json.loads(mm[start:start + length].decode('utf-8'))
+                parts, query, params, url = data['url_template']
+                data['url_template'] = URLTemplate(tuple(parts), query, params, url)
+                return data
+        return None
+
+    def discard(self, *keys):
+        """
+        Treat keys and aliases changed in this process as missing from
+        the index, until it is rebuilt.
+        """
+        if not self.enabled:
+            return
+        changed = time.time()
+        for key in keys:
+            if key:
+                self._stale[key.lower()] = changed
+
+
+redirect_index = RedirectIndex()
+
+
+@receiver(setting_changed)
+def reset_redirect_index(**kwargs):
+    if kwargs['setting'].startswith('DEFLECT_INDEX_'):
+        redirect_index.reset()
@@ -0,0 +1,223 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import random
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.servers.basehttp import WSGIRequestHandler
+from django.core.servers.basehttp import WSGIServer
+from django.core.urlresolvers import reverse
+from django.core.wsgi import get_wsgi_application
+from django.utils.six.moves import socketserver
+
+import requests
+
+from .imports import import_urls
+from .models import ShortURL
+
+
+TRAFFIC_KINDS = ('hot', 'tail', 'alias', 'invalid', 'params')
+
+DEFAULT_MIX = OrderedDict([('hot', 50), ('tail', 25), ('alias', 10), ('invalid', 5), ('params', 10)])
+
+
+def parse_mix(value):
+    """
+    Parse a traffic mix of comma separated ``kind=weight`` pairs, such
+    as ``hot=50,tail=50``, into an ordered dict of weights.
+    """
+    mix = OrderedDict()
+    for pair in value.split(','):
+        kind, _, weight = pair.partition('=')
+        kind = kind.strip()
+        if kind not in TRAFFIC_KINDS:
+            raise ValueError("Unknown traffic kind %s" % kind)
+        mix[kind] = int(weight)
+    return mix
+
+
+def percentile(values, pct):
+    """
+    Return the value at a percentile of a sorted list, using the
+    nearest rank.
+    """
+    if not values:
+        return None
+    index = max(int(round(pct / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class TrafficMix(object):
+    """
+    Generate request paths for a weighted mix of traffic: a few hot
+    keys, the long tail of every key, aliases, invalid keys, and hot
+    keys with a query string.
+    """
+    def __init__(self, keys, aliases, mix=None, hot_keys=5, seed=None):
+        self.keys = keys
+        self.hot = keys[:hot_keys]
+        self.aliases = aliases or keys
+        self.mix = mix or DEFAULT_MIX
+        self.random = random.Random(seed)
+        self._kinds = list(self.mix)
+        self._weights = [self.mix[kind] for kind in self._kinds]
+        self._lock = threading.Lock()
+
+    def _choose_kind(self):
+        point = self.random.uniform(0, sum(self._weights))
+        for kind, weight in zip(self._kinds, self._weights):
+            point -= weight
+            if point <= 0:
+                return kind
+        return self._kinds[-1]
+
+    def next(self):
+        """
+        Return the kind of the next request, its path and the
+        expected status code.
+        """
+        with self._lock:
+            kind = self._choose_kind()
+            if kind == 'hot':
+                key = self.random.choice(self.hot)
+            elif kind == 'tail':
+                key = self.random.choice(self.keys)
+            elif kind == 'alias':
+                key = self.random.choice(self.aliases)
+            elif kind == 'invalid':
+                key = 'missing-%d' % self.random.randint(0, 10 ** 9)
+            else:
+                key = self.random.choice(self.hot)
+        path = reverse('deflect:redirect', args=[key])
+        if kind == 'params':
+            path += '?utm_source=loadtest&ref=%d' % self.random.randint(0, 1000)
+        return kind, path, 404 if kind == 'invalid' else 301
+
+
+def create_links(count, aliases=0):
+    """
+    Create ``count`` ``ShortURL``s to request, the first ``aliases``
+    of which have an alias. Return the list of keys and the list of
+    aliases.
+    """
+    user, _ = get_user_model().objects.get_or_create(username='deflect-loadtest')
+    rows = [{'long_url': 'http://www.example.com/%d' % i, 'campaign': 'Load test',
+             'alias': 'load-%d' % i if i < aliases else ''}
+            for i in range(count)]
+    import_urls(rows, user)
+    qs = ShortURL.objects.filter(creator=user).order_by('pk')
+    keys = [shorturl.key for shorturl in qs.only('pk')]
+    return keys, ['load-%d' % i for i in range(min(aliases, count))]
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(host='127.0.0.1', port=0):
+    """
+    Serve the Django project with a threaded WSGI server in a daemon
+    thread. Return the server, whose ``shutdown`` method stops it.
+    """
+    server = ThreadedWSGIServer((host, port), QuietWSGIRequestHandler)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, name='deflect-loadtest-server')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run_load(base_url, traffic, requests_count, concurrency=10):
+    """
+    Send ``requests_count`` requests generated by a ``TrafficMix`` to
+    ``base_url`` from ``concurrency`` client threads. Return a list of
+    ``(kind, latency, ok)`` tuples, where ``ok`` is ``False`` for an
+    unexpected status code or a connection error, and the total
+    duration in seconds.
+    """
+    results = []
+    remaining = [requests_count]
+    lock = threading.Lock()
+
+    def work():
+        session = requests.Session()
+        while True:
+            with lock:
+                if not remaining[0]:
+                    break
+                remaining[0] -= 1
+            kind, path, expected = traffic.next()
+            start = time.time()
+            try:
+                ok = session.get(base_url + path, allow_redirects=False).status_code == expected
+            except requests.exceptions.RequestException:
+                ok = False
+            latency = time.time() - start
+            with lock:
+                results.append((kind, latency, ok))
+
+    clients = [threading.Thread(target=work) for i in range(concurrency)]
+    start = time.time()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return results, time.time() - start
+
+
+def summarize(results, duration):
+    """
+    Summarize the results of ``run_load`` as a dict of the request
+    count, throughput in requests per second, error rate, and the p50
+    and p99 latencies in milliseconds, overall and for each kind of
+    traffic.
+    """
+    def stats(items):
+        latencies = sorted(latency * 1000 for kind, latency, ok in items)
+        errors = len([item for item in items if not item[2]])
+        return {
+            'requests': len(items),
+            'error_rate': float(errors) / len(items) if items else 0.0,
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+        }
+
+    summary = stats(results)
+    summary['throughput'] = len(results) / duration if duration else 0.0
+    summary['kinds'] = OrderedDict((kind, stats([item for item in results if item[0] == kind]))
+                                   for kind in TRAFFIC_KINDS if any(item[0] == kind for item in results))
+    return summary
+
+
+def check_thresholds(summary, max_p50=None, max_p99=None, min_throughput=None, max_error_rate=0.0,
+                     baseline=None, threshold=0.2):
+    """
+    Return a list of messages for each threshold a summary fails:
+    absolute latency, throughput and error rate limits, and when a
+    ``baseline`` summary is given, a p99 latency or throughput more
+    than ``threshold`` worse than the baseline.
+    """
+    failures = []
+    if max_p50 is not None and summary['p50'] > max_p50:
+        failures.append("p50 latency %.1fms exceeds %.1fms" % (summary['p50'], max_p50))
+    if max_p99 is not None and summary['p99'] > max_p99:
+        failures.append("p99 latency %.1fms exceeds %.1fms" % (summary['p99'], max_p99))
+    if min_throughput is not None and summary['throughput'] < min_throughput:
+        failures.append("throughput %.1f/s is below %.1f/s" % (summary['throughput'], min_throughput))
+    if max_error_rate is not None and summary['error_rate'] > max_error_rate:
+        failures.append("error rate %.2f%% exceeds %.2f%%" % (summary['error_rate'] * 100, max_error_rate * 100))
+    if baseline:
+        if summary['p99'] > baseline['p99'] * (1 + threshold):
+            failures.append("p99 latency %.1fms regressed from %.1fms" % (summary['p99'], baseline['p99']))
+        if summary['throughput'] < baseline['throughput'] * (1 - threshold):
+            failures.append("throughput %.1f/s regressed from %.1f/s" %
+                            (summary['throughput'], baseline['throughput']))
+    return failures
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+
+from deflect.benchmarks import benchmarks
+from deflect.benchmarks import compare_results
+from deflect.benchmarks import load_results
+from deflect.benchmarks import run_benchmarks
+from deflect.benchmarks import save_results
+
+
+class Command(BaseCommand):
+    help = "Run the redirect benchmarks against a test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="The benchmarks to run, defaulting to all of them")
+        parser.add_argument('--save', help="Save the results as a baseline to this path")
+        parser.add_argument('--compare', help="Compare the results against the baseline at this path")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="The fraction slower than the baseline that is reported as a regression")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="The number of times to repeat each benchmark")
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - set(benchmarks)
+        if unknown:
+            raise CommandError("Unknown benchmarks: %s" % ', '.join(sorted(unknown)))
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmarks(options['names'], repeat=options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for name, result in results.items():
+            self.stdout.write("%-20s %10.2f us/call %3d queries" % (name, result['time'] * 1e6, result['queries']))
+        if options['save']:
+            save_results(results, options['save'])
+        if options['compare']:
+            regressions = compare_results(results, load_results(options['compare']), options['threshold'])
+            for name, message in regressions:
+                self.stderr.write("%s: %s" % (name, message))
+            if regressions:
+                raise CommandError("%d benchmark regressions" % len(regressions))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from deflect.index import build_index
+
+
+class Command(BaseCommand):
+    help = "Build the shared redirect index file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=getattr(settings, 'DEFLECT_INDEX_PATH', None),
+                            help="The path of the index file, defaulting to DEFLECT_INDEX_PATH")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="The number of short URLs to load from the database at once")
+
+    def handle(self, *args, **options):
+        if not options['path']:
+            raise CommandError("An index path must be given, or DEFLECT_INDEX_PATH set")
+        count = build_index(options['path'], chunk_size=options['chunk_size'])
+        self.stdout.write("Indexed %d keys and aliases in %s" % (count, options['path']))
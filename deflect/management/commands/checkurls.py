@@ -1,56 +1,155 @@
+from argparse import ArgumentTypeError
+from collections import defaultdict
+import logging
+import time
+import zlib
+
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.mail import mail_managers
-from django.core.management.base import NoArgsCommand
+from django.core.management.base import BaseCommand
 from django.core.urlresolvers import reverse
 
-import requests
+import base32_crockford
 
+from deflect.checker import URLChecker
+from deflect.checker import get_result
+from deflect.compat import urlparse
+from deflect.metrics import metrics
 from deflect.models import ShortURL
-from deflect.compat import gevent
+from deflect.models import ShortURLStatus
+from deflect.models import Watermark
+
+
+logger = logging.getLogger(__name__)
 
-if gevent:
-    from gevent.pool import Pool
-    from gevent import monkey
-    monkey.patch_all(thread=False, select=False)
 
+def shard(value):
+    """
+    Parse a shard specification in the form ``i/N``.
+    """
+    try:
+        index, count = [int(v) for v in value.split('/')]
+    except ValueError:
+        raise ArgumentTypeError("Shard must be in the form i/N")
+    if count < 1 or not 0 <= index < count:
+        raise ArgumentTypeError("Shard index must be between 0 and %d" % (count - 1))
+    return index, count
 
-class Command(NoArgsCommand):
+
+class Command(BaseCommand):
     help = "Validate short URL redirect targets"
-    domain = Site.objects.get_current().domain
-    message = ''
-
-    def handle_noargs(self, *args, **options):
-        def spawn(url, pool=None):
-            if pool is not None:
-                return pool.spawn(self.validate_url, url)
-            return gevent.spawn(self.validate_url, url)
-
-        urls = list(ShortURL.objects.all())
-
-        if gevent:
-            size = getattr(settings, 'DEFLECT_ASYNC_CONCURRENCY', None)
-            pool = Pool(size) if size else None
-            requests = [spawn(u, pool=pool) for u in urls]
-            gevent.joinall(requests)
-        else:
-            for url in urls:
-                self.validate_url(url)
-        mail_managers('URL report for %s' % self.domain, self.message)
-
-    def validate_url(self, url):
-        """
-        Validate a given URL. If an exception is raised, append an
-        informational text block with the failure details.
-        """
-        try:
-            url.check_status()
-        except requests.exceptions.RequestException as e:
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', default=False,
+                            help="Check every short URL, instead of only those not checked recently")
+        parser.add_argument('--max-age', type=int,
+                            default=getattr(settings, 'DEFLECT_CHECK_MAX_AGE', 86400),
+                            help="Recheck short URLs last checked more than this many seconds ago")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="The number of short URLs to load from the database at once")
+        parser.add_argument('--shard', type=shard,
+                            help="Only check partition i of N, in the form i/N, and skip the report")
+        parser.add_argument('--partition', choices=('host', 'pk'), default='host',
+                            help="Partition shards by target host or by primary key")
+        parser.add_argument('--restart', action='store_true', default=False,
+                            help="Ignore the checkpoint left by an interrupted run")
+        parser.add_argument('--report-only', action='store_true', default=False,
+                            help="Send the report for the stored results without checking")
+
+    def handle(self, *args, **options):
+        self.domain = Site.objects.get_current().domain
+        if not options['report_only']:
+            start = time.time()
+            self.check_urls(options)
+            duration = time.time() - start
+            metrics.observe('checkurls_seconds', duration)
+            logger.info("Checked %d target URLs in %.1f seconds" % (len(self.results), duration))
+        # Sharded runs leave the report to a final --report-only run
+        if options['shard'] is None or options['report_only']:
+            mail_managers('URL report for %s' % self.domain, self.get_report())
+
+    def check_urls(self, options):
+        self.checker = URLChecker()
+        self.shard, self.shard_count = options['shard'] or (0, 1)
+        self.partition = options['partition']
+        # Results are shared by every short URL with the same target,
+        # so each distinct target is only checked once per run
+        self.results = {}
+
+        # The last completed primary key is stored after each chunk,
+        # so an interrupted run can resume where it stopped
+        checkpoint, _ = Watermark.objects.get_or_create(name='checkurls:%d/%d' % (self.shard, self.shard_count))
+        if options['restart']:
+            checkpoint.position = 0
+
+        qs = ShortURL.objects.all()
+        if not options['all']:
+            qs = qs.needs_check(options['max_age'])
+        for chunk in self.get_chunks(qs, options['chunk_size'], checkpoint.position):
+            self.check_chunk([(id, url) for id, url in chunk if self.in_shard(id, url)])
+            checkpoint.position = chunk[-1][0]
+            checkpoint.save()
+        checkpoint.delete()
+
+    def in_shard(self, id, long_url):
+        """
+        Return whether a short URL belongs to the shard being checked.
+        Partitioning by host keeps each host in a single shard, so the
+        per host concurrency limit applies across every shard.
+        """
+        if self.shard_count == 1:
+            return True
+        if self.partition == 'pk':
+            return id % self.shard_count == self.shard
+        host = urlparse(long_url).netloc.lower().encode('utf-8')
+        return (zlib.crc32(host) & 0xffffffff) % self.shard_count == self.shard
+
+    def get_chunks(self, qs, chunk_size, start=0):
+        """
+        Yield lists of ``(id, long_url)`` tuples from a queryset,
+        loading ``chunk_size`` rows at a time.
+        """
+        qs = qs.order_by('pk').values_list('pk', 'long_url')
+        last = start
+        while True:
+            chunk = list(qs.filter(pk__gt=last)[:chunk_size])
+            if not chunk:
+                break
+            yield chunk
+            last = chunk[-1][0]
+
+    def check_chunk(self, chunk):
+        """
+        Check the distinct targets in a chunk that have not already
+        been checked, and store the results for every short URL.
+        """
+        ids = defaultdict(list)
+        for id, long_url in chunk:
+            ids[long_url].append(id)
+
+        urls = [url for url in ids if url not in self.results]
+        for url, response, error, latency in self.checker.check_many(urls, get_url=lambda url: url):
+            self.results[url] = get_result(response, error, latency)
+            metrics.observe('url_check_seconds', latency, result='error' if error is not None else 'ok')
+
+        for url, url_ids in ids.items():
+            ShortURLStatus.objects.record(url_ids, **self.results[url])
+
+    def get_report(self):
+        """
+        Return an informational text block with the failure details
+        for each short URL that failed its most recent check.
+        """
+        report = []
+        failures = ShortURLStatus.objects.exclude(error='').order_by('redirect_id')
+        for id, long_url, error in failures.values_list('redirect_id', 'redirect__long_url', 'error').iterator():
             edit_url = 'http://%s%s' % (
-                    self.domain, reverse('admin:deflect_shorturl_change', args=(url.id,)))
-            self.message += """
+                    self.domain, reverse('admin:deflect_shorturl_change', args=(id,)))
+            report.append("""
 
 Redirect {key} with target {target} returned {error}
 
 Edit this short URL: {edit_url}
-""".format(key=url.key, target=url.long_url, error=e, edit_url=edit_url)
+""".format(key=base32_crockford.encode(id), target=long_url, error=error, edit_url=edit_url))
+        return ''.join(report)
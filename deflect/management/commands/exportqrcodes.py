@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from deflect.exports import write_qr_codes
+from deflect.models import ShortURL
+
+
+class Command(BaseCommand):
+    help = "Export QR codes for short URLs to a ZIP archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="The path of the ZIP archive to write")
+        parser.add_argument('--format', choices=('png', 'svg'), default='png',
+                            help="The image format of the QR codes")
+        parser.add_argument('--size', type=int, default=10,
+                            help="The size of each QR code module in pixels")
+        parser.add_argument('--processes', type=int, default=None,
+                            help="The number of worker processes, defaulting to the number of CPUs")
+        parser.add_argument('--campaign', help="Only export short URLs for this campaign")
+        parser.add_argument('--medium', help="Only export short URLs for this medium")
+
+    def handle(self, *args, **options):
+        qs = ShortURL.objects.all()
+        if options['campaign'] is not None:
+            qs = qs.filter(campaign=options['campaign'])
+        if options['medium'] is not None:
+            qs = qs.filter(medium=options['medium'])
+        with open(options['output'], 'wb') as f:
+            count = write_qr_codes(f, qs, format=options['format'], box_size=options['size'],
+                                   processes=options['processes'])
+        self.stdout.write("Exported %d QR codes to %s" % (count, options['output']))
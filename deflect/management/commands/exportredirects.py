@@ -0,0 +1,32 @@
+import os
+import zlib
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from deflect.edge import RULE_FORMATS
+from deflect.edge import export_rules
+from deflect.models import Watermark
+
+
+class Command(BaseCommand):
+    help = "Export every short URL redirect as an nginx map or a JSON or CSV rule set"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="The path of the file to write")
+        parser.add_argument('--format', choices=RULE_FORMATS, default='nginx', help="The output format")
+        parser.add_argument('--full', action='store_true', default=False,
+                            help="Regenerate every rule, instead of only those changed since the last export")
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['output'])
+        # Each output file records the start of its last export, so
+        # changes made during an export are included in the next one
+        name = 'exportredirects:%08x' % (zlib.crc32(path.encode('utf-8')) & 0xffffffff)
+        watermark, created = Watermark.objects.get_or_create(name=name)
+        since = None if created or options['full'] else watermark.updated
+
+        start = now()
+        total, changed = export_rules(path, options['format'], since=since)
+        Watermark.objects.filter(pk=watermark.pk).update(updated=start)
+        self.stdout.write("Wrote %d rules to %s, %d regenerated" % (total, path, changed))
@@ -0,0 +1,45 @@
+import io
+
+from django.core.management.base import BaseCommand
+from django.utils import six
+
+from deflect.exports import get_export_rows
+from deflect.exports import stream_csv
+from deflect.exports import stream_json
+from deflect.models import ShortURL
+
+
+class Command(BaseCommand):
+    help = "Export short URLs and their statistics as CSV or JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', default='-',
+                            help="The path of the file to write, defaulting to standard output")
+        parser.add_argument('--format', choices=('csv', 'json'), default='csv',
+                            help="The output format")
+        parser.add_argument('--campaign', help="Only export short URLs for this campaign")
+        parser.add_argument('--medium', help="Only export short URLs for this medium")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="The number of rows to load at a time")
+
+    def handle(self, *args, **options):
+        qs = ShortURL.objects.all()
+        if options['campaign'] is not None:
+            qs = qs.filter(campaign=options['campaign'])
+        if options['medium'] is not None:
+            qs = qs.filter(medium=options['medium'])
+        stream = stream_json if options['format'] == 'json' else stream_csv
+        lines = stream(get_export_rows(qs, chunk_size=options['chunk_size']))
+
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        # The Python 2 csv module writes encoded bytes
+        if six.PY2 and options['format'] == 'csv':
+            f = open(options['output'], 'wb')
+        else:
+            f = io.open(options['output'], 'w', encoding='utf-8', newline='')
+        with f:
+            for line in lines:
+                f.write(line)
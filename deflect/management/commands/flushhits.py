@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from deflect.hits import flush_hits
+
+
+class Command(BaseCommand):
+    help = "Write buffered short URL hits to the database"
+
+    def handle(self, *args, **options):
+        count = flush_hits()
+        self.stdout.write("Updated hits for %d short URLs" % count)
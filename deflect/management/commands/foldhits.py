@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from deflect.models import ShortURL
+
+
+class Command(BaseCommand):
+    help = "Fold sharded short URL hits into the short URL hit counts"
+
+    def handle(self, *args, **options):
+        count = ShortURL.objects.fold_hit_shards()
+        self.stdout.write("Folded hit shards for %d short URLs" % count)
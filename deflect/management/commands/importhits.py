@@ -0,0 +1,31 @@
+import io
+import os
+
+from django.core.management.base import BaseCommand
+
+from deflect.edge import LogFile
+from deflect.edge import import_hits
+from deflect.models import Watermark
+
+
+class Command(BaseCommand):
+    help = "Add the redirects served by the edge to the hits, from access logs in the combined log format"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="The access log files to read")
+        parser.add_argument('--all', action='store_true', default=False,
+                            help="Import every request, instead of only those after the last import")
+
+    def handle(self, *args, **options):
+        total = 0
+        for path in options['paths']:
+            with io.open(path, 'rb') as f:
+                # The position in each file is stored by its inode, so
+                # a log renamed by rotation continues where it stopped
+                stat = os.fstat(f.fileno())
+                watermark, _ = Watermark.objects.get_or_create(name='importhits:%d:%d' % (stat.st_dev, stat.st_ino))
+                log = LogFile(f, offset=0 if options['all'] else watermark.position)
+                total += import_hits(log)
+            watermark.position = log.offset
+            watermark.save()
+        self.stdout.write("Imported %d hits" % total)
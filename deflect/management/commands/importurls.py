@@ -0,0 +1,48 @@
+import io
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.utils import six
+
+from deflect.imports import import_urls
+from deflect.imports import read_rows
+
+
+class Command(BaseCommand):
+    help = "Import short URLs from a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The file of short URLs to import")
+        parser.add_argument('--user',
+                            help="The username of the creator of the imported short URLs")
+        parser.add_argument('--format', choices=('csv', 'json'), default=None,
+                            help="The file format, defaulting to the file extension")
+        parser.add_argument('--check', action='store_true', default=False,
+                            help="Check the target URLs before importing them")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="The number of rows to insert at a time")
+
+    def handle(self, *args, **options):
+        if not options['user']:
+            raise CommandError("A creator must be given with --user")
+        user = get_user_model()
+        try:
+            creator = user.objects.get(**{user.USERNAME_FIELD: options['user']})
+        except user.DoesNotExist:
+            raise CommandError("User %s does not exist" % options['user'])
+
+        path = options['path']
+        format = options['format'] or ('json' if path.endswith(('.json', '.jsonl')) else 'csv')
+        # The Python 2 csv module reads bytes
+        if six.PY2 and format == 'csv':
+            f = open(path, 'rb')
+        else:
+            f = io.open(path, encoding='utf-8', newline='')
+        with f:
+            result = import_urls(read_rows(f, format), creator, check=options['check'],
+                                 chunk_size=options['chunk_size'])
+
+        for row, message in result.errors:
+            self.stderr.write("Row %d: %s" % (row, message))
+        self.stdout.write("Imported %d short URLs, skipped %d rows" % (result.created, len(result.errors)))
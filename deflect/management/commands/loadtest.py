@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from deflect.benchmarks import load_results
+from deflect.benchmarks import save_results
+from deflect.loadtest import DEFAULT_MIX
+from deflect.loadtest import TrafficMix
+from deflect.loadtest import check_thresholds
+from deflect.loadtest import create_links
+from deflect.loadtest import parse_mix
+from deflect.loadtest import run_load
+from deflect.loadtest import serve
+from deflect.loadtest import summarize
+
+
+class Command(BaseCommand):
+    help = "Load test the redirect view through a local WSGI server and a test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000, help="The number of requests to send")
+        parser.add_argument('--concurrency', type=int, default=10, help="The number of concurrent clients")
+        parser.add_argument('--links', type=int, default=1000, help="The number of short URLs to create")
+        parser.add_argument('--aliases', type=int, default=100, help="The number of short URLs with an alias")
+        parser.add_argument('--hot-keys', type=int, default=5, help="The number of frequently requested keys")
+        parser.add_argument('--mix', default=','.join('%s=%d' % item for item in DEFAULT_MIX.items()),
+                            help="The traffic mix, as comma separated kind=weight pairs")
+        parser.add_argument('--seed', type=int, default=None, help="The random seed for the traffic mix")
+        parser.add_argument('--max-p50', type=float, default=None, help="The maximum p50 latency in milliseconds")
+        parser.add_argument('--max-p99', type=float, default=None, help="The maximum p99 latency in milliseconds")
+        parser.add_argument('--min-throughput', type=float, default=None,
+                            help="The minimum throughput in requests per second")
+        parser.add_argument('--max-error-rate', type=float, default=0.0,
+                            help="The maximum fraction of failed requests")
+        parser.add_argument('--save', help="Save the summary as a baseline to this path")
+        parser.add_argument('--compare', help="Compare the summary against the baseline at this path")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="The fraction worse than the baseline that is reported as a regression")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        # Server threads need their own connections to the test
+        # database, so an in-memory SQLite database cannot be used
+        test_name = None
+        if connection.vendor == 'sqlite':
+            test_name = os.path.join(tempfile.mkdtemp(), 'loadtest.sqlite3')
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = test_name
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            keys, aliases = create_links(options['links'], options['aliases'])
+            traffic = TrafficMix(keys, aliases, mix=mix, hot_keys=options['hot_keys'], seed=options['seed'])
+            with override_settings(ALLOWED_HOSTS=['127.0.0.1'], DEBUG=False):
+                server = serve()
+                try:
+                    base_url = 'http://127.0.0.1:%d' % server.server_port
+                    results, duration = run_load(base_url, traffic, options['requests'], options['concurrency'])
+                finally:
+                    server.shutdown()
+                    server.server_close()
+        finally:
+            connection.close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if test_name is not None:
+                os.rmdir(os.path.dirname(test_name))
+
+        summary = summarize(results, duration)
+        self.stdout.write("%-8s %8s %9s %9s %8s" % ('kind', 'requests', 'p50 (ms)', 'p99 (ms)', 'errors'))
+        for kind, stats in list(summary['kinds'].items()) + [('total', summary)]:
+            self.stdout.write("%-8s %8d %9.2f %9.2f %7.2f%%" % (kind, stats['requests'], stats['p50'],
+                                                                stats['p99'], stats['error_rate'] * 100))
+        self.stdout.write("Throughput: %.1f requests/s" % summary['throughput'])
+
+        if options['save']:
+            save_results(summary, options['save'])
+        baseline = load_results(options['compare']) if options['compare'] else None
+        failures = check_thresholds(summary, max_p50=options['max_p50'], max_p99=options['max_p99'],
+                                    min_throughput=options['min_throughput'],
+                                    max_error_rate=options['max_error_rate'],
+                                    baseline=baseline, threshold=options['threshold'])
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures:
+            raise CommandError("%d load test thresholds failed" % len(failures))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from deflect.rollups import rollup_clicks
+
+
+class Command(BaseCommand):
+    help = "Add new click events to the click statistics rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help="The number of click events to process per transaction")
+
+    def handle(self, *args, **options):
+        count = rollup_clicks(chunk_size=options['chunk_size'])
+        self.stdout.write("Processed %d click events" % count)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from deflect.cache import redirect_cache
+
+
+class Command(BaseCommand):
+    help = "Load the most used short URLs into the redirect cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=getattr(settings, 'DEFLECT_WARMUP_SIZE', 0) or 1000,
+                            help="The number of short URLs to load")
+        parser.add_argument('--max-age', type=int, default=getattr(settings, 'DEFLECT_WARMUP_MAX_AGE', 604800),
+                            help="Only load short URLs used in the last this many seconds")
+        parser.add_argument('--force', action='store_true', default=False,
+                            help="Load the short URLs even if another process recently warmed the cache")
+
+    def handle(self, *args, **options):
+        if not redirect_cache.enabled:
+            raise CommandError("The redirect cache is not enabled")
+        # The in-process cache is discarded when the command exits
+        if not getattr(settings, 'DEFLECT_CACHE_BACKEND', None):
+            raise CommandError("Warming the redirect cache from a command requires DEFLECT_CACHE_BACKEND")
+        count = redirect_cache.warm(options['limit'], max_age=options['max_age'], force=options['force'])
+        if count is None:
+            self.stdout.write("The redirect cache was recently warmed by another process")
+        else:
+            self.stdout.write("Loaded %d short URLs into the redirect cache" % count)
@@ -0,0 +1,164 @@
+from __future__ import unicode_literals
+
+from bisect import bisect_left
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import Signal
+from django.dispatch import receiver
+
+
+# Sent for every counter increment and timing observation while
+# metrics are enabled, so they can be forwarded to another system
+metric_recorded = Signal(providing_args=['name', 'labels', 'value'])
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Timer(object):
+    """
+    A context manager that records the duration of its block as an
+    observation.
+    """
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.time() - self.start, **self.labels)
+
+
+class NullTimer(object):
+    """
+    A context manager that does nothing, used while metrics are
+    disabled.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+null_timer = NullTimer()
+
+
+class Metrics(object):
+    """
+    Collect counters and timing histograms in process memory, keyed
+    by name and labels. While ``DEFLECT_METRICS`` is disabled, every
+    method returns immediately and ``timer`` returns a shared no-op
+    context manager.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Discard every recorded value, and reload the configuration on
+        next use.
+        """
+        self.counters = {}
+        self.histograms = {}
+        self._enabled = None
+
+    @property
+    def enabled(self):
+        if self._enabled is None:
+            self._enabled = getattr(settings, 'DEFLECT_METRICS', False)
+        return self._enabled
+
+    def increment(self, name, value=1, **labels):
+        """
+        Add ``value`` to a counter.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        metric_recorded.send(sender=Metrics, name=name, labels=labels, value=value)
+
+    def observe(self, name, value, **labels):
+        """
+        Record a duration in seconds in a histogram.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][index] += 1
+            histogram[1] += value
+        metric_recorded.send(sender=Metrics, name=name, labels=labels, value=value)
+
+    def timer(self, name, **labels):
+        """
+        Return a context manager that records the duration of its
+        block in a histogram.
+        """
+        if not self.enabled:
+            return null_timer
+        return Timer(self, name, labels)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+def render_prometheus(metrics, prefix='deflect_'):
+    """
+    Return the counters and histograms of a ``Metrics`` instance in
+    the Prometheus text exposition format.
+    """
+    with metrics._lock:
+        counters = sorted(metrics.counters.items())
+        histograms = sorted((key, (list(buckets), total)) for key, (buckets, total) in metrics.histograms.items())
+
+    lines = []
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append('# TYPE %s%s counter' % (prefix, name))
+            typed.add(name)
+        lines.append('%s%s%s %s' % (prefix, name, _format_labels(labels), value))
+    for (name, labels), (buckets, total) in histograms:
+        if name not in typed:
+            lines.append('# TYPE %s%s histogram' % (prefix, name))
+            typed.add(name)
+        count = 0
+        for bound, bucket in zip(metrics.buckets + (float('inf'),), buckets):
+            count += bucket
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('%s%s_bucket%s %d' % (prefix, name, _format_labels(labels + (('le', le),)), count))
+        lines.append('%s%s_sum%s %r' % (prefix, name, _format_labels(labels), total))
+        lines.append('%s%s_count%s %d' % (prefix, name, _format_labels(labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+@receiver(setting_changed)
+def reset_metrics(**kwargs):
+    if kwargs['setting'].startswith('DEFLECT_METRICS'):
+        metrics.reset()
@@ -1,36 +1,126 @@
 from __future__ import unicode_literals
 
+from datetime import timedelta
+import random
+
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError
 from django.db import models
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import DateTimeField
 from django.db.models import F
+from django.db.models import IntegerField
+from django.db.models import Max
+from django.db.models import Q
+from django.db.models import Sum
+from django.db.models import Value
+from django.db.models import When
+from django.utils import six
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.functional import cached_property
+from django.utils.html import format_html
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
 import base32_crockford
-import requests
 
-from .utils import add_query_params
-from .utils import get_qr_code_img
+from .checker import get_checker
+from .hits import get_hit_buffer
+from .utils import compile_url
+from .utils import render_url
+
 
+class ShortURLQuerySet(models.QuerySet):
+    def with_shard_hits(self):
+        """
+        Annotate the queryset with the hits and last used timestamp
+        recorded in ``ShortURLHitShard``s.
+        """
+        return self.annotate(shard_hits=Sum('hit_shards__hits'),
+                             shard_last_used=Max('hit_shards__last_used'))
 
-class ShortURLManager(models.Manager):
+    def needs_check(self, max_age):
+        """
+        Filter the queryset to ``ShortURL``s whose target has never
+        been checked, was last checked more than ``max_age`` seconds
+        ago, or failed the last check.
+        """
+        cutoff = now() - timedelta(seconds=max_age)
+        return self.filter(Q(status__isnull=True) | Q(status__checked__lt=cutoff) | ~Q(status__error=''))
+
+
+class ShortURLManager(models.Manager.from_queryset(ShortURLQuerySet)):
     def increment_hits(self, id):
         """
         Increment a ``ShortURL``s hits by one, and set the last
-        used timestamp to the current time.
+        used timestamp to the current time. If a hit buffer is
+        configured, the hit is buffered and written in a later batch.
+        If hit shards are configured, the hit is added to a randomly
+        selected shard.
+        """
+        buffer = get_hit_buffer()
+        shards = getattr(settings, 'DEFLECT_HIT_SHARDS', 0)
+        if buffer is not None:
+            buffer.add(id, now())
+        elif shards:
+            ShortURLHitShard.objects.increment_hits(id, random.randrange(shards))
+        else:
+            self.filter(pk=id).update(hits=F('hits') + 1, last_used=now())
+
+    def apply_hits(self, hits, batch_size=500):
+        """
+        Apply buffered hits with one update per batch of ``ShortURL``s.
+        ``hits`` is a dict mapping ids to a tuple of the number of hits
+        and the most recent hit timestamp. The last used timestamp is
+        only ever moved forward.
         """
-        self.filter(pk=id).update(hits=F('hits') + 1, last_used=now())
+        ids = list(hits)
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            hits_case = Case(
+                *[When(pk=id, then=Value(hits[id][0])) for id in batch],
+                output_field=IntegerField()
+            )
+            last_used_case = Case(
+                *[When(Q(pk=id) & (Q(last_used__isnull=True) | Q(last_used__lt=hits[id][1])),
+                       then=Value(hits[id][1])) for id in batch],
+                default=F('last_used'),
+                output_field=DateTimeField()
+            )
+            self.filter(pk__in=batch).update(hits=F('hits') + hits_case, last_used=last_used_case)
 
-    def get_unique_list(self, field):
+    def fold_hit_shards(self):
+        """
+        Add the hits recorded in ``ShortURLHitShard``s to the
+        ``ShortURL``s they belong to, and reset the shards. Return the
+        number of ``ShortURL``s updated.
+        """
+        ids = list(ShortURLHitShard.objects.filter(hits__gt=0).values_list('redirect_id', flat=True).distinct())
+        for id in ids:
+            with transaction.atomic():
+                shards = ShortURLHitShard.objects.select_for_update().filter(redirect_id=id, hits__gt=0)
+                totals = shards.aggregate(hits=Sum('hits'), last_used=Max('last_used'))
+                if not totals['hits']:
+                    continue
+                shards.update(hits=0)
+                self.apply_hits({id: (totals['hits'], totals['last_used'])})
+        return len(ids)
+
+    def get_unique_list(self, field, limit=None):
         """
         Get a list of non-blank, unique values from a specified
-        field.
+        field, ordered by the most recently created ``ShortURL`` using
+        each value. If ``limit`` is given, return at most that many
+        values.
         """
         blank = {'%s__exact' % field: ''}
-        return self.exclude(**blank).values_list(field, flat=True).distinct()
+        qs = self.exclude(**blank).values_list(field).annotate(latest=Max('created')).order_by('-latest')
+        if limit is not None:
+            qs = qs[:limit]
+        return [value for value, latest in qs]
 
 
 @python_2_unicode_compatible
@@ -91,9 +181,19 @@ class ShortURL(models.Model):
         blank=True,
         help_text=_('The advertising or marketing medium, e.g.: postcard, banner, email newsletter'),
     )
+    updated = models.DateTimeField(
+        _('updated'),
+        auto_now=True,
+        db_index=True,
+    )
 
     objects = ShortURLManager()
 
+    # Fields required to build the redirect target without a query
+    redirect_fields = ('id', 'campaign', 'content', 'is_tracking', 'long_url', 'medium')
+    # Fields with suggested values in the admin
+    suggestion_fields = ('campaign', 'medium')
+
     class Meta:
         permissions = (
             ('list_all', 'Can list all short URLs'),
@@ -107,6 +207,8 @@ class ShortURL(models.Model):
     def save(self, *args, **kwargs):
         if not self.id:
             self.created = now()
+        # Discard the compiled target URL, as the fields may change
+        self.__dict__.pop('url_template', None)
         super(ShortURL, self).save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -118,12 +220,37 @@ class ShortURL(models.Model):
         except ShortURLAlias.DoesNotExist:
             return self.get_absolute_url()
 
-    def target_url(self, params={}):
+    def get_redirect_data(self):
         """
-        Return the complete redirect URL, including any provided query
-        parameters. If it is a tracking URL, inject available Google
-        campaign parameters into the destination URL.
+        Return a dict of the field values and compiled target URL
+        required to build the redirect, suitable for storing in a
+        cache.
+        """
+        data = dict((field, getattr(self, field)) for field in self.redirect_fields)
+        data['url_template'] = self.url_template
+        return data
+
+    @classmethod
+    def from_redirect_data(cls, data):
         """
+        Build an unsaved ``ShortURL`` instance from a dict returned by
+        ``get_redirect_data``.
+        """
+        data = dict(data)
+        url_template = data.pop('url_template', None)
+        instance = cls(**data)
+        if url_template is not None:
+            instance.url_template = url_template
+        return instance
+
+    @cached_property
+    def url_template(self):
+        """
+        Return the destination URL compiled with the Google campaign
+        parameters for a tracking URL, so only the incoming query
+        parameters need to be merged for each redirect.
+        """
+        params = {}
         if self.is_tracking:
             params['utm_source'] = self.key
             params['utm_campaign'] = self.campaign.lower()
@@ -131,9 +258,49 @@ class ShortURL(models.Model):
             params['utm_medium'] = self.medium.lower()
             if getattr(settings, 'DEFLECT_NOOVERRIDE', False):
                 params['utm_nooverride'] = '1'
-        return add_query_params(self.long_url, params)
+        return compile_url(self.long_url, params)
+
+    def target_url(self, params=None):
+        """
+        Return the complete redirect URL, including any provided query
+        parameters. If it is a tracking URL, inject available Google
+        campaign parameters into the destination URL.
+        """
+        return render_url(self.url_template, params)
     target_url.short_description = 'target URL'
 
+    def get_hits(self):
+        """
+        Return the total hits, including any recorded in hit shards
+        that have not yet been folded into the ``ShortURL``.
+        """
+        if hasattr(self, 'shard_hits'):
+            shard_hits = self.shard_hits
+        elif getattr(settings, 'DEFLECT_HIT_SHARDS', 0):
+            shard_hits = self.hit_shards.aggregate(hits=Sum('hits'))['hits']
+        else:
+            shard_hits = None
+        return self.hits + (shard_hits or 0)
+    get_hits.admin_order_field = 'hits'
+    get_hits.short_description = 'hits'
+
+    def get_last_used(self):
+        """
+        Return the last used timestamp, including any recorded in hit
+        shards that have not yet been folded into the ``ShortURL``.
+        """
+        if hasattr(self, 'shard_last_used'):
+            shard_last_used = self.shard_last_used
+        elif getattr(settings, 'DEFLECT_HIT_SHARDS', 0):
+            shard_last_used = self.hit_shards.aggregate(last_used=Max('last_used'))['last_used']
+        else:
+            shard_last_used = None
+        if shard_last_used is None or (self.last_used and self.last_used > shard_last_used):
+            return self.last_used
+        return shard_last_used
+    get_last_used.admin_order_field = 'last_used'
+    get_last_used.short_description = 'last used'
+
     @property
     def key(self):
         return base32_crockford.encode(self.pk)
@@ -141,9 +308,12 @@ class ShortURL(models.Model):
     def short_url(self, alias=True):
         """
         Return the complete short URL for the current redirect. If
-        ``alias`` is ``True``, use the URL alias when available.
+        ``alias`` is ``True``, use the URL alias when available. A
+        ``site_domain`` annotation is used in place of the current
+        ``Site``, when present.
         """
-        base = 'http://%s' % Site.objects.get_current().domain
+        domain = getattr(self, 'site_domain', None) or Site.objects.get_current().domain
+        base = 'http://%s' % domain
         if alias:
             return base + self.get_alias_url()
         return base + self.get_absolute_url()
@@ -151,10 +321,11 @@ class ShortURL(models.Model):
 
     def qr_code(self):
         """
-        Return a HTML img tag with an inline representation of the
-        short URL as a QR code. The absolute URL is used for the URL.
+        Return a HTML img tag displaying the short URL as a QR code,
+        served by the QR code view. The absolute URL is used for the
+        URL.
         """
-        return get_qr_code_img(self.short_url(alias=False))
+        return format_html('<img src="{0}" />', reverse('deflect:qr_code', args=[self.key, 'png']))
     qr_code.allow_tags = True
     qr_code.short_description = 'QR code'
 
@@ -163,10 +334,7 @@ class ShortURL(models.Model):
         Validate the destination URL, checking for connection errors
         or invalid HTTP status codes.
         """
-        headers = getattr(settings, 'DEFLECT_REQUESTS_HEADERS', None)
-        timeout = getattr(settings, 'DEFLECT_REQUESTS_TIMEOUT', 3.0)
-        r = requests.get(self.long_url, headers=headers, timeout=timeout, allow_redirects=True)
-        r.raise_for_status()
+        get_checker().check(self.long_url)
 
 
 @python_2_unicode_compatible
@@ -194,3 +362,257 @@ class ShortURLAlias(models.Model):
         if self.alias:
             self.alias = self.alias.lower()
         super(ShortURLAlias, self).save(*args, **kwargs)
+
+
+class ShortURLHitShardManager(models.Manager):
+    def increment_hits(self, redirect_id, shard):
+        """
+        Increment the hits of a single shard by one, and set the last
+        used timestamp to the current time. The shard is created on
+        first use.
+        """
+        timestamp = now()
+        qs = self.filter(redirect_id=redirect_id, shard=shard)
+        if qs.update(hits=F('hits') + 1, last_used=timestamp):
+            return
+        try:
+            with transaction.atomic():
+                self.create(redirect_id=redirect_id, shard=shard, hits=1, last_used=timestamp)
+        except IntegrityError:
+            # Another process created the shard first
+            qs.update(hits=F('hits') + 1, last_used=timestamp)
+
+
+@python_2_unicode_compatible
+class ShortURLHitShard(models.Model):
+    """
+    A ``ShortURLHitShard`` holds part of the hit count for a
+    ``ShortURL``, so that concurrent redirects to the same short URL
+    update different rows.
+    """
+    redirect = models.ForeignKey(ShortURL, related_name='hit_shards')
+    shard = models.PositiveSmallIntegerField(
+        _('shard'),
+    )
+    hits = models.IntegerField(
+        _('hits'),
+        default=0,
+    )
+    last_used = models.DateTimeField(
+        _('last used'),
+        blank=True,
+        null=True,
+    )
+
+    objects = ShortURLHitShardManager()
+
+    class Meta:
+        unique_together = ('redirect', 'shard')
+        verbose_name = _('hit shard')
+        verbose_name_plural = _('hit shards')
+
+    def __str__(self):
+        return '%s/%d' % (self.redirect_id, self.shard)
+
+
+@python_2_unicode_compatible
+class ClickEvent(models.Model):
+    """
+    A ``ClickEvent`` records a single redirect of a ``ShortURL``,
+    when click events are enabled.
+    """
+    redirect = models.ForeignKey(ShortURL, related_name='clicks')
+    timestamp = models.DateTimeField(
+        _('timestamp'),
+        db_index=True,
+    )
+    referrer = models.TextField(
+        _('referrer'),
+        blank=True,
+    )
+    user_agent_family = models.CharField(
+        _('user agent family'),
+        max_length=32,
+        blank=True,
+    )
+    query_params = models.TextField(
+        _('query parameters'),
+        blank=True,
+        help_text=_('The query parameters provided to the short URL, encoded as JSON'),
+    )
+
+    class Meta:
+        verbose_name = _('click event')
+        verbose_name_plural = _('click events')
+
+    def __str__(self):
+        return '%s %s' % (self.redirect_id, self.timestamp)
+
+
+class ClickRollup(models.Model):
+    """
+    An abstract count of ``ClickEvent``s over a period of time.
+    """
+    clicks = models.IntegerField(
+        _('clicks'),
+        default=0,
+    )
+
+    class Meta:
+        abstract = True
+
+
+@python_2_unicode_compatible
+class HourlyClickRollup(ClickRollup):
+    """
+    A ``HourlyClickRollup`` counts the clicks on a ``ShortURL``
+    within an hour.
+    """
+    redirect = models.ForeignKey(ShortURL, related_name='hourly_clicks')
+    hour = models.DateTimeField(
+        _('hour'),
+    )
+
+    class Meta:
+        unique_together = ('redirect', 'hour')
+        verbose_name = _('hourly click rollup')
+        verbose_name_plural = _('hourly click rollups')
+
+    def __str__(self):
+        return '%s %s' % (self.redirect_id, self.hour)
+
+
+@python_2_unicode_compatible
+class DailyClickRollup(ClickRollup):
+    """
+    A ``DailyClickRollup`` counts the clicks on a ``ShortURL``
+    within a day.
+    """
+    redirect = models.ForeignKey(ShortURL, related_name='daily_clicks')
+    date = models.DateField(
+        _('date'),
+    )
+
+    class Meta:
+        unique_together = ('redirect', 'date')
+        verbose_name = _('daily click rollup')
+        verbose_name_plural = _('daily click rollups')
+
+    def __str__(self):
+        return '%s %s' % (self.redirect_id, self.date)
+
+
+@python_2_unicode_compatible
+class CampaignClickRollup(ClickRollup):
+    """
+    A ``CampaignClickRollup`` counts the clicks on all ``ShortURL``s
+    with the same campaign and medium within a day.
+    """
+    campaign = models.CharField(
+        _('campaign'),
+        max_length=64,
+        blank=True,
+    )
+    medium = models.CharField(
+        _('medium'),
+        max_length=64,
+        blank=True,
+    )
+    date = models.DateField(
+        _('date'),
+    )
+
+    class Meta:
+        unique_together = ('campaign', 'medium', 'date')
+        verbose_name = _('campaign click rollup')
+        verbose_name_plural = _('campaign click rollups')
+
+    def __str__(self):
+        return '%s/%s %s' % (self.campaign, self.medium, self.date)
+
+
+@python_2_unicode_compatible
+class Watermark(models.Model):
+    """
+    A ``Watermark`` records how far an incremental job has
+    progressed, so the next run only processes newer data.
+    """
+    name = models.CharField(
+        _('name'),
+        max_length=64,
+        unique=True,
+    )
+    position = models.BigIntegerField(
+        _('position'),
+        default=0,
+    )
+    updated = models.DateTimeField(
+        _('updated'),
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = _('watermark')
+        verbose_name_plural = _('watermarks')
+
+    def __str__(self):
+        return '%s: %d' % (self.name, self.position)
+
+
+class ShortURLStatusManager(models.Manager):
+    def record(self, ids, status_code=None, error='', final_url='', latency=None):
+        """
+        Store the result of checking a target URL for each of the
+        given ``ShortURL`` ids.
+        """
+        fields = {
+            'checked': now(),
+            'status_code': status_code,
+            'error': error,
+            'final_url': final_url,
+            'latency': latency,
+        }
+        self.filter(redirect_id__in=ids).update(**fields)
+        existing = set(self.filter(redirect_id__in=ids).values_list('redirect_id', flat=True))
+        self.bulk_create([self.model(redirect_id=id, **fields) for id in ids if id not in existing])
+
+
+@python_2_unicode_compatible
+class ShortURLStatus(models.Model):
+    """
+    A ``ShortURLStatus`` stores the result of the most recent check
+    of a ``ShortURL`` target.
+    """
+    redirect = models.OneToOneField(ShortURL, related_name='status')
+    checked = models.DateTimeField(
+        _('last checked'),
+    )
+    status_code = models.PositiveSmallIntegerField(
+        _('status code'),
+        blank=True,
+        null=True,
+    )
+    error = models.TextField(
+        _('error'),
+        blank=True,
+    )
+    final_url = models.TextField(
+        _('final URL'),
+        blank=True,
+        help_text=_('The URL reached after following any redirects'),
+    )
+    latency = models.FloatField(
+        _('latency'),
+        blank=True,
+        null=True,
+        help_text=_('The duration of the check in seconds'),
+    )
+
+    objects = ShortURLStatusManager()
+
+    class Meta:
+        verbose_name = _('status')
+        verbose_name_plural = _('statuses')
+
+    def __str__(self):
+        return self.error or six.text_type(self.status_code)
@@ -0,0 +1,66 @@
+from __future__ import unicode_literals
+
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Max
+from django.utils.timezone import is_aware
+from django.utils.timezone import localtime
+from django.utils.timezone import now
+
+from .models import CampaignClickRollup
+from .models import ClickEvent
+from .models import DailyClickRollup
+from .models import HourlyClickRollup
+from .models import Watermark
+
+
+WATERMARK = 'rollupclicks'
+
+
+def _add_clicks(model, counts, fields):
+    """
+    Add click counts to the rollup rows identified by ``fields``,
+    creating rows that do not exist yet.
+    """
+    for values, clicks in counts.items():
+        lookup = dict(zip(fields, values))
+        if not model.objects.filter(**lookup).update(clicks=F('clicks') + clicks):
+            model.objects.create(clicks=clicks, **lookup)
+
+
+def rollup_clicks(chunk_size=10000, settle=timedelta(minutes=5)):
+    """
+    Add ``ClickEvent``s newer than the last run to the hourly, daily
+    and campaign rollups. Events from the last ``settle`` period are
+    left for the next run, as they may still be waiting to be written
+    out of order. Return the number of events processed.
+    """
+    watermark, _ = Watermark.objects.get_or_create(name=WATERMARK)
+    start = watermark.position
+    end = ClickEvent.objects.filter(timestamp__lt=now() - settle).aggregate(pk=Max('pk'))['pk'] or start
+    processed = 0
+
+    while start < end:
+        stop = min(start + chunk_size, end)
+        events = ClickEvent.objects.filter(pk__gt=start, pk__lte=stop).values_list(
+            'redirect_id', 'timestamp', 'redirect__campaign', 'redirect__medium')
+        hourly = Counter()
+        daily = Counter()
+        campaign = Counter()
+        for redirect_id, timestamp, campaign_name, medium in events.iterator():
+            date = (localtime(timestamp) if is_aware(timestamp) else timestamp).date()
+            hourly[(redirect_id, timestamp.replace(minute=0, second=0, microsecond=0))] += 1
+            daily[(redirect_id, date)] += 1
+            campaign[(campaign_name, medium, date)] += 1
+            processed += 1
+
+        with transaction.atomic():
+            _add_clicks(HourlyClickRollup, hourly, ('redirect_id', 'hour'))
+            _add_clicks(DailyClickRollup, daily, ('redirect_id', 'date'))
+            _add_clicks(CampaignClickRollup, campaign, ('campaign', 'medium', 'date'))
+            Watermark.objects.filter(pk=watermark.pk).update(position=stop, updated=now())
+        start = stop
+    return processed
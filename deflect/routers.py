@@ -0,0 +1,60 @@
+from __future__ import unicode_literals
+
+import random
+
+from django.conf import settings
+from django.utils import six
+
+
+def get_write_db():
+    """
+    Return the database alias of the primary database for the
+    ``deflect`` models.
+    """
+    return getattr(settings, 'DEFLECT_WRITE_DB', 'default')
+
+
+def get_read_db():
+    """
+    Return the database alias used to look up redirects, or ``None``
+    if ``DEFLECT_READ_DB`` is not set. If it is a list of aliases, one
+    is chosen at random for each lookup.
+    """
+    read_db = getattr(settings, 'DEFLECT_READ_DB', None)
+    if not read_db:
+        return None
+    if isinstance(read_db, six.string_types):
+        return read_db
+    return random.choice(read_db)
+
+
+class RedirectRouter(object):
+    """
+    Send every read and write of the ``deflect`` models to
+    ``DEFLECT_WRITE_DB``, so the admin, management commands and hit
+    updates always see the latest data. Redirect lookups choose a
+    database with ``get_read_db`` instead, which sends them to the
+    ``DEFLECT_READ_DB`` replicas. Add it to ``DATABASE_ROUTERS`` as
+    ``'deflect.routers.RedirectRouter'``.
+    """
+    app_label = 'deflect'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return get_write_db()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return get_write_db()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary, so objects
+        # loaded from either can be related
+        if self.app_label in (obj1._meta.app_label, obj2._meta.app_label):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        return None
@@ -0,0 +1,140 @@
+from __future__ import unicode_literals
+
+import logging
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from .bloom import redirect_filter
+from .cache import redirect_cache
+from .cache import suggestion_cache
+from .index import redirect_index
+from .models import ShortURL
+from .models import ShortURLAlias
+
+
+logger = logging.getLogger(__name__)
+
+
+def _invalidate(keys):
+    redirect_cache.delete(*keys)
+    redirect_index.discard(*keys)
+
+
+def invalidate(*keys):
+    """
+    Remove cached and indexed redirect data for keys and aliases now,
+    and again once the current transaction commits, as a redirect
+    handled before the commit can cache the previous data again.
+    """
+    _invalidate(keys)
+    transaction.on_commit(lambda: _invalidate(keys))
+
+
+@receiver(post_save, sender=ShortURL)
+@receiver(post_delete, sender=ShortURL)
+def invalidate_shorturl(sender, instance, **kwargs):
+    """
+    Remove cached and indexed redirect data for a ``ShortURL`` when
+    it is changed or deleted.
+    """
+    if not redirect_cache.enabled and not redirect_index.enabled:
+        return
+    aliases = ShortURLAlias.objects.filter(redirect_id=instance.pk).values_list('alias', flat=True)
+    invalidate(instance.key, *aliases)
+
+
+@receiver(pre_save, sender=ShortURLAlias)
+def invalidate_previous_alias(sender, instance, **kwargs):
+    """
+    Remove cached and indexed redirect data for the previous value of
+    an alias that is being changed.
+    """
+    if not (redirect_cache.enabled or redirect_index.enabled) or not instance.pk:
+        return
+    aliases = ShortURLAlias.objects.filter(pk=instance.pk).values_list('alias', flat=True)
+    invalidate(*aliases)
+
+
+@receiver(post_save, sender=ShortURLAlias)
+@receiver(post_delete, sender=ShortURLAlias)
+def invalidate_alias(sender, instance, **kwargs):
+    """
+    Remove cached and indexed redirect data for an alias when it is
+    created, changed or deleted. A new alias may shadow a cached key.
+    """
+    invalidate(instance.alias)
+
+
+@receiver(post_save, sender=ShortURL)
+def add_shorturl_to_filter(sender, instance, created, **kwargs):
+    """
+    Add a new ``ShortURL`` key to the redirect filter.
+    """
+    if created:
+        redirect_filter.add(id=instance.pk)
+
+
+@receiver(post_save, sender=ShortURLAlias)
+def add_alias_to_filter(sender, instance, **kwargs):
+    """
+    Add a new or changed alias to the redirect filter.
+    """
+    redirect_filter.add(alias=instance.alias)
+
+
+@receiver(post_save, sender=ShortURL)
+def add_suggestions(sender, instance, **kwargs):
+    """
+    Add the campaign and medium of a saved ``ShortURL`` to the
+    suggested values.
+    """
+    for field in ShortURL.suggestion_fields:
+        suggestion_cache.add(field, getattr(instance, field))
+
+
+@receiver(post_delete, sender=ShortURL)
+def remove_suggestions(sender, instance, **kwargs):
+    """
+    Remove the campaign and medium of a deleted ``ShortURL`` from the
+    suggested values, if no other ``ShortURL`` uses them.
+    """
+    for field in ShortURL.suggestion_fields:
+        value = getattr(instance, field)
+        if value and not ShortURL.objects.filter(**{field: value}).exists():
+            suggestion_cache.remove(field, value)
+
+
+@receiver(post_save, sender=ShortURLAlias)
+@receiver(post_delete, sender=ShortURLAlias)
+def touch_shorturl(sender, instance, **kwargs):
+    """
+    Mark a ``ShortURL`` as updated when its alias is created, changed
+    or deleted, so incremental exports include the change.
+    """
+    ShortURL.objects.filter(pk=instance.redirect_id).update(updated=now())
+
+
+def warm_redirect_cache(sender, **kwargs):
+    """
+    Warm the redirect cache with the most used ``ShortURL``s when a
+    process handles its first request. This is connected in
+    ``DeflectConfig.ready`` when ``DEFLECT_WARMUP_SIZE`` is set, and
+    waits for a request so management commands do not query the
+    database on startup.
+    """
+    request_started.disconnect(dispatch_uid='deflect.warm_redirect_cache')
+    try:
+        count = redirect_cache.warm(getattr(settings, 'DEFLECT_WARMUP_SIZE', 0),
+                                    max_age=getattr(settings, 'DEFLECT_WARMUP_MAX_AGE', 604800))
+    except Exception:
+        logger.exception("Error warming the redirect cache")
+        return
+    if count is not None:
+        logger.info("Warmed the redirect cache with %d short URLs" % count)
@@ -0,0 +1,59 @@
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+from django.db import close_old_connections
+from django.utils.six.moves import queue
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWorker(object):
+    """
+    Run callables on a daemon thread, outside of the request and
+    response cycle. If the queue is full, callables are run in the
+    calling thread instead of being dropped.
+    """
+    def __init__(self, name, maxsize=10000):
+        self.name = name
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        if self._thread is None or not self._thread.is_alive():
+            self._start()
+        try:
+            self._queue.put_nowait((func, args, kwargs))
+        except queue.Full:
+            logger.warning("Background queue %s is full, running task synchronously" % self.name)
+            func(*args, **kwargs)
+
+    def join(self):
+        """
+        Block until every submitted callable has run.
+        """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception("Error running background task in %s" % self.name)
+            finally:
+                self._queue.task_done()
+            # Release the database connection once the queue is idle,
+            # as is done at the end of a request
+            if self._queue.empty():
+                close_old_connections()
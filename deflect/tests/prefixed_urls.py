@@ -0,0 +1,7 @@
+from django.conf.urls import include
+from django.conf.urls import url
+
+
+urlpatterns = [
+    url(r'^r/', include('deflect.urls')),
+]
@@ -0,0 +1,81 @@
+from __future__ import unicode_literals
+
+import json
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+
+from ..models import ShortURL
+from ..models import ShortURLAlias
+
+
+@override_settings(ROOT_URLCONF='deflect.tests.urls')
+class ShortURLAdminTests(TestCase):
+    """
+    Tests for the ``ShortURL`` admin.
+    """
+    def setUp(self):
+        """
+        Create users to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.other = user.objects.create_user('other', 'other@example.com', 'password')
+        self.other.is_staff = True
+        self.other.save()
+        self.other.user_permissions.add(Permission.objects.get(codename='change_shorturl'))
+        self.url = reverse('admin:deflect_shorturl_changelist')
+
+    def create_shorturls(self, count, creator):
+        for i in range(count):
+            shorturl = ShortURL.objects.create(long_url='http://www.example.com/%d' % i, creator=creator)
+            ShortURLAlias.objects.create(redirect=shorturl, alias='%s-%d' % (creator.username, i))
+
+    def count_changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_query_count(self):
+        """
+        The number of queries to display the changelist should not
+        depend on the number of rows.
+        """
+        self.client.login(username='admin', password='password')
+        self.create_shorturls(1, self.user)
+        self.count_changelist_queries()
+        expected = self.count_changelist_queries()
+        self.create_shorturls(20, self.other)
+        self.assertEqual(self.count_changelist_queries(), expected)
+
+    def test_changelist_owner(self):
+        """
+        Users without the ``list_all`` permission should only see
+        their own ``ShortURL``s.
+        """
+        self.create_shorturls(1, self.user)
+        self.create_shorturls(2, self.other)
+        self.client.login(username='other', password='password')
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        self.assertContains(response, 'http://example.com/other-0')
+
+    def test_export_json(self):
+        """
+        The JSON export action should stream a line for each selected
+        short URL.
+        """
+        self.create_shorturls(3, self.user)
+        selected = ShortURL.objects.order_by('pk').values_list('pk', flat=True)[:2]
+        self.client.login(username='admin', password='password')
+        response = self.client.post(self.url, {'action': 'export_json', '_selected_action': list(selected)})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['alias_url'] for line in lines],
+                         ['http://example.com/admin-0', 'http://example.com/admin-1'])
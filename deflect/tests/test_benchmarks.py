@@ -0,0 +1,42 @@
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from ..benchmarks import benchmarks
+from ..benchmarks import compare_results
+from ..benchmarks import run_benchmarks
+
+
+class BenchmarkTests(TestCase):
+    """
+    Tests for the redirect benchmarks.
+    """
+    def test_run_benchmarks(self):
+        """
+        Every benchmark should run and report its time and queries
+        per call.
+        """
+        results = run_benchmarks(number=1, repeat=1)
+        self.assertEqual(list(results), list(benchmarks))
+        self.assertEqual(results['decode_key']['queries'], 0)
+        self.assertGreater(results['redirect_alias']['queries'], 0)
+        self.assertGreater(results['redirect_alias']['time'], 0)
+
+    def test_compare_results(self):
+        """
+        Benchmarks that are slower than the threshold, or run more
+        queries than the baseline, should be reported.
+        """
+        baseline = {
+            'fast': {'time': 1.0, 'queries': 1},
+            'slow': {'time': 1.0, 'queries': 1},
+            'queries': {'time': 1.0, 'queries': 1},
+        }
+        results = {
+            'fast': {'time': 1.1, 'queries': 1},
+            'slow': {'time': 1.5, 'queries': 1},
+            'queries': {'time': 1.0, 'queries': 2},
+            'new': {'time': 1.0, 'queries': 1},
+        }
+        regressions = compare_results(results, baseline, threshold=0.2)
+        self.assertEqual(sorted(name for name, message in regressions), ['queries', 'slow'])
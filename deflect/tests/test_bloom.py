@@ -0,0 +1,218 @@
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+import base32_crockford
+
+from .. import bloom
+from ..bloom import BloomFilter
+from ..bloom import redirect_filter
+from ..models import ShortURL
+from ..models import ShortURLAlias
+from .test_views import SynchronousWorker
+
+
+class RecordingWorker(object):
+    """
+    Record submitted callables without running them.
+    """
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args, **kwargs):
+        self.submitted.append(func)
+
+
+class BloomFilterTests(TestCase):
+    """
+    Tests for the Bloom filter.
+    """
+    def test_membership(self):
+        """
+        Every added item should be a member, and a filter with a
+        small error rate should reject most other items.
+        """
+        bloom = BloomFilter(1000, error_rate=0.001)
+        for i in range(1000):
+            bloom.add('k:%d' % i)
+        for i in range(1000):
+            self.assertIn('k:%d' % i, bloom)
+        false_positives = sum(1 for i in range(1000, 11000) if 'k:%d' % i in bloom)
+        self.assertLess(false_positives, 50)
+
+
+@override_settings(DEFLECT_BLOOM_FILTER=True, DEFLECT_CACHE_BACKEND='default')
+class RedirectFilterTests(TestCase):
+    """
+    Tests for rejecting unknown keys without querying the database.
+    """
+    def setUp(self):
+        """
+        Create a user and model instance to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                                creator=self.user)
+        self.alias = ShortURLAlias.objects.create(redirect=self.shorturl,
+                                                  alias='test')
+        self.key = base32_crockford.encode(self.shorturl.pk)
+        self.invalid_key = base32_crockford.encode(self.shorturl.pk - 1)
+        caches['default'].clear()
+        self.rebuild_worker = bloom.rebuild_worker
+        bloom.rebuild_worker = SynchronousWorker()
+        redirect_filter.build()
+
+    def tearDown(self):
+        bloom.rebuild_worker = self.rebuild_worker
+
+    def test_invalid_key(self):
+        """
+        An unknown key should return a 404 status without querying
+        the database.
+        """
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('deflect:redirect', args=[self.invalid_key]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(redirect_filter.stats()['bloom_rejections'], 1)
+
+    def test_valid_key(self):
+        """
+        Known keys and aliases should still redirect.
+        """
+        response = self.client.get(reverse('deflect:redirect', args=[self.key]))
+        self.assertEqual(response.status_code, 301)
+        response = self.client.get(reverse('deflect:redirect', args=['test']))
+        self.assertEqual(response.status_code, 301)
+
+    def test_new_key(self):
+        """
+        Keys and aliases saved after the filter is built should
+        redirect.
+        """
+        shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                           creator=self.user)
+        ShortURLAlias.objects.create(redirect=shorturl, alias='new')
+        key = base32_crockford.encode(shorturl.pk)
+        response = self.client.get(reverse('deflect:redirect', args=[key]))
+        self.assertEqual(response.status_code, 301)
+        response = self.client.get(reverse('deflect:redirect', args=['new']))
+        self.assertEqual(response.status_code, 301)
+
+    def test_other_process(self):
+        """
+        Keys and aliases saved by another process should redirect
+        before the filter is rebuilt.
+        """
+        shorturl = ShortURL(long_url='http://www.example.com', creator=self.user, created=now())
+        ShortURL.objects.bulk_create([shorturl])
+        shorturl = ShortURL.objects.latest('pk')
+        ShortURLAlias.objects.bulk_create([ShortURLAlias(redirect=shorturl, alias='unused')])
+        bloom.rebuild_worker = RecordingWorker()
+        self.assertFalse(redirect_filter.is_missing(base32_crockford.encode(shorturl.pk)))
+        self.assertTrue(redirect_filter.is_missing('unused'))
+
+        caches['default'].set(redirect_filter.generation_key, 1, None)
+        self.assertFalse(redirect_filter.is_missing('unused'))
+        self.assertEqual(len(bloom.rebuild_worker.submitted), 1)
+
+    def test_background_rebuild(self):
+        """
+        An expired filter should be rebuilt on the worker, and used
+        until the rebuild finishes.
+        """
+        bloom.rebuild_worker = RecordingWorker()
+        with self.settings(DEFLECT_BLOOM_TIMEOUT=0):
+            redirect_filter.build()
+            self.assertTrue(redirect_filter.is_missing(self.invalid_key))
+            self.assertTrue(redirect_filter.is_missing(self.invalid_key))
+        self.assertEqual(len(bloom.rebuild_worker.submitted), 1)
+
+    @override_settings(DEFLECT_NEGATIVE_CACHE_TIMEOUT=60)
+    def test_negative_cache_new_key(self):
+        """
+        Keys above the largest id in the filter should not be added to
+        the negative cache, as another process may have saved them.
+        """
+        redirect_filter.build()
+        redirect_filter.add_miss(base32_crockford.encode(self.shorturl.pk + 1))
+        redirect_filter.add_miss('unused')
+        self.assertFalse(redirect_filter.is_missing(base32_crockford.encode(self.shorturl.pk + 1)))
+        self.assertEqual(redirect_filter.stats()['negative_cache_hits'], 0)
+        self.assertTrue(redirect_filter.is_missing('unused'))
+        self.assertEqual(redirect_filter.stats()['negative_cache_hits'], 1)
+
+    def test_requires_backend(self):
+        """
+        The filter should not be enabled without a shared cache
+        backend.
+        """
+        with self.settings(DEFLECT_CACHE_BACKEND=None):
+            with self.assertRaises(ImproperlyConfigured):
+                redirect_filter.is_missing(self.key)
+
+
+@override_settings(DEFLECT_BLOOM_FILTER=True, DEFLECT_CACHE_BACKEND='default')
+class RedirectFilterCommitTests(TransactionTestCase):
+    """
+    Tests for notifying other processes of new keys and aliases.
+    """
+    def test_generation_on_commit(self):
+        """
+        The shared generation should only change once the new alias
+        is committed.
+        """
+        cache = caches['default']
+        cache.set(redirect_filter.generation_key, 0, None)
+        user = get_user_model().objects.create_user('testing')
+        shorturl = ShortURL.objects.create(long_url='http://www.example.com', creator=user)
+        generation = cache.get(redirect_filter.generation_key)
+        with transaction.atomic():
+            ShortURLAlias.objects.create(redirect=shorturl, alias='test')
+            self.assertEqual(cache.get(redirect_filter.generation_key), generation)
+        self.assertEqual(cache.get(redirect_filter.generation_key), generation + 1)
+
+
+@override_settings(DEFLECT_NEGATIVE_CACHE_TIMEOUT=60)
+class NegativeCacheTests(TestCase):
+    """
+    Tests for caching unknown keys.
+    """
+    def setUp(self):
+        """
+        Create a user and model instance to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                                creator=self.user)
+
+    def test_negative_cache(self):
+        """
+        A repeated unknown key should return a 404 status without
+        querying the database.
+        """
+        url = reverse('deflect:redirect', args=['missing'])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(redirect_filter.stats()['negative_cache_hits'], 1)
+
+    def test_new_alias(self):
+        """
+        Saving an alias should remove it from the negative cache.
+        """
+        url = reverse('deflect:redirect', args=['missing'])
+        self.client.get(url)
+        ShortURLAlias.objects.create(redirect=self.shorturl, alias='missing')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 301)
@@ -0,0 +1,268 @@
+from __future__ import unicode_literals
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import CommandError
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from django.utils.timezone import now
+
+import base32_crockford
+
+from ..cache import LRUCache
+from ..cache import redirect_cache
+from ..cache import suggestion_cache
+from ..models import ShortURL
+from ..models import ShortURLAlias
+from ..signals import warm_redirect_cache
+
+
+class LRUCacheTests(TestCase):
+    """
+    Tests for the in-process LRU cache.
+    """
+    def test_get_set(self):
+        """
+        A stored value should be returned, and a missing key should
+        return the default.
+        """
+        cache = LRUCache()
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertIsNone(cache.get('missing'))
+
+    def test_max_size(self):
+        """
+        The least recently used entry should be evicted when the
+        cache is full.
+        """
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+
+    def test_timeout(self):
+        """
+        An expired entry should not be returned.
+        """
+        cache = LRUCache(timeout=0.01)
+        cache.set('key', 'value')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('key'))
+
+
+@override_settings(DEFLECT_CACHE_SIZE=100)
+class RedirectCacheTests(TestCase):
+    """
+    Tests for caching redirect resolution.
+    """
+    def setUp(self):
+        """
+        Create a user and model instance to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                                creator=self.user,
+                                                campaign='Example',
+                                                medium='Email',
+                                                content='Test')
+        self.alias = ShortURLAlias.objects.create(redirect=self.shorturl,
+                                                  alias='test')
+        self.key = base32_crockford.encode(self.shorturl.pk)
+
+    def test_warm_redirect(self):
+        """
+        A cached redirect should only query the database to update
+        the hit statistics.
+        """
+        url = reverse('deflect:redirect', args=[self.key])
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertIn('utm_campaign=example', response['Location'])
+
+    def test_warm_alias(self):
+        """
+        A cached alias should only query the database to update the
+        hit statistics.
+        """
+        url = reverse('deflect:redirect', args=['test'])
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertIn('utm_source=' + self.key, response['Location'])
+
+    def test_invalidate_shorturl(self):
+        """
+        Saving a ``ShortURL`` should remove its cached key and alias.
+        """
+        self.client.get(reverse('deflect:redirect', args=[self.key]))
+        self.client.get(reverse('deflect:redirect', args=['test']))
+        self.shorturl.campaign = 'Changed'
+        self.shorturl.save()
+        self.assertIsNone(redirect_cache.get(self.key))
+        self.assertIsNone(redirect_cache.get('test'))
+        response = self.client.get(reverse('deflect:redirect', args=['test']))
+        self.assertIn('utm_campaign=changed', response['Location'])
+
+    def test_invalidate_alias(self):
+        """
+        Changing or deleting an alias should remove the previously
+        cached alias.
+        """
+        self.client.get(reverse('deflect:redirect', args=['test']))
+        self.alias.alias = 'renamed'
+        self.alias.save()
+        self.assertIsNone(redirect_cache.get('test'))
+        response = self.client.get(reverse('deflect:redirect', args=['test']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_non_canonical_key(self):
+        """
+        Only the canonical form of a key should be cached.
+        """
+        self.client.get(reverse('deflect:redirect', args=[self.key + '-']))
+        self.assertIsNone(redirect_cache.get(self.key + '-'))
+
+    def test_warm(self):
+        """
+        Warming the cache should load the most used keys and aliases,
+        and skip ``ShortURL``s not used recently.
+        """
+        unused = ShortURL.objects.create(long_url='http://www.example.com/unused', creator=self.user)
+        ShortURL.objects.filter(pk=self.shorturl.pk).update(hits=10, last_used=now())
+        self.assertEqual(redirect_cache.warm(10, max_age=3600), 1)
+        self.assertIsNone(redirect_cache.get(unused.key))
+        for key in (self.key, 'test'):
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('deflect:redirect', args=[key]))
+            self.assertIn('utm_campaign=example', response['Location'])
+
+    def test_warm_shadowed_key(self):
+        """
+        Warming the cache should skip a key that is also the alias of
+        a ``ShortURL`` that is not loaded.
+        """
+        other = ShortURL.objects.create(long_url='http://www.example.com/other', creator=self.user)
+        ShortURLAlias.objects.create(redirect=other, alias=self.key.lower())
+        ShortURL.objects.filter(pk=self.shorturl.pk).update(hits=10)
+        self.assertEqual(redirect_cache.warm(1), 1)
+        self.assertIsNone(redirect_cache.get(self.key))
+        self.assertIsNotNone(redirect_cache.get('test'))
+        response = self.client.get(reverse('deflect:redirect', args=[self.key]))
+        self.assertEqual(response['Location'], other.target_url())
+
+    @override_settings(DEFLECT_CACHE_BACKEND='default')
+    def test_warm_once_per_host(self):
+        """
+        With a shared cache backend, only the first process to warm
+        the cache should query the database.
+        """
+        caches['default'].clear()
+        self.assertEqual(redirect_cache.warm(10), 1)
+        redirect_cache.reset()
+        with self.assertNumQueries(0):
+            self.assertIsNone(redirect_cache.warm(10))
+        self.assertIsNotNone(redirect_cache.get('test'))
+        self.assertEqual(redirect_cache.warm(10, force=True), 1)
+
+    @override_settings(DEFLECT_WARMUP_SIZE=10, DEFLECT_WARMUP_MAX_AGE=None)
+    def test_warm_first_request(self):
+        """
+        The cache should be warmed when the first request starts, if
+        enabled.
+        """
+        request_started.connect(warm_redirect_cache, dispatch_uid='deflect.warm_redirect_cache')
+        self.client.get(reverse('deflect:redirect', args=['missing']))
+        self.assertIsNotNone(redirect_cache.get(self.key))
+        self.assertFalse(request_started.disconnect(dispatch_uid='deflect.warm_redirect_cache'))
+
+    @override_settings(DEFLECT_CACHE_BACKEND='default')
+    def test_warm_command(self):
+        """
+        The command should report the number of ``ShortURL``s loaded.
+        """
+        caches['default'].clear()
+        out = StringIO()
+        call_command('warmredirects', max_age=None, stdout=out)
+        self.assertIn('Loaded 1 short URLs', out.getvalue())
+        self.assertIsNotNone(redirect_cache.get('test'))
+
+    def test_warm_command_local(self):
+        """
+        The command should fail without a shared cache backend, as the
+        in-process cache is discarded when it exits.
+        """
+        with self.assertRaises(CommandError):
+            call_command('warmredirects', stdout=StringIO())
+
+
+@override_settings(DEFLECT_CACHE_SIZE=100)
+class RedirectCacheCommitTests(TransactionTestCase):
+    """
+    Tests for invalidating cached redirects when a transaction
+    commits.
+    """
+    def test_invalidate_on_commit(self):
+        """
+        Redirect data cached before a change is committed should be
+        removed when the transaction commits.
+        """
+        user = get_user_model().objects.create_user('testing')
+        shorturl = ShortURL.objects.create(long_url='http://www.example.com', creator=user)
+        with transaction.atomic():
+            shorturl.long_url = 'http://www.example.com/changed'
+            shorturl.save()
+            # A redirect in another process caches the committed row
+            redirect_cache.set(shorturl.key, ShortURL.objects.get(pk=shorturl.pk).get_redirect_data())
+            self.assertIsNotNone(redirect_cache.get(shorturl.key))
+        self.assertIsNone(redirect_cache.get(shorturl.key))
+
+
+@override_settings(DEFLECT_SUGGESTIONS_SIZE=2)
+class SuggestionCacheTests(TestCase):
+    """
+    Tests for the cached suggested values.
+    """
+    def setUp(self):
+        """
+        Create a user and model instances to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        for campaign in ('First', 'Second', 'Third'):
+            ShortURL.objects.create(long_url='http://www.example.com', creator=self.user, campaign=campaign)
+
+    def test_get(self):
+        """
+        The most recently used values should be loaded once.
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(suggestion_cache.get('campaign'), ['Third', 'Second'])
+            self.assertEqual(suggestion_cache.get('campaign'), ['Third', 'Second'])
+
+    def test_update(self):
+        """
+        Saving and deleting a ``ShortURL`` should update the values
+        without reloading them.
+        """
+        suggestion_cache.get('campaign')
+        shorturl = ShortURL.objects.create(long_url='http://www.example.com', creator=self.user, campaign='Fourth')
+        with self.assertNumQueries(0):
+            self.assertEqual(suggestion_cache.get('campaign'), ['Fourth', 'Third'])
+        shorturl.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(suggestion_cache.get('campaign'), ['Third'])
@@ -0,0 +1,263 @@
+from __future__ import unicode_literals
+
+import threading
+
+from django.contrib.auth import get_user_model
+from django.contrib.admin.sites import AdminSite
+from django.core import mail
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.six.moves import BaseHTTPServer
+
+import requests
+
+from .. import admin
+from ..checker import URLChecker
+from ..checker import get_validation_cache
+from ..checker import validate_target
+from ..models import ShortURL
+from ..models import ShortURLStatus
+from ..models import Watermark
+from ..utils import normalize_url
+from .test_views import SynchronousWorker
+
+
+class StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Respond with the status code in the request path. Paths starting
+    with /get/ reject HEAD requests.
+    """
+    paths = []
+
+    def do_HEAD(self):
+        self.paths.append(self.path)
+        if self.path.startswith('/get/'):
+            self.send_response(405)
+        else:
+            self.send_response(int(self.path.rsplit('/', 1)[-1]))
+        self.end_headers()
+
+    def do_GET(self):
+        self.send_response(int(self.path.rsplit('/', 1)[-1]))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class StatusServerMixin(object):
+    """
+    Serve ``StatusHandler`` on a local port for the tests in a class.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super(StatusServerMixin, cls).setUpClass()
+        cls.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StatusHandler)
+        cls.base_url = 'http://127.0.0.1:%d' % cls.server.server_port
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(StatusServerMixin, cls).tearDownClass()
+
+
+class CheckerTests(StatusServerMixin, TestCase):
+    """
+    Tests for validating target URLs.
+    """
+    def setUp(self):
+        """
+        Create a user to test against.
+        """
+        StatusHandler.paths = []
+        get_validation_cache().clear()
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+
+    def test_check(self):
+        """
+        A valid URL should return the response, and an invalid status
+        should raise an exception.
+        """
+        checker = URLChecker(concurrency=2)
+        self.assertEqual(checker.check(self.base_url + '/200').status_code, 200)
+        self.assertRaises(requests.exceptions.HTTPError, checker.check, self.base_url + '/404')
+
+    def test_get_fallback(self):
+        """
+        A URL that rejects HEAD requests should be checked with a GET
+        request.
+        """
+        checker = URLChecker(concurrency=2)
+        self.assertEqual(checker.check(self.base_url + '/get/200').status_code, 200)
+
+    def test_check_many(self):
+        """
+        Every URL should be checked, and errors should be returned
+        with the failing item.
+        """
+        urls = ['/200', '/get/200', '/500'] * 10
+        checker = URLChecker(concurrency=3)
+        results = list(checker.check_many(urls, get_url=lambda path: self.base_url + path))
+        self.assertEqual(len(results), 30)
+        errors = [item for item, response, error, latency in results if error is not None]
+        self.assertEqual(errors, ['/500'] * 10)
+
+    @override_settings(MANAGERS=[('Manager', 'manager@example.com')])
+    def test_checkurls_command(self):
+        """
+        The checkurls command should report the failing short URLs.
+        """
+        ShortURL.objects.create(long_url=self.base_url + '/200', creator=self.user)
+        failing = ShortURL.objects.create(long_url=self.base_url + '/404', creator=self.user)
+        call_command('checkurls')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Redirect %s with target' % failing.key, mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].body.count('Redirect '), 1)
+
+    @override_settings(MANAGERS=[('Manager', 'manager@example.com')])
+    def test_checkurls_status(self):
+        """
+        The checkurls command should store the result for each short
+        URL, check each target once, and only recheck short URLs that
+        failed or were not checked recently.
+        """
+        ok = ShortURL.objects.create(long_url=self.base_url + '/200', creator=self.user)
+        ShortURL.objects.create(long_url=self.base_url + '/200', creator=self.user)
+        failing = ShortURL.objects.create(long_url=self.base_url + '/404', creator=self.user)
+        call_command('checkurls', chunk_size=1)
+        self.assertEqual(sorted(StatusHandler.paths), ['/200', '/404'])
+
+        status = ShortURLStatus.objects.get(redirect=ok)
+        self.assertEqual(status.status_code, 200)
+        self.assertEqual(status.error, '')
+        self.assertEqual(status.final_url, self.base_url + '/200')
+        self.assertIsNotNone(status.latency)
+        status = ShortURLStatus.objects.get(redirect=failing)
+        self.assertEqual(status.status_code, 404)
+        self.assertNotEqual(status.error, '')
+
+        StatusHandler.paths = []
+        call_command('checkurls')
+        self.assertEqual(StatusHandler.paths, ['/404'])
+
+    @override_settings(MANAGERS=[('Manager', 'manager@example.com')])
+    def test_checkurls_shard(self):
+        """
+        Sharded runs should each check a partition of the short URLs
+        without sending a report, and a final run should send one
+        report for every shard.
+        """
+        for i in range(4):
+            ShortURL.objects.create(long_url=self.base_url + '/404?%d' % i, creator=self.user)
+        call_command('checkurls', shard=(0, 2), partition='pk')
+        self.assertEqual(len(StatusHandler.paths), 2)
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('checkurls', shard=(1, 2), partition='pk')
+        self.assertEqual(len(StatusHandler.paths), 4)
+        call_command('checkurls', report_only=True)
+        self.assertEqual(len(StatusHandler.paths), 4)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].body.count('Redirect '), 4)
+
+    @override_settings(MANAGERS=[('Manager', 'manager@example.com')])
+    def test_checkurls_resume(self):
+        """
+        A run should resume after the checkpoint left by an
+        interrupted run.
+        """
+        first = ShortURL.objects.create(long_url=self.base_url + '/404', creator=self.user)
+        ShortURL.objects.create(long_url=self.base_url + '/500', creator=self.user)
+        Watermark.objects.create(name='checkurls:0/1', position=first.pk)
+        call_command('checkurls')
+        self.assertEqual(StatusHandler.paths, ['/500'])
+        self.assertFalse(Watermark.objects.filter(name='checkurls:0/1').exists())
+
+    def test_validate_target(self):
+        """
+        Validating a target should return the final URL or an error
+        message, and reuse the result for the same normalized URL.
+        """
+        self.assertEqual(validate_target(self.base_url + '/200'), (self.base_url + '/200', None))
+        self.assertEqual(validate_target(self.base_url.upper() + '/200'), (self.base_url + '/200', None))
+        self.assertEqual(validate_target(self.base_url + '/404'),
+                         (self.base_url + '/404', 'Invalid status returned (404)'))
+        self.assertEqual(StatusHandler.paths, ['/200', '/404'])
+
+    def test_validate_target_fragment(self):
+        """
+        A cached result should keep the fragment of the URL being
+        validated.
+        """
+        self.assertEqual(validate_target(self.base_url + '/200#faq'), (self.base_url + '/200#faq', None))
+        self.assertEqual(validate_target(self.base_url + '/200#pricing'), (self.base_url + '/200#pricing', None))
+        self.assertEqual(validate_target(self.base_url + '/200'), (self.base_url + '/200', None))
+        self.assertEqual(StatusHandler.paths, ['/200'])
+
+    def test_validate_target_error(self):
+        """
+        Errors should not be cached, so a fixed target can be saved.
+        """
+        validate_target(self.base_url + '/404')
+        validate_target(self.base_url + '/404')
+        self.assertEqual(StatusHandler.paths, ['/404', '/404'])
+
+    @override_settings(DEFLECT_VALIDATION_CACHE_TIMEOUT=0)
+    def test_validate_target_uncached(self):
+        """
+        With the validation cache disabled, every validation should
+        check the target.
+        """
+        validate_target(self.base_url + '/200')
+        validate_target(self.base_url + '/200')
+        self.assertEqual(StatusHandler.paths, ['/200', '/200'])
+
+    def test_normalize_url(self):
+        """
+        URLs differing only in case, default port, empty path or
+        fragment should have the same normalized form.
+        """
+        self.assertEqual(normalize_url('HTTP://Example.COM:80#top'), 'http://example.com/')
+        self.assertEqual(normalize_url('https://example.com:443/Path?q=1'), 'https://example.com/Path?q=1')
+
+
+class BackgroundValidationTests(StatusServerMixin, TransactionTestCase):
+    """
+    Tests for validating targets after the admin saves a link.
+    """
+    def setUp(self):
+        """
+        Create a user to test against.
+        """
+        StatusHandler.paths = []
+        self.user = get_user_model().objects.create_user('testing')
+
+    @override_settings(DEFLECT_VALIDATE_IN_BACKGROUND=True)
+    def test_validate_in_background(self):
+        """
+        Saving a ``ShortURL`` in the admin should validate the target
+        in the background once the transaction commits, and store the
+        result on the link.
+        """
+        validation_worker = admin.validation_worker
+        admin.validation_worker = SynchronousWorker()
+        try:
+            shorturl_admin = admin.ShortURLAdmin(ShortURL, AdminSite())
+            form = shorturl_admin.get_form(None)(data={'long_url': self.base_url + '/404', 'is_tracking': True})
+            self.assertTrue(form.is_valid())
+            request = type(str('Request'), (object,), {'user': self.user})()
+            shorturl = form.save(commit=False)
+            with transaction.atomic():
+                shorturl_admin.save_model(request, shorturl, form, False)
+                self.assertFalse(ShortURLStatus.objects.exists())
+        finally:
+            admin.validation_worker = validation_worker
+        self.assertEqual(ShortURLStatus.objects.get(redirect=shorturl).status_code, 404)
+        self.assertIn('Failed', shorturl_admin.target_status(shorturl))
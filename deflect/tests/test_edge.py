@@ -0,0 +1,173 @@
+from __future__ import unicode_literals
+
+from datetime import datetime
+import io
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from ..edge import import_hits
+from ..edge import parse_log_time
+from ..models import ShortURL
+from ..models import ShortURLAlias
+
+
+class EdgeTests(TestCase):
+    """
+    Tests for serving redirects from an edge server.
+    """
+    def setUp(self):
+        """
+        Create a user and model instances to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.tracking = ShortURL.objects.create(long_url='http://www.example.com/$1', creator=self.user,
+                                                campaign='Example')
+        self.plain = ShortURL.objects.create(long_url='http://www.example.com', creator=self.user,
+                                             is_tracking=False)
+        ShortURLAlias.objects.create(redirect=self.tracking, alias='test')
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'redirects.map')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        with io.open(self.path, encoding='utf-8') as f:
+            return f.read()
+
+    def test_nginx_map(self):
+        """
+        Permanent and temporary redirects should be written to
+        separate maps, with special characters encoded.
+        """
+        call_command('exportredirects', self.path, stdout=StringIO())
+        output = self.read()
+        permanent, temporary = output.split('}\n')[:2]
+        self.assertIn('"/test" "%s"; # %d' % (self.tracking.target_url().replace('$', '%24'), self.tracking.pk),
+                      permanent)
+        self.assertIn('"/%s" "http://www.example.com"; # %d' % (self.plain.key, self.plain.pk), temporary)
+        self.assertNotIn('$1', output)
+
+    def test_shadowed_key(self):
+        """
+        A key matching an alias in another case should have no rule of
+        its own, and get one again once the alias is removed.
+        """
+        other = ShortURL.objects.create(long_url='http://www.example.com/other', creator=self.user)
+        alias = ShortURLAlias.objects.create(redirect=self.plain, alias=other.key.lower())
+        call_command('exportredirects', self.path, stdout=StringIO())
+        output = self.read()
+        self.assertIn('"/%s" "http://www.example.com"; # %d' % (other.key.lower(), self.plain.pk), output)
+        self.assertNotIn('# %d\n' % other.pk, output)
+
+        alias.delete()
+        call_command('exportredirects', self.path, stdout=StringIO())
+        self.assertIn('"/%s" "%s"; # %d' % (other.key, other.target_url(), other.pk), self.read())
+
+    def test_incremental(self):
+        """
+        Later exports should only regenerate the rules for changed
+        ``ShortURL``s, and drop the rules for deleted ones.
+        """
+        out = StringIO()
+        call_command('exportredirects', self.path, format='json', stdout=out)
+        self.assertIn('Wrote 3 rules', out.getvalue())
+
+        self.plain.long_url = 'http://www.example.com/changed'
+        self.plain.save()
+        self.tracking.shorturlalias.delete()
+        created = ShortURL.objects.create(long_url='http://www.example.com/new', creator=self.user)
+        out = StringIO()
+        call_command('exportredirects', self.path, format='json', stdout=out)
+        self.assertIn('Wrote 3 rules', out.getvalue())
+        self.assertIn('3 regenerated', out.getvalue())
+        output = self.read()
+        self.assertIn('http://www.example.com/changed', output)
+        self.assertIn('"/%s"' % created.key, output)
+        self.assertNotIn('/test', output)
+
+        self.tracking.delete()
+        out = StringIO()
+        call_command('exportredirects', self.path, format='csv', full=True, stdout=out)
+        self.assertIn('Wrote 2 rules', out.getvalue())
+        self.assertTrue(self.read().startswith('id,source,target,status'))
+
+    def test_import_hits(self):
+        """
+        Redirects in an access log should be added to the hits of the
+        matching ``ShortURL``s, whatever the case of the key. Requests
+        with a query string should be skipped, as the edge rules do not
+        match them and the application counted them.
+        """
+        log = [
+            '127.0.0.1 - - [10/Oct/2026:13:55:36 +0000] "GET /test HTTP/1.1" 301 0 "-" "Mozilla"',
+            '127.0.0.1 - - [10/Oct/2026:13:55:37 +0000] "GET /test HTTP/1.1" 301 0 "-" "Mozilla"',
+            '127.0.0.1 - - [10/Oct/2026:13:55:38 +0000] "GET /TEST?ref=1 HTTP/1.1" 301 0 "-" "Mozilla"',
+            '127.0.0.1 - - [10/Oct/2026:13:55:38 +0000] "GET /test?ref=1 HTTP/1.1" 301 0 "-" "Mozilla"',
+            '127.0.0.1 - - [10/Oct/2026:13:55:38 +0000] "GET /%s HTTP/1.1" 302 0 "-" "-"' % self.plain.key,
+            '127.0.0.1 - - [10/Oct/2026:13:55:38 +0000] "GET /TEST HTTP/1.1" 301 0 "-" "-"',
+            '127.0.0.1 - - [10/Oct/2026:13:55:39 +0000] "GET /missing HTTP/1.1" 301 0 "-" "-"',
+            '127.0.0.1 - - [10/Oct/2026:13:55:40 +0000] "GET /test HTTP/1.1" 404 0 "-" "-"',
+            'invalid line',
+        ]
+        self.assertEqual(import_hits(log), 4)
+        tracking = ShortURL.objects.get(pk=self.tracking.pk)
+        self.assertEqual(tracking.hits, 3)
+        self.assertEqual(tracking.last_used, parse_log_time('10/Oct/2026:13:55:38 +0000'))
+        self.assertEqual(ShortURL.objects.get(pk=self.plain.pk).hits, 1)
+
+    @override_settings(ROOT_URLCONF='deflect.tests.prefixed_urls')
+    def test_import_hits_prefix(self):
+        """
+        Redirects should be counted when the short URLs are not at the
+        root of the site.
+        """
+        log = [
+            '127.0.0.1 - - [10/Oct/2026:13:55:36 +0000] "GET /r/test HTTP/1.1" 301 0 "-" "-"',
+            '127.0.0.1 - - [10/Oct/2026:13:55:37 +0000] "GET /r/%s HTTP/1.1" 302 0 "-" "-"' % self.plain.key.lower(),
+            '127.0.0.1 - - [10/Oct/2026:13:55:38 +0000] "GET /test HTTP/1.1" 301 0 "-" "-"',
+        ]
+        self.assertEqual(import_hits(log), 2)
+        self.assertEqual(ShortURL.objects.get(pk=self.tracking.pk).hits, 1)
+        self.assertEqual(ShortURL.objects.get(pk=self.plain.pk).hits, 1)
+
+    def test_parse_log_time(self):
+        """
+        Log timestamps should be converted from their offset.
+        """
+        self.assertEqual(parse_log_time('10/Oct/2000:13:55:36 -0700'),
+                         parse_log_time('10/Oct/2000:20:55:36 +0000'))
+        self.assertIsInstance(parse_log_time('10/Oct/2000:13:55:36 +0000'), datetime)
+
+    def test_importhits_command(self):
+        """
+        The importhits command should only import lines appended since
+        the last import, including lines with the same timestamp, and
+        leave a partly written line for the next import.
+        """
+        path = os.path.join(self.tmpdir, 'access.log')
+        line = '127.0.0.1 - - [10/Oct/2026:13:55:01 +0000] "GET /test HTTP/1.1" 301 0 "-" "-"\n'
+        with io.open(path, 'w') as f:
+            f.write(line + line[:20])
+        call_command('importhits', path, stdout=StringIO())
+        self.assertEqual(ShortURL.objects.get(pk=self.tracking.pk).hits, 1)
+        with io.open(path, 'a') as f:
+            f.write(line[20:] + line)
+        out = StringIO()
+        call_command('importhits', path, stdout=out)
+        self.assertIn('Imported 2 hits', out.getvalue())
+        self.assertEqual(ShortURL.objects.get(pk=self.tracking.pk).hits, 3)
+
+        # A truncated log is read from the start
+        with io.open(path, 'w') as f:
+            f.write(line)
+        call_command('importhits', path, stdout=StringIO())
+        self.assertEqual(ShortURL.objects.get(pk=self.tracking.pk).hits, 4)
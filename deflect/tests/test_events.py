@@ -0,0 +1,66 @@
+from __future__ import unicode_literals
+
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+
+import base32_crockford
+
+from ..events import get_click_queue
+from ..models import ClickEvent
+from ..models import ShortURL
+from ..utils import get_user_agent_family
+
+
+@override_settings(DEFLECT_CLICK_EVENTS=True, DEFLECT_CLICK_EVENTS_FLUSH_INTERVAL=None)
+class ClickEventTests(TestCase):
+    """
+    Tests for recording click events.
+    """
+    def setUp(self):
+        """
+        Create a user and model instance to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                                creator=self.user)
+        self.key = base32_crockford.encode(self.shorturl.pk)
+
+    def test_record_click(self):
+        """
+        A redirect should queue a click event without writing it,
+        and the queued event should be written on flush.
+        """
+        url = reverse('deflect:redirect', args=[self.key]) + '?test=param'
+        self.client.get(url, HTTP_REFERER='http://example.org/',
+                        HTTP_USER_AGENT='Mozilla/5.0 Firefox/45.0')
+        self.assertEqual(ClickEvent.objects.count(), 0)
+        self.assertEqual(get_click_queue().flush(), 1)
+        event = ClickEvent.objects.get()
+        self.assertEqual(event.redirect_id, self.shorturl.pk)
+        self.assertEqual(event.referrer, 'http://example.org/')
+        self.assertEqual(event.user_agent_family, 'Firefox')
+        self.assertEqual(json.loads(event.query_params), {'test': 'param'})
+
+    def test_deleted_shorturl(self):
+        """
+        Events for a deleted ``ShortURL`` should be skipped.
+        """
+        self.client.get(reverse('deflect:redirect', args=[self.key]))
+        self.shorturl.delete()
+        self.assertEqual(get_click_queue().flush(), 0)
+
+    def test_user_agent_family(self):
+        """
+        Common browsers and bots should be identified.
+        """
+        chrome = ('Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/50.0.2661.102 Safari/537.36')
+        self.assertEqual(get_user_agent_family(chrome), 'Chrome')
+        self.assertEqual(get_user_agent_family('Googlebot/2.1'), 'Bot')
+        self.assertEqual(get_user_agent_family('curl/7.47.0'), 'Other')
+        self.assertEqual(get_user_agent_family(''), '')
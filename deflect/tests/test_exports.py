@@ -0,0 +1,134 @@
+from __future__ import unicode_literals
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import BytesIO
+from django.utils.six import StringIO
+
+from ..exports import get_export_rows
+from ..exports import stream_csv
+from ..exports import stream_json
+from ..exports import write_qr_codes
+from ..models import ShortURL
+from ..models import ShortURLAlias
+
+
+class QRCodeExportTests(TestCase):
+    """
+    Tests for exporting QR codes.
+    """
+    def setUp(self):
+        """
+        Create a user and model instances to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturls = [ShortURL.objects.create(long_url='http://www.example.com',
+                                                  creator=self.user,
+                                                  campaign='Example' if i else 'Other')
+                          for i in range(3)]
+        ShortURLAlias.objects.create(redirect=self.shorturls[0], alias='test')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_qr_codes(self):
+        """
+        The archive should contain an image for each ``ShortURL``,
+        named with the alias when available.
+        """
+        f = BytesIO()
+        self.assertEqual(write_qr_codes(f, ShortURL.objects.all(), processes=2), 3)
+        archive = zipfile.ZipFile(f)
+        expected = ['test.png'] + ['%s.png' % s.key for s in self.shorturls[1:]]
+        self.assertEqual(archive.namelist(), expected)
+        self.assertTrue(archive.read('test.png').startswith(b'\x89PNG'))
+
+    def test_exportqrcodes_command(self):
+        """
+        The exportqrcodes command should write the filtered QR codes
+        to the given path.
+        """
+        path = os.path.join(self.tmpdir, 'qrcodes.zip')
+        out = StringIO()
+        call_command('exportqrcodes', path, format='svg', campaign='Example', processes=1, stdout=out)
+        self.assertIn('Exported 2 QR codes', out.getvalue())
+        self.assertEqual(len(zipfile.ZipFile(path).namelist()), 2)
+
+
+class URLExportTests(TestCase):
+    """
+    Tests for exporting short URLs and their statistics.
+    """
+    def setUp(self):
+        """
+        Create a user and model instances to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturls = [ShortURL.objects.create(long_url='http://www.example.com', creator=self.user,
+                                                  campaign='Example', hits=i)
+                          for i in range(5)]
+        ShortURLAlias.objects.create(redirect=self.shorturls[0], alias='test')
+
+    @override_settings(DEFLECT_HIT_SHARDS=2)
+    def test_get_export_rows(self):
+        """
+        Rows should include the short, alias and target URLs and the
+        hits, with a constant number of queries per chunk.
+        """
+        ShortURL.objects.increment_hits(self.shorturls[0].pk)
+        with self.assertNumQueries(4):
+            rows = list(get_export_rows(ShortURL.objects.all(), chunk_size=3))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['short_url'], 'http://example.com/%s' % self.shorturls[0].key)
+        self.assertEqual(rows[0]['alias_url'], 'http://example.com/test')
+        self.assertEqual(rows[1]['alias_url'], '')
+        self.assertIn('utm_campaign=example', rows[0]['target_url'])
+        self.assertEqual([row['hits'] for row in rows], [1, 1, 2, 3, 4])
+
+    def test_stream_csv(self):
+        """
+        The CSV export should contain a header and a line for each
+        row.
+        """
+        lines = list(stream_csv(get_export_rows(ShortURL.objects.all())))
+        rows = list(csv.reader(lines))
+        self.assertEqual(rows[0][:3], ['key', 'short_url', 'alias_url'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][0], self.shorturls[0].key)
+
+    def test_stream_json(self):
+        """
+        The JSON lines export should contain an object for each row,
+        keeping empty values as ``null``.
+        """
+        lines = list(stream_json(get_export_rows(ShortURL.objects.all())))
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(all(line.endswith('\n') for line in lines))
+        row = json.loads(lines[0])
+        self.assertEqual(row['alias_url'], 'http://example.com/test')
+        self.assertEqual(row['campaign'], 'Example')
+        self.assertIsNone(row['last_used'])
+
+    def test_exporturls_command(self):
+        """
+        The exporturls command should write a JSON object for each
+        filtered short URL.
+        """
+        out = StringIO()
+        call_command('exporturls', format='json', campaign='Example', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['key'], self.shorturls[0].key)
+        self.assertIsNone(rows[0]['last_used'])
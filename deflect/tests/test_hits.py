@@ -0,0 +1,246 @@
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from django.utils.timezone import now
+
+import base32_crockford
+
+from ..hits import CacheHitBuffer
+from ..hits import MemoryHitBuffer
+from ..hits import flush_hits
+from ..hits import get_hit_buffer
+from ..models import ShortURL
+from ..models import ShortURLHitShard
+
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'deflect-hits-tests',
+    },
+}
+
+
+class HitBufferTests(TestCase):
+    """
+    Tests for buffered hit counting.
+    """
+    def setUp(self):
+        """
+        Create a user and model instances to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                                creator=self.user)
+        self.shorturl2 = ShortURL.objects.create(long_url='http://www.example.com',
+                                                 creator=self.user)
+
+    def test_memory_buffer(self):
+        """
+        Hits added to a memory buffer should be counted per link
+        with the most recent timestamp.
+        """
+        buffer = MemoryHitBuffer()
+        earlier = now() - timedelta(hours=1)
+        buffer.add(self.shorturl.pk, now())
+        buffer.add(self.shorturl.pk, earlier)
+        buffer.add(self.shorturl2.pk, earlier)
+        hits = buffer.drain()
+        self.assertEqual(hits[self.shorturl.pk][0], 2)
+        self.assertGreater(hits[self.shorturl.pk][1], earlier)
+        self.assertEqual(hits[self.shorturl2.pk], (1, earlier))
+        self.assertEqual(buffer.drain(), {})
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_cache_buffer(self):
+        """
+        Hits added to a cache buffer should be drained once, and
+        hits recorded after a drain should be kept for the next one.
+        """
+        from django.core.cache import caches
+        buffer = CacheHitBuffer(caches['default'])
+        buffer.add(self.shorturl.pk, now())
+        buffer.add(self.shorturl.pk, now())
+        buffer.add(self.shorturl2.pk, now())
+        hits = buffer.drain()
+        self.assertEqual(hits[self.shorturl.pk][0], 2)
+        self.assertEqual(hits[self.shorturl2.pk][0], 1)
+        self.assertEqual(buffer.drain(), {})
+        buffer.add(self.shorturl.pk, now())
+        self.assertEqual(buffer.drain()[self.shorturl.pk][0], 1)
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_cache_buffer_last_used(self):
+        """
+        A cache buffer should keep the most recent hit timestamp,
+        regardless of the order the hits are added.
+        """
+        from django.core.cache import caches
+        buffer = CacheHitBuffer(caches['default'])
+        latest = now()
+        buffer.add(self.shorturl.pk, latest)
+        buffer.add(self.shorturl.pk, latest - timedelta(hours=1))
+        self.assertEqual(buffer.drain()[self.shorturl.pk], (2, latest))
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_cache_buffer_evicted(self):
+        """
+        A counter evicted during a drain should not prevent the hits
+        of the other links from being drained.
+        """
+        from django.core.cache import caches
+        cache = caches['default']
+        buffer = CacheHitBuffer(cache)
+        buffer.add(self.shorturl.pk, now())
+        buffer.add(self.shorturl2.pk, now())
+        evicted = buffer._key('count', self.shorturl.pk)
+        get_many = cache.get_many
+
+        def get_many_and_evict(keys, **kwargs):
+            values = get_many(keys, **kwargs)
+            if evicted in keys:
+                cache.delete(evicted)
+            return values
+
+        cache.get_many = get_many_and_evict
+        try:
+            hits = buffer.drain()
+        finally:
+            del cache.get_many
+        self.assertEqual(hits[self.shorturl.pk][0], 1)
+        self.assertEqual(hits[self.shorturl2.pk][0], 1)
+        self.assertEqual(buffer.drain(), {})
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_cache_buffer_pending_slot(self):
+        """
+        A slot not yet written by a concurrent hit should be read by
+        the next flush, and a slot evicted from the cache should not
+        stop later flushes.
+        """
+        from django.core.cache import caches
+        cache = caches['default']
+        self.addCleanup(cache.clear)
+        buffer = CacheHitBuffer(cache)
+        buffer.add(self.shorturl.pk, now())
+        # Simulate a hit that has taken a slot number but not yet
+        # written the slot
+        cache.add(buffer._key('count', self.shorturl2.pk), 0, None)
+        cache.incr(buffer._key('count', self.shorturl2.pk))
+        cache.set(buffer._key('dirty', self.shorturl2.pk), 1)
+        seq = cache.incr(buffer.prefix + 'seq')
+        self.assertEqual(list(buffer.drain()), [self.shorturl.pk])
+
+        cache.set(buffer._key('slot', seq), self.shorturl2.pk, None)
+        hits = buffer.drain()
+        self.assertEqual(hits[self.shorturl2.pk][0], 1)
+        self.assertIsNotNone(hits[self.shorturl2.pk][1])
+
+        buffer.add(self.shorturl.pk, now())
+        cache.delete(buffer._key('slot', seq + 1))
+        buffer.add(self.shorturl2.pk, now())
+        self.assertEqual(list(buffer.drain()), [self.shorturl2.pk])
+        self.assertEqual(buffer.drain(), {})
+        self.assertEqual(cache.get(buffer.prefix + 'flushed'), seq + 2)
+
+    def test_apply_hits(self):
+        """
+        Applying buffered hits should add to the hit count and only
+        move the last used timestamp forward.
+        """
+        earlier = now() - timedelta(hours=1)
+        ShortURL.objects.increment_hits(self.shorturl.pk)
+        ShortURL.objects.apply_hits({self.shorturl.pk: (3, earlier),
+                                     self.shorturl2.pk: (2, earlier)})
+        url = ShortURL.objects.get(pk=self.shorturl.pk)
+        url2 = ShortURL.objects.get(pk=self.shorturl2.pk)
+        self.assertEqual(url.hits, 4)
+        self.assertGreater(url.last_used, earlier)
+        self.assertEqual(url2.hits, 2)
+        self.assertEqual(url2.last_used, earlier)
+
+    @override_settings(DEFLECT_HITS_BUFFER='memory', DEFLECT_HITS_FLUSH_INTERVAL=None)
+    def test_buffered_redirect(self):
+        """
+        With a hit buffer configured, a redirect should not update the
+        hits until the buffer is flushed.
+        """
+        key = base32_crockford.encode(self.shorturl.pk)
+        self.client.get(reverse('deflect:redirect', args=[key]))
+        self.assertEqual(ShortURL.objects.get(pk=self.shorturl.pk).hits, 0)
+        self.assertEqual(flush_hits(), 1)
+        self.assertEqual(ShortURL.objects.get(pk=self.shorturl.pk).hits, 1)
+
+    @override_settings(DEFLECT_HITS_BUFFER='cache', CACHES=TEST_CACHES)
+    def test_flushhits_command(self):
+        """
+        The flushhits command should write the buffered hits.
+        """
+        get_hit_buffer().add(self.shorturl.pk, now())
+        out = StringIO()
+        call_command('flushhits', stdout=out)
+        self.assertIn('Updated hits for 1 short URLs', out.getvalue())
+        self.assertEqual(ShortURL.objects.get(pk=self.shorturl.pk).hits, 1)
+
+
+@override_settings(DEFLECT_HIT_SHARDS=4)
+class HitShardTests(TestCase):
+    """
+    Tests for sharded hit counting.
+    """
+    def setUp(self):
+        """
+        Create a user and model instance to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                                creator=self.user)
+
+    def test_increment_hits(self):
+        """
+        With hit shards configured, hits should be recorded in the
+        shards and aggregated on read.
+        """
+        for i in range(10):
+            ShortURL.objects.increment_hits(self.shorturl.pk)
+        url = ShortURL.objects.get(pk=self.shorturl.pk)
+        self.assertEqual(url.hits, 0)
+        self.assertLessEqual(ShortURLHitShard.objects.filter(redirect=url).count(), 4)
+        self.assertEqual(url.get_hits(), 10)
+        self.assertIsNotNone(url.get_last_used())
+
+    def test_with_shard_hits(self):
+        """
+        An annotated queryset should provide the aggregated hits
+        without querying the shards.
+        """
+        ShortURLHitShard.objects.increment_hits(self.shorturl.pk, 0)
+        ShortURLHitShard.objects.increment_hits(self.shorturl.pk, 1)
+        url = ShortURL.objects.with_shard_hits().get(pk=self.shorturl.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(url.get_hits(), 2)
+
+    def test_foldhits_command(self):
+        """
+        The foldhits command should move the shard hits into the
+        ``ShortURL`` hit count.
+        """
+        ShortURLHitShard.objects.increment_hits(self.shorturl.pk, 0)
+        ShortURLHitShard.objects.increment_hits(self.shorturl.pk, 0)
+        ShortURLHitShard.objects.increment_hits(self.shorturl.pk, 3)
+        out = StringIO()
+        call_command('foldhits', stdout=out)
+        self.assertIn('Folded hit shards for 1 short URLs', out.getvalue())
+        url = ShortURL.objects.get(pk=self.shorturl.pk)
+        self.assertEqual(url.hits, 3)
+        self.assertIsNotNone(url.last_used)
+        self.assertEqual(url.get_hits(), 3)
@@ -0,0 +1,105 @@
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from ..imports import import_urls
+from ..imports import read_rows
+from ..models import ShortURL
+from ..models import ShortURLAlias
+
+
+class ImportTests(TestCase):
+    """
+    Tests for importing short URLs.
+    """
+    def setUp(self):
+        """
+        Create a user and model instances to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        shorturl = ShortURL.objects.create(long_url='http://www.example.com', creator=self.user)
+        ShortURLAlias.objects.create(redirect=shorturl, alias='taken')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_import_urls(self):
+        """
+        Valid rows should be created with their aliases, and invalid
+        rows should be reported without aborting the import.
+        """
+        rows = [
+            {'long_url': 'http://www.example.com/1', 'campaign': 'Example', 'alias': 'First'},
+            {'long_url': 'not a url'},
+            {'long_url': 'http://www.example.com/2', 'alias': 'taken'},
+            {'long_url': 'http://www.example.com/3', 'alias': 'first'},
+            {'long_url': 'http://www.example.com/4', 'alias': 'bad alias'},
+            None,
+            {'long_url': 'http://www.example.com/5', 'medium': 'email'},
+        ]
+        result = import_urls(rows, self.user, chunk_size=2)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([row for row, message in result.errors], [2, 3, 4, 5, 6])
+        self.assertIn('already exists', result.errors[1][1])
+
+        alias = ShortURLAlias.objects.get(alias='first')
+        self.assertEqual(alias.redirect.long_url, 'http://www.example.com/1')
+        self.assertEqual(alias.redirect.campaign, 'Example')
+        shorturl = ShortURL.objects.get(long_url='http://www.example.com/5')
+        self.assertEqual(shorturl.medium, 'email')
+        self.assertIsNotNone(shorturl.created)
+
+    def test_read_rows_json(self):
+        """
+        JSON lines should be read as dicts, and invalid lines as
+        ``None``.
+        """
+        f = StringIO('{"long_url": "http://www.example.com"}\n\n[1]\n{invalid\n')
+        self.assertEqual(list(read_rows(f, 'json')), [{'long_url': 'http://www.example.com'}, None, None])
+
+    def test_importurls_command(self):
+        """
+        The importurls command should import the rows of a CSV file
+        and report the skipped rows.
+        """
+        path = os.path.join(self.tmpdir, 'urls.csv')
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write('long_url,campaign,medium,content,alias\n'
+                    'http://www.example.com/1,Caf\xe9,email,,new\n'
+                    'http://www.example.com/2,,,,taken\n')
+        out = StringIO()
+        err = StringIO()
+        call_command('importurls', path, user='testing', stdout=out, stderr=err)
+        self.assertIn('Imported 1 short URLs, skipped 1 rows', out.getvalue())
+        self.assertIn('Row 2: Alias taken already exists', err.getvalue())
+        self.assertEqual(ShortURLAlias.objects.get(alias='new').redirect.campaign, 'Caf\xe9')
+
+    def test_import_values(self):
+        """
+        Numbers should be imported as text, lists and objects should
+        be reported, and columns beyond the header ignored.
+        """
+        f = StringIO('{"long_url": "http://www.example.com/1", "campaign": 2024}\n'
+                     '{"long_url": "http://www.example.com/2", "medium": ["email"]}\n')
+        result = import_urls(read_rows(f, 'json'), self.user)
+        self.assertEqual(result.created, 1)
+        self.assertEqual(result.errors, [(2, 'Invalid value for medium')])
+        self.assertEqual(ShortURL.objects.get(long_url='http://www.example.com/1').campaign, '2024')
+
+        path = os.path.join(self.tmpdir, 'urls.csv')
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write('long_url,campaign\n'
+                    'http://www.example.com/3,Example,extra\n')
+        out = StringIO()
+        call_command('importurls', path, user='testing', stdout=out, stderr=StringIO())
+        self.assertIn('Imported 1 short URLs, skipped 0 rows', out.getvalue())
@@ -0,0 +1,107 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from ..index import build_index
+from ..index import redirect_index
+from ..models import ShortURL
+from ..models import ShortURLAlias
+
+
+class RedirectIndexTests(TestCase):
+    """
+    Tests for the shared redirect index.
+    """
+    def setUp(self):
+        """
+        Create a user and model instances to test against, and an
+        index path.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com', creator=self.user,
+                                                campaign='Example')
+        ShortURLAlias.objects.create(redirect=self.shorturl, alias='test')
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'redirects.idx')
+        self.index_settings = override_settings(DEFLECT_INDEX_PATH=self.path, DEFLECT_INDEX_CHECK_INTERVAL=0)
+        self.index_settings.enable()
+
+    def tearDown(self):
+        self.index_settings.disable()
+        shutil.rmtree(self.tmpdir)
+
+    def test_get(self):
+        """
+        Keys and aliases should be found in the index regardless of
+        case, with the compiled target URL, and missing keys should
+        return ``None``.
+        """
+        self.assertEqual(build_index(self.path), 2)
+        data = redirect_index.get(self.shorturl.key)
+        self.assertEqual(data['id'], self.shorturl.pk)
+        self.assertEqual(data['campaign'], 'Example')
+        self.assertEqual(data['url_template'], self.shorturl.url_template)
+        self.assertEqual(redirect_index.get('TEST'), data)
+        self.assertIsNone(redirect_index.get('missing'))
+        self.assertIsNone(redirect_index.get('a-key-longer-than-the-slot'))
+
+    def test_redirect(self):
+        """
+        Redirects should be served from the index without querying
+        the ``ShortURL``, and fall back to the database for entries
+        newer than the index.
+        """
+        call_command('buildindex', stdout=StringIO())
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('deflect:redirect', args=['test']))
+        self.assertEqual(response['Location'], self.shorturl.target_url())
+
+        created = ShortURL.objects.create(long_url='http://www.example.com/new', creator=self.user)
+        response = self.client.get(reverse('deflect:redirect', args=[created.key]))
+        self.assertEqual(response['Location'], created.target_url())
+
+    def test_changes(self):
+        """
+        Entries changed in this process should be looked up in the
+        database until the index is rebuilt and swapped in.
+        """
+        build_index(self.path)
+        redirect_index.get('test')
+        self.shorturl.long_url = 'http://www.example.com/changed'
+        self.shorturl.save()
+        self.assertIsNone(redirect_index.get('test'))
+        response = self.client.get(reverse('deflect:redirect', args=['test']))
+        self.assertEqual(response['Location'], self.shorturl.target_url())
+
+        build_index(self.path)
+        self.assertEqual(redirect_index.get('test')['long_url'], 'http://www.example.com/changed')
+
+    def test_max_age(self):
+        """
+        An index older than the maximum age should not be used, so
+        changes made by other processes are seen.
+        """
+        build_index(self.path)
+        with self.settings(DEFLECT_INDEX_MAX_AGE=0.01):
+            time.sleep(0.02)
+            self.assertIsNone(redirect_index.get('test'))
+            build_index(self.path)
+            self.assertIsNotNone(redirect_index.get('test'))
+
+    def test_missing_file(self):
+        """
+        Lookups should return ``None`` if the index has not been
+        built.
+        """
+        self.assertIsNone(redirect_index.get('test'))
@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from ..loadtest import TrafficMix
+from ..loadtest import check_thresholds
+from ..loadtest import parse_mix
+from ..loadtest import percentile
+from ..loadtest import summarize
+
+
+class LoadTestTests(TestCase):
+    """
+    Tests for the load test harness.
+    """
+    def test_parse_mix(self):
+        """
+        A traffic mix should be parsed into weights, and unknown
+        kinds of traffic should be rejected.
+        """
+        self.assertEqual(dict(parse_mix('hot=3, invalid=1')), {'hot': 3, 'invalid': 1})
+        self.assertRaises(ValueError, parse_mix, 'hot=1,other=1')
+
+    def test_traffic_mix(self):
+        """
+        Generated requests should follow the weights of the mix, with
+        the expected status for each kind of traffic.
+        """
+        traffic = TrafficMix(['a', 'b', 'c'], ['alias'], mix=parse_mix('hot=1,invalid=1,params=0'),
+                             hot_keys=1, seed=1)
+        requests = [traffic.next() for i in range(100)]
+        kinds = set(kind for kind, path, expected in requests)
+        self.assertEqual(kinds, set(['hot', 'invalid']))
+        for kind, path, expected in requests:
+            if kind == 'hot':
+                self.assertEqual((path, expected), ('/a', 301))
+            else:
+                self.assertEqual(expected, 404)
+
+    def test_summarize(self):
+        """
+        The summary should include the latency percentiles, error
+        rate and throughput, overall and for each kind of traffic.
+        """
+        results = [('hot', i / 1000.0, True) for i in range(1, 100)] + [('invalid', 0.5, False)]
+        summary = summarize(results, 2.0)
+        self.assertEqual(summary['requests'], 100)
+        self.assertEqual(summary['throughput'], 50.0)
+        self.assertEqual(summary['error_rate'], 0.01)
+        self.assertEqual(summary['p50'], 50.0)
+        self.assertEqual(summary['p99'], 99.0)
+        self.assertEqual(summary['kinds']['invalid']['p99'], 500.0)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_check_thresholds(self):
+        """
+        Each failed threshold and regression against a baseline
+        should be reported.
+        """
+        summary = {'p50': 10.0, 'p99': 100.0, 'throughput': 50.0, 'error_rate': 0.0}
+        self.assertEqual(check_thresholds(summary, max_p50=20, max_p99=200, min_throughput=10), [])
+        self.assertEqual(len(check_thresholds(summary, max_p50=5, max_p99=50, min_throughput=100)), 3)
+        baseline = {'p50': 10.0, 'p99': 50.0, 'throughput': 100.0}
+        self.assertEqual(len(check_thresholds(summary, baseline=baseline)), 2)
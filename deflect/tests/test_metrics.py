@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test import RequestFactory
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import views
+from ..metrics import Metrics
+from ..metrics import metric_recorded
+from ..metrics import metrics
+from ..metrics import null_timer
+from ..metrics import render_prometheus
+from ..models import ShortURL
+from ..models import ShortURLAlias
+
+
+class MetricsTests(TestCase):
+    """
+    Tests for collecting and exposing metrics.
+    """
+    def setUp(self):
+        """
+        Create a user and model instances to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com', creator=self.user)
+        ShortURLAlias.objects.create(redirect=self.shorturl, alias='test')
+
+    def test_disabled(self):
+        """
+        Nothing should be recorded while metrics are disabled.
+        """
+        m = Metrics()
+        m.increment('requests_total')
+        self.assertIs(m.timer('duration_seconds'), null_timer)
+        self.assertEqual(m.counters, {})
+        self.assertEqual(m.histograms, {})
+
+    @override_settings(DEFLECT_METRICS=True)
+    def test_render_prometheus(self):
+        """
+        Counters and histograms should be rendered in the Prometheus
+        text format, and each value sent with a signal.
+        """
+        received = []
+
+        def handler(sender, name, labels, value, **kwargs):
+            received.append((name, labels, value))
+
+        metric_recorded.connect(handler)
+        try:
+            m = Metrics(buckets=(0.1, 1.0))
+            m.increment('requests_total', result='hit')
+            m.increment('requests_total', result='hit')
+            m.observe('duration_seconds', 0.5)
+            m.observe('duration_seconds', 2.0)
+        finally:
+            metric_recorded.disconnect(handler)
+        self.assertEqual(len(received), 4)
+        self.assertEqual(received[0], ('requests_total', {'result': 'hit'}, 1))
+        output = render_prometheus(m)
+        self.assertIn('deflect_requests_total{result="hit"} 2\n', output)
+        self.assertIn('deflect_duration_seconds_bucket{le="0.1"} 0\n', output)
+        self.assertIn('deflect_duration_seconds_bucket{le="1.0"} 1\n', output)
+        self.assertIn('deflect_duration_seconds_bucket{le="+Inf"} 2\n', output)
+        self.assertIn('deflect_duration_seconds_sum 2.5\n', output)
+        self.assertIn('deflect_duration_seconds_count 2\n', output)
+
+    @override_settings(DEFLECT_METRICS=True)
+    def test_redirect_metrics(self):
+        """
+        Redirects should record the time spent in each phase, and the
+        number of keys not found.
+        """
+        self.client.get(reverse('deflect:redirect', args=[self.shorturl.key]))
+        self.client.get(reverse('deflect:redirect', args=['test']))
+        self.client.get(reverse('deflect:redirect', args=['u']))
+        phases = set(dict(labels)['phase'] for name, labels in metrics.histograms
+                     if name == 'redirect_phase_seconds')
+        self.assertEqual(phases, set(['alias_lookup', 'key_decode', 'fetch', 'hit_update', 'url_build']))
+        self.assertEqual(metrics.counters[('redirect_not_found_total', ())], 1)
+
+        response = views.metrics_view(RequestFactory().get('/metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'deflect_redirect_seconds_count 3', response.content)
+        self.assertIn(b'deflect_bloom_rejections_total 0', response.content)
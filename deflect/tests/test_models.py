@@ -71,6 +71,37 @@ class ShortURLTests(TestCase):
         self.assertIn('http://www.example.com', tracking_url)
         self.assertIn('test=param', tracking_url)
 
+    def test_redirect_params_unchanged(self):
+        """
+        The provided query parameters should not be modified, and
+        tracking parameters should take precedence over them.
+        """
+        params = {'utm_source': 'other', 'test': 'param'}
+        tracking_url = self.shorturl.target_url(params=params)
+        self.assertEqual(params, {'utm_source': 'other', 'test': 'param'})
+        self.assertIn('utm_source=%s' % self.key, tracking_url)
+        self.assertNotIn('utm_source=other', tracking_url)
+
+    def test_redirect_existing_params(self):
+        """
+        Query parameters already in the long URL should be kept, but
+        overridden by provided query parameters.
+        """
+        shorturl = ShortURL(long_url='http://www.example.com/?a=1&b=2', is_tracking=False)
+        self.assertEqual(shorturl.target_url(), shorturl.url_template.url)
+        url = shorturl.target_url(params={'b': '3'})
+        self.assertIn('a=1', url)
+        self.assertIn('b=3', url)
+
+    def test_redirect_data(self):
+        """
+        A ``ShortURL`` built from its redirect data should produce the
+        same redirect URL.
+        """
+        shorturl = ShortURL.from_redirect_data(self.shorturl.get_redirect_data())
+        self.assertEqual(shorturl.key, self.key)
+        self.assertEqual(shorturl.target_url(), self.shorturl.target_url())
+
     def test_short_url(self):
         """
         The short URL should be equal to the model's complete URL,
@@ -81,10 +112,10 @@ class ShortURLTests(TestCase):
 
     def test_qr_code(self):
         """
-        The QR code should return an HTML img tag containing an
-        inline base64 PNG image.
+        The QR code should return an HTML img tag referencing the QR
+        code view.
         """
-        self.assertIn('<img src="data:image/png;base64,', self.shorturl.qr_code())
+        self.assertEqual(self.shorturl.qr_code(), '<img src="/%s.png" />' % self.key)
 
     def test_increment_hits(self):
         """
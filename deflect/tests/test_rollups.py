@@ -0,0 +1,72 @@
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+from django.utils.timezone import now
+
+from ..admin import ShortURLAdmin
+from ..models import CampaignClickRollup
+from ..models import ClickEvent
+from ..models import DailyClickRollup
+from ..models import HourlyClickRollup
+from ..models import ShortURL
+
+
+class RollupTests(TestCase):
+    """
+    Tests for the click statistics rollups.
+    """
+    def setUp(self):
+        """
+        Create a user, model instance and click events to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                                creator=self.user,
+                                                campaign='Example',
+                                                medium='Email')
+        self.timestamp = now() - timedelta(hours=1)
+        for i in range(3):
+            ClickEvent.objects.create(redirect=self.shorturl, timestamp=self.timestamp)
+
+    def rollupclicks(self):
+        out = StringIO()
+        call_command('rollupclicks', stdout=out)
+        return out.getvalue()
+
+    def test_rollupclicks(self):
+        """
+        The rollupclicks command should count the click events in
+        each rollup.
+        """
+        self.assertIn('Processed 3 click events', self.rollupclicks())
+        self.assertEqual(HourlyClickRollup.objects.get(redirect=self.shorturl).clicks, 3)
+        self.assertEqual(DailyClickRollup.objects.get(redirect=self.shorturl).clicks, 3)
+        rollup = CampaignClickRollup.objects.get()
+        self.assertEqual((rollup.campaign, rollup.medium, rollup.clicks), ('Example', 'Email', 3))
+
+    def test_incremental(self):
+        """
+        Subsequent runs should only process new click events, and
+        recent events should be left for a later run.
+        """
+        self.rollupclicks()
+        ClickEvent.objects.create(redirect=self.shorturl, timestamp=self.timestamp)
+        ClickEvent.objects.create(redirect=self.shorturl, timestamp=now())
+        self.assertIn('Processed 1 click events', self.rollupclicks())
+        self.assertEqual(HourlyClickRollup.objects.get(redirect=self.shorturl).clicks, 4)
+
+    def test_click_history(self):
+        """
+        The admin should display the daily clicks as a chart.
+        """
+        shorturl_admin = ShortURLAdmin(ShortURL, AdminSite())
+        self.assertEqual(shorturl_admin.click_history(self.shorturl), 'No clicks recorded')
+        self.rollupclicks()
+        self.assertIn('<svg', shorturl_admin.click_history(self.shorturl))
@@ -0,0 +1,73 @@
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..models import ShortURL
+from ..models import ShortURLAlias
+from ..routers import RedirectRouter
+from ..routers import get_read_db
+
+
+class RedirectRouterTests(TestCase):
+    """
+    Tests for routing redirect lookups to read replicas.
+    """
+    def setUp(self):
+        """
+        Create a user and model instances to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com', creator=self.user)
+        ShortURLAlias.objects.create(redirect=self.shorturl, alias='test')
+        self.router = RedirectRouter()
+
+    def test_primary(self):
+        """
+        Reads and writes of ``deflect`` models should be sent to the
+        primary, and other models left to other routers.
+        """
+        self.assertEqual(self.router.db_for_read(ShortURL), 'default')
+        with self.settings(DEFLECT_WRITE_DB='primary'):
+            self.assertEqual(self.router.db_for_read(ShortURLAlias), 'primary')
+            self.assertEqual(self.router.db_for_write(ShortURL), 'primary')
+        self.assertIsNone(self.router.db_for_read(get_user_model()))
+        self.assertTrue(self.router.allow_relation(self.shorturl, self.user))
+        self.assertIsNone(self.router.allow_relation(self.user, self.user))
+
+    def test_read_db(self):
+        """
+        The read database should be the configured alias, or one of a
+        list of aliases.
+        """
+        self.assertIsNone(get_read_db())
+        with self.settings(DEFLECT_READ_DB='replica'):
+            self.assertEqual(get_read_db(), 'replica')
+        with self.settings(DEFLECT_READ_DB=['replica1', 'replica2']):
+            self.assertIn(get_read_db(), ['replica1', 'replica2'])
+
+    @override_settings(DEFLECT_READ_DB='default')
+    def test_redirect(self):
+        """
+        Redirects should be looked up in the read database, without
+        checking it twice when it is also the primary.
+        """
+        response = self.client.get(reverse('deflect:redirect', args=['test']))
+        self.assertEqual(response['Location'], self.shorturl.target_url())
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('deflect:redirect', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(DEFLECT_READ_DB='default', DEFLECT_WRITE_DB='primary')
+    def test_redirect_invalid_key(self):
+        """
+        A key that cannot be an alias or a ``ShortURL`` id should not
+        be looked up again on the primary.
+        """
+        for key in ('u' * 17, 'missing-123456789'):
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('deflect:redirect', args=[key]))
+            self.assertEqual(response.status_code, 404)
@@ -9,6 +9,8 @@ import base32_crockford
 
 from ..models import ShortURL
 from ..models import ShortURLAlias
+from .. import views
+from ..tasks import BackgroundWorker
 
 
 class DeflectTests(TestCase):
@@ -114,6 +116,14 @@ class RedirectViewTests(DeflectTests):
         response = self.client.get(reverse('deflect:redirect', args=['u']))
         self.assertEqual(response.status_code, 404)
 
+    def test_key_too_large(self):
+        """
+        A key that decodes to a value larger than any primary key
+        should return a 404 status.
+        """
+        response = self.client.get(reverse('deflect:redirect', args=['missing-123456789']))
+        self.assertEqual(response.status_code, 404)
+
     @override_settings(DEFLECT_NOOVERRIDE=True)
     def test_nooverride(self):
         """
@@ -122,3 +132,128 @@ class RedirectViewTests(DeflectTests):
         """
         response = self.client.get(reverse('deflect:redirect', args=[self.key]))
         self.assertInHeader(response, 'utm_nooverride=1', 'location')
+
+
+class QRCodeViewTests(DeflectTests):
+    """
+    Tests for the QR code view.
+    """
+    def setUp(self):
+        """
+        Create a user and model instance to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                                creator=self.user)
+        self.key = base32_crockford.encode(self.shorturl.pk)
+
+    def test_png(self):
+        """
+        A PNG QR code should be returned with caching headers.
+        """
+        response = self.client.get(reverse('deflect:qr_code', args=[self.key, 'png']))
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertIn('ETag', response)
+        self.assertInHeader(response, 'max-age=', 'cache-control')
+
+    def test_svg(self):
+        """
+        An SVG QR code should be returned.
+        """
+        response = self.client.get(reverse('deflect:qr_code', args=[self.key, 'svg']))
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+
+    def test_size(self):
+        """
+        A different size should return a different image.
+        """
+        url = reverse('deflect:qr_code', args=[self.key, 'png'])
+        response = self.client.get(url)
+        response2 = self.client.get(url + '?size=2')
+        self.assertNotEqual(response['ETag'], response2['ETag'])
+        self.assertLess(len(response2.content), len(response.content))
+
+    def test_not_modified(self):
+        """
+        A request with a matching ETag should return a 304 status.
+        """
+        url = reverse('deflect:qr_code', args=[self.key, 'png'])
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalid_key(self):
+        """
+        An invalid key should return a 404 status.
+        """
+        response = self.client.get(reverse('deflect:qr_code', args=['u', 'png']))
+        self.assertEqual(response.status_code, 404)
+
+
+class SynchronousWorker(object):
+    """
+    Run submitted callables immediately, so their effects are visible
+    within the test transaction.
+    """
+    def submit(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+@override_settings(ROOT_URLCONF='deflect.deferred_urls')
+class DeferredRedirectViewTests(DeflectTests):
+    """
+    Tests for the deferred redirect view.
+    """
+    def setUp(self):
+        """
+        Create a user and model instance to test against.
+        """
+        user = get_user_model()
+        self.user = user.objects.create_user('testing')
+        self.shorturl = ShortURL.objects.create(long_url='http://www.example.com',
+                                                creator=self.user,
+                                                campaign='Example')
+        self.key = base32_crockford.encode(self.shorturl.pk)
+        self.hit_worker = views.hit_worker
+        views.hit_worker = SynchronousWorker()
+
+    def tearDown(self):
+        views.hit_worker = self.hit_worker
+
+    def test_redirect(self):
+        """
+        A valid key should redirect to the target URL, and the hits
+        should be updated by the worker.
+        """
+        response = self.client.get(reverse('redirect', args=[self.key]))
+        self.assertRedirectsNoFollow(response, 'http://www.example.com')
+        self.assertInHeader(response, 'utm_campaign=example', 'location')
+        self.assertEqual(ShortURL.objects.get(pk=self.shorturl.pk).hits, 1)
+
+    def test_invalid_key(self):
+        """
+        An invalid key should return a 404 status.
+        """
+        response = self.client.get(reverse('redirect', args=['u']))
+        self.assertEqual(response.status_code, 404)
+
+
+class BackgroundWorkerTests(TestCase):
+    """
+    Tests for the background worker.
+    """
+    def test_submit(self):
+        """
+        Submitted callables should run on the worker thread, and a
+        failing callable should not stop the worker.
+        """
+        results = []
+        worker = BackgroundWorker('deflect-test')
+        worker.submit(lambda: 1 / 0)
+        worker.submit(results.append, 1)
+        worker.submit(results.append, 2)
+        worker.join()
+        self.assertEqual(results, [1, 2])
@@ -0,0 +1,9 @@
+from django.conf.urls import include
+from django.conf.urls import url
+from django.contrib import admin
+
+
+urlpatterns = [
+    url(r'^admin/', admin.site.urls),
+    url(r'^', include('deflect.urls')),
+]
@@ -1,10 +1,12 @@
 from django.conf.urls import url
 
+from .views import qr_code
 from .views import redirect
 
 
 app_name = 'deflect'
 
 urlpatterns = [
+    url(r'^(?P<key>[a-zA-Z0-9-]+)\.(?P<format>png|svg)$', qr_code, name='qr_code'),
     url(r'^(?P<key>[a-zA-Z0-9-]+)$', redirect, name='redirect'),
 ]
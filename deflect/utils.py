@@ -1,7 +1,9 @@
 import base64
-from cStringIO import StringIO
+from collections import namedtuple
+from io import BytesIO
 
 import qrcode
+import qrcode.image.svg
 
 from .compat import parse_qsl
 from .compat import urlencode
@@ -9,29 +11,121 @@ from .compat import urlparse
 from .compat import urlunparse
 
 
-def add_query_params(url, params):
+# Ordered so that more specific tokens are matched first, as most
+# browsers include the tokens of the browsers they are derived from
+USER_AGENT_FAMILIES = (
+    ('bot', 'Bot'),
+    ('spider', 'Bot'),
+    ('crawl', 'Bot'),
+    ('edge/', 'Edge'),
+    ('edg/', 'Edge'),
+    ('opr/', 'Opera'),
+    ('opera', 'Opera'),
+    ('chrome/', 'Chrome'),
+    ('crios/', 'Chrome'),
+    ('firefox/', 'Firefox'),
+    ('fxios/', 'Firefox'),
+    ('msie ', 'IE'),
+    ('trident/', 'IE'),
+    ('safari/', 'Safari'),
+)
+
+URLTemplate = namedtuple('URLTemplate', ['parts', 'query', 'params', 'url'])
+
+
+def compile_url(url, params=None):
     """
-    Inject additional query parameters into an existing URL. If
-    parameters already exist with the same name, they will be
-    overwritten. Return the modified URL as a string.
+    Parse a URL once, so it can be rendered repeatedly with varying
+    query parameters by ``render_url``. The provided parameters are
+    included in every rendered URL, overriding any parameters with
+    the same name. Return a ``URLTemplate``.
     """
     # Ignore additional parameters with empty values
-    params = dict([(k, v) for k, v in params.items() if v])
+    params = dict([(k, v) for k, v in (params or {}).items() if v])
     parts = list(urlparse(url))
     query = dict(parse_qsl(parts[4]))
+    merged = dict(query)
+    merged.update(params)
+    parts[4] = urlencode(merged)
+    return URLTemplate(tuple(parts), query, params, urlunparse(parts))
+
+
+def render_url(template, params=None):
+    """
+    Return the URL for a ``URLTemplate`` with additional query
+    parameters injected. Parameters already in the URL are
+    overwritten, but the template's own parameters take precedence.
+    """
+    params = dict([(k, v) for k, v in (params or {}).items() if v])
+    if not params:
+        return template.url
+    query = dict(template.query)
     query.update(params)
+    query.update(template.params)
+    parts = list(template.parts)
     parts[4] = urlencode(query)
     return urlunparse(parts)
 
 
+def normalize_url(url):
+    """
+    Return a normalized form of a URL, for comparing URLs that differ
+    only in the case of the scheme and host, an explicit default
+    port, an empty path or a fragment.
+    """
+    parts = list(urlparse(url))
+    parts[0] = parts[0].lower()
+    parts[1] = parts[1].lower()
+    default_port = {'http': ':80', 'https': ':443'}.get(parts[0])
+    if default_port and parts[1].endswith(default_port):
+        parts[1] = parts[1][:-len(default_port)]
+    parts[2] = parts[2] or '/'
+    parts[5] = ''
+    return urlunparse(parts)
+
+
+def add_query_params(url, params):
+    """
+    Inject additional query parameters into an existing URL. If
+    parameters already exist with the same name, they will be
+    overwritten. Return the modified URL as a string.
+    """
+    return render_url(compile_url(url), params)
+
+
+def get_user_agent_family(user_agent):
+    """
+    Return the browser family for a User-Agent header, or an empty
+    string if no User-Agent was provided.
+    """
+    user_agent = user_agent.lower()
+    for token, family in USER_AGENT_FAMILIES:
+        if token in user_agent:
+            return family
+    return 'Other' if user_agent else ''
+
+
+QR_CODE_FORMATS = {
+    'png': ('image/png', None),
+    'svg': ('image/svg+xml', qrcode.image.svg.SvgPathImage),
+}
+
+
+def get_qr_code(url, format='png', box_size=10):
+    """
+    Return the provided URL as a QR code image in the given format,
+    where ``box_size`` is the size of each QR code module in pixels.
+    """
+    stream = BytesIO()
+    img = qrcode.make(url, box_size=box_size, image_factory=QR_CODE_FORMATS[format][1])
+    img.save(stream)
+    return stream.getvalue()
+
+
 def get_qr_code_img(url):
     """
     Return an HTML img tag containing an inline base64 encoded
     representation of the provided URL as a QR code.
     """
-    png_stream = StringIO()
-    img = qrcode.make(url)
-    img.save(png_stream)
-    png_base64 = base64.b64encode(png_stream.getvalue())
-    png_stream.close()
+    png_base64 = base64.b64encode(get_qr_code(url)).decode('ascii')
     return '<img src="data:image/png;base64,%s" />' % png_base64
@@ -1,40 +1,207 @@
 from __future__ import unicode_literals
 
 import base32_crockford
+import hashlib
 import logging
 
+from django.conf import settings
+from django.core.cache import caches
 from django.http import Http404
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
 from django.http import HttpResponsePermanentRedirect
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
 
+from .bloom import redirect_filter
+from .cache import redirect_cache
+from .events import record_click
+from .index import redirect_index
+from .metrics import metrics
+from .metrics import render_prometheus
 from .models import ShortURL
 from .models import ShortURLAlias
+from .routers import get_read_db
+from .routers import get_write_db
+from .tasks import BackgroundWorker
+from .utils import QR_CODE_FORMATS
+from .utils import get_qr_code
 
 
 logger = logging.getLogger(__name__)
 
+hit_worker = BackgroundWorker('deflect-hits')
 
-def redirect(request, key):
+# The largest primary key supported by the database backends
+MAX_KEY_ID = 2 ** 63 - 1
+
+ALIAS_MAX_LENGTH = ShortURLAlias._meta.get_field('alias').max_length
+
+
+def get_redirect_or_404(key):
     """
-    Given the short URL key, update the statistics and redirect the
-    user to the destination URL.
+    Return the ``ShortURL`` for a given short URL key or alias,
+    using the redirect cache and index when available. Raise
+    ``Http404`` if no matching ``ShortURL`` exists.
     """
+    data = redirect_cache.get(key)
+    if data is not None:
+        metrics.increment('redirect_cache_total', result='hit')
+        return ShortURL.from_redirect_data(data)
+    if redirect_cache.enabled:
+        metrics.increment('redirect_cache_total', result='miss')
+    if redirect_index.enabled:
+        data = redirect_index.get(key)
+        metrics.increment('redirect_index_total', result='hit' if data is not None else 'miss')
+        if data is not None:
+            return ShortURL.from_redirect_data(data)
+    if redirect_filter.is_missing(key):
+        metrics.increment('redirect_not_found_total')
+        raise Http404
+
+    try:
+        redirect, canonical = _get_redirect(key)
+    except Http404:
+        metrics.increment('redirect_not_found_total')
+        redirect_filter.add_miss(key)
+        raise
+
+    # Only cache the canonical form of a key, so that changes to a
+    # ``ShortURL`` can invalidate every cached entry
+    if key.lower() == canonical.lower():
+        redirect_cache.set(key, redirect.get_redirect_data())
+    return redirect
+
+
+def _get_redirect(key):
+    """
+    Query the ``ShortURL`` for a given short URL key or alias, from a
+    read replica if one is configured. Return the ``ShortURL`` and the
+    canonical form of the key.
+    """
+    read_db = get_read_db()
+    try:
+        return _query_redirect(key, read_db)
+    except Http404:
+        # A short URL saved moments ago may not have reached the
+        # replica yet, so check the primary before giving up
+        if read_db is None or read_db == get_write_db() or not _is_valid_key(key):
+            raise
+        metrics.increment('redirect_replica_miss_total')
+        return _query_redirect(key, get_write_db())
+
+
+def _is_valid_key(key):
+    """
+    Return ``True`` if a key could be an alias or decodes to a valid
+    ``ShortURL`` id.
+    """
+    if len(key) <= ALIAS_MAX_LENGTH:
+        return True
+    try:
+        return base32_crockford.decode(key) <= MAX_KEY_ID
+    except ValueError:
+        return False
+
+
+def _query_redirect(key, using):
     try:
-        alias = ShortURLAlias.objects.get(alias=key.lower())
-        key_id = alias.redirect_id
+        with metrics.timer('redirect_phase_seconds', phase='alias_lookup'):
+            alias = ShortURLAlias.objects.using(using).select_related('redirect').get(alias=key.lower())
+        redirect = alias.redirect
+        canonical = alias.alias
     except ShortURLAlias.DoesNotExist:
         try:
-            key_id = base32_crockford.decode(key)
+            with metrics.timer('redirect_phase_seconds', phase='key_decode'):
+                key_id = base32_crockford.decode(key)
         except ValueError as e:
             logger.warning("Error decoding redirect: %s" % e)
             raise Http404
+        # Keys too long to be a primary key cannot exist
+        if key_id > MAX_KEY_ID:
+            raise Http404
+        with metrics.timer('redirect_phase_seconds', phase='fetch'):
+            redirect = get_object_or_404(ShortURL.objects.using(using), pk=key_id)
+        canonical = redirect.key
+    return redirect, canonical
+
+
+def _redirect_response(request, redirect):
+    with metrics.timer('redirect_phase_seconds', phase='url_build'):
+        params = request.GET.dict() if request.META.get('QUERY_STRING') else None
+        if redirect.is_tracking:
+            return HttpResponsePermanentRedirect(redirect.target_url(params=params))
+        else:
+            return HttpResponseRedirect(redirect.target_url(params=params))
 
-    redirect = get_object_or_404(ShortURL, pk=key_id)
-    ShortURL.objects.increment_hits(redirect.pk)
-    params = request.GET.dict()
 
-    if redirect.is_tracking:
-        return HttpResponsePermanentRedirect(redirect.target_url(params=params))
+def redirect(request, key):
+    """
+    Given the short URL key, update the statistics and redirect the
+    user to the destination URL.
+    """
+    with metrics.timer('redirect_seconds'):
+        redirect = get_redirect_or_404(key)
+        with metrics.timer('redirect_phase_seconds', phase='hit_update'):
+            ShortURL.objects.increment_hits(redirect.pk)
+        record_click(request, redirect)
+        return _redirect_response(request, redirect)
+
+
+def deferred_redirect(request, key):
+    """
+    Given the short URL key, redirect the user to the destination
+    URL. The statistics are updated on a background thread, so the
+    database write is not included in the redirect latency.
+    """
+    with metrics.timer('redirect_seconds'):
+        redirect = get_redirect_or_404(key)
+        with metrics.timer('redirect_phase_seconds', phase='hit_update'):
+            hit_worker.submit(ShortURL.objects.increment_hits, redirect.pk)
+        record_click(request, redirect)
+        return _redirect_response(request, redirect)
+
+
+def qr_code(request, key, format):
+    """
+    Return the short URL as a QR code image in PNG or SVG format. The
+    size of each QR code module in pixels can be set with the ``size``
+    query parameter. Rendered images are cached by their content, and
+    can be cached by clients and proxies.
+    """
+    redirect = get_redirect_or_404(key)
+    try:
+        size = int(request.GET.get('size', 10))
+    except ValueError:
+        raise Http404
+    size = max(1, min(size, 40))
+    url = redirect.short_url(alias=False)
+    etag = '"%s"' % hashlib.sha1(('%s:%s:%d' % (url, format, size)).encode('utf-8')).hexdigest()
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
     else:
-        return HttpResponseRedirect(redirect.target_url(params=params))
+        cache = caches[getattr(settings, 'DEFLECT_QR_CACHE_BACKEND', 'default')]
+        cache_key = 'deflect:qr:%s' % etag.strip('"')
+        image = cache.get(cache_key)
+        if image is None:
+            image = get_qr_code(url, format=format, box_size=size)
+            cache.set(cache_key, image, None)
+        response = HttpResponse(image, content_type=QR_CODE_FORMATS[format][0])
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=getattr(settings, 'DEFLECT_QR_MAX_AGE', 86400))
+    return response
+
+
+def metrics_view(request):
+    """
+    Return the metrics collected by this process in the Prometheus
+    text format, including the redirect filter counters. Return a 404
+    status if metrics are not enabled.
+    """
+    if not metrics.enabled:
+        raise Http404
+    output = render_prometheus(metrics)
+    for name, value in sorted(redirect_filter.stats().items()):
+        output += '# TYPE deflect_%s_total counter\ndeflect_%s_total %d\n' % (name, name, value)
+    return HttpResponse(output, content_type='text/plain; version=0.0.4; charset=utf-8')